@@ -1,15 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
 import os
 import sys
 import json
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from chatbot import MiraMusicRecommendationBot
+from mylogger import log_body
+from conversation_store import DEFAULT_SESSION
+from openai_utils import completion_flights, get_openai_client
+import openai_utils
+import prefork
+import metrics
+from metrics import stage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Routed through the queued "hoopr" pipeline set up in mylogger
+logger = logging.getLogger("hoopr.app")
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -17,12 +27,28 @@ CORS(app)  # Enable CORS for all routes
 # Global bot instance
 bot = None
 
+DEFAULT_JSON_FILE_PATH = r"C:\Users\AAAA\Desktop\chatbot\chatbot-be\hoopr_data_v2.json"
+
+# Catalog reloads run on one background worker so /init never blocks a request thread
+reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-reload")
+reload_lock = threading.Lock()
+MAX_BATCH_ITEMS = int(os.getenv("MIRA_BATCH_MAX_ITEMS", "500"))
+reload_status = {
+    "state": "idle",
+    "stage": None,
+    "tracks_processed": 0,
+    "json_file_path": None,
+    "started_at": None,
+    "finished_at": None,
+    "error": None
+}
+
 def initialize_bot(json_file_path=None):
     """Initialize the MIRA bot with tracks data"""
     global bot
     
     if json_file_path is None:
-        json_file_path = r"C:\Users\AAAA\Desktop\chatbot\chatbot-be\hoopr_data_v2.json"
+        json_file_path = DEFAULT_JSON_FILE_PATH
     
     try:
         if not os.path.exists(json_file_path):
@@ -40,6 +66,193 @@ def initialize_bot(json_file_path=None):
         logger.error(f"Failed to initialize MIRA bot: {e}")
         return False
 
+def flush_writes():
+    """Commit the conversation log's and completion cache's queued writes (pre-forked workers skip atexit)"""
+    if bot is not None and bot.conversations.log is not None:
+        bot.conversations.log.close()
+    if openai_utils.completion_cache is not None:
+        openai_utils.completion_cache.close()
+
+def warm_up():
+    """Run the request path once without calling the model or recording a turn
+
+    Pre-forked workers then inherit the imported modules, the client and a
+    warm retrieval path from the parent instead of each building its own.
+    Nothing here may start a background thread (a recorded exchange would
+    start the summarizer's): forked workers inherit such threads dead.
+    """
+    session_id = "prefork-warmup"
+    get_openai_client().responses
+    with app.test_client() as client:
+        client.get('/health')
+        # Rejected before it reaches the bot, but it warms request parsing and the error path
+        client.post('/chat', json={"message": "", "session_id": session_id})
+    bot.router.classify("hi")
+    bot._build_prompt("upbeat music for a reel", session_id)
+    bot.conversations.reset(session_id)
+
+def update_reload_status(**changes):
+    with reload_lock:
+        reload_status.update(changes)
+
+def reload_catalog(json_file_path):
+    """Background job: build the new catalog and index, then swap it into the running bot"""
+    def progress(stage, tracks_processed):
+        update_reload_status(stage=stage, tracks_processed=tracks_processed)
+    
+    try:
+        if not os.path.exists(json_file_path):
+            raise FileNotFoundError(f"JSON file not found: {json_file_path}")
+        
+        if bot is None:
+            if not initialize_bot(json_file_path):
+                raise RuntimeError("Failed to initialize bot. Check server logs for details.")
+        else:
+            bot.reload_catalog(json_file_path, progress=progress)
+        
+        update_reload_status(state="completed", stage="loaded", finished_at=time.time(),
+                             tracks_processed=len(bot.tracks_data))
+        logger.info(f"Catalog reload from {json_file_path} completed")
+    except Exception as e:
+        logger.error(f"Catalog reload from {json_file_path} failed: {e}")
+        update_reload_status(state="failed", finished_at=time.time(), error=str(e))
+
+def get_reload_status():
+    with reload_lock:
+        status = dict(reload_status)
+    status["catalog_version"] = bot.catalog_version if bot else None
+    status["tracks_loaded"] = len(bot.tracks_data) if bot else 0
+    return status
+
+# Serialized /stats aggregates for the current catalog version, rendered on first request
+_stats_body = (None, None)
+
+def stats_body(current_bot, catalog) -> str:
+    """The /stats JSON for `catalog`; catalogs are immutable, so only the timestamp is added per response"""
+    global _stats_body
+    version, body = _stats_body
+    if version != catalog.version or body is None:
+        body = json.dumps({
+            "success": True,
+            **catalog.stats.as_dict(),
+            "catalog_version": catalog.version,
+            "stats_text": current_bot.get_stats(catalog)
+        })
+        _stats_body = (catalog.version, body)
+    return f'{body[:-1]}, "timestamp": {int(time.time())}}}'
+
+def conversation_page_args(args):
+    """(before, limit) for paging /conversation: ?before=<cursor from the previous page>&limit=<turns, 1-200>"""
+    before = args.get('before', type=int)
+    limit = min(max(args.get('limit', 50, type=int), 1), 200)
+    return before, limit
+
+def conversation_page(conversations, session_id: str, before, limit: int) -> dict:
+    """JSON body for one page of a session's history"""
+    turns, next_cursor = conversations.page(session_id, before, limit)
+    return {
+        "success": True,
+        "session_id": session_id,
+        "conversation": [{
+            "id": turn["id"],
+            "role": turn["role"],
+            "message": turn["message"],
+            "timestamp": turn["created_at"],
+            "latency_ms": turn["latency_ms"]
+        } for turn in turns],
+        "length": len(turns),
+        "next_cursor": next_cursor,
+        "max_length": conversations.max_turns,
+        "timestamp": int(time.time())
+    }
+
+def get_session_id(data=None):
+    """Resolve the conversation session id from the body, query string or X-Session-Id header"""
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if not session_id:
+        session_id = request.args.get('session_id') or request.headers.get('X-Session-Id')
+    return str(session_id) if session_id else DEFAULT_SESSION
+
+def sse_event(payload, event=None):
+    """Format a payload as one Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return f"{message}data: {json.dumps(payload)}\n\n"
+
+def ndjson_line(payload):
+    """Format a payload as one newline-delimited JSON record"""
+    return json.dumps(payload) + "\n"
+
+def parse_batch(data):
+    """(ids, messages) from a /chat/batch body; raises ValueError describing the first bad item
+
+    Items are strings or {"id": ..., "message": ...}; ids default to the item's position.
+    """
+    items = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("'messages' must be a non-empty list")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"A batch holds at most {MAX_BATCH_ITEMS} messages")
+
+    ids, messages = [], []
+    for index, item in enumerate(items):
+        item_id, message = index, item
+        if isinstance(item, dict):
+            item_id, message = item.get('id', index), item.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise ValueError(f"Item {index} has no message")
+        ids.append(item_id)
+        messages.append(message.strip())
+    return ids, messages
+
+def batch_summary(results, started):
+    return {
+        "count": len(results),
+        "errors": sum(1 for result in results if result["error"]),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "timestamp": int(time.time())
+    }
+
+def stream_chat_response(user_message, session_id):
+    """Stream a MIRA reply as Server-Sent Events, one event per model chunk"""
+    current_bot = bot
+
+    def generate():
+        try:
+            for chunk in current_bot.chat_stream(user_message, session_id):
+                yield sse_event({"delta": chunk})
+            yield sse_event({
+                "success": True,
+                "bot_name": current_bot.bot_name,
+                "session_id": session_id,
+                "timestamp": int(time.time()),
+                "conversation_length": current_bot.conversations.length(session_id)
+            }, event="done")
+        except Exception as e:
+            logger.error(f"Error in streaming chat: {e}")
+            yield sse_event({"error": f"Internal server error: {str(e)}"}, event="error")
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def finish_request_timing(response):
+    """Record request latency and, when enabled, attach the Server-Timing header"""
+    started = g.get('request_started')
+    if started is not None and metrics.enabled:
+        elapsed = time.perf_counter() - started
+        metrics.request_seconds.observe(elapsed, request.endpoint or "unmatched", str(response.status_code))
+        timing = metrics.server_timing_header(elapsed)
+        if timing:
+            response.headers["Server-Timing"] = timing
+    return response
+
 @app.route('/', methods=['GET'])
 def home():
     """Home endpoint with API information"""
@@ -50,12 +263,16 @@ def home():
         "endpoints": {
             "health": "GET /health - Check server health",
             "chat": "POST /chat - Send messages to MIRA",
+            "chat_stream": "POST /chat/stream (or /chat with stream: true) - Stream MIRA's reply as Server-Sent Events",
+            "metrics": "GET /metrics - Prometheus metrics (per-stage latency, sizes, cache and upstream counters)",
+            "chat_batch": "POST /chat/batch - Answer many independent messages in parallel (stream: true for NDJSON)",
             "stats": "GET /stats - Get track statistics", 
-            "reset": "POST /reset - Reset conversation",
-            "conversation": "GET /conversation - Get conversation history",
-            "init": "POST /init - Reinitialize bot"
+            "reset": "POST /reset - Reset conversation (optional session_id)",
+            "conversation": "GET /conversation?session_id=...&limit=50&before=<next_cursor> - Get conversation history, a page at a time",
+            "init": "POST /init - Reload the track catalog in the background",
+            "init_status": "GET /init/status - Progress of the latest catalog reload"
         },
-        "example_curl": "curl -X POST http://localhost:5000/chat -H 'Content-Type: application/json' -d '{\"message\": \"I need music for my video\"}'"
+        "example_curl": "curl -X POST http://localhost:5000/chat -H 'Content-Type: application/json' -d '{\"message\": \"I need music for my video\", \"session_id\": \"user-123\"}'"
     })
 
 @app.route('/health', methods=['GET'])
@@ -70,11 +287,19 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "bot_name": bot.bot_name,
-        "tracks_loaded": len(bot.tracks_data) if bot.tracks_data else 0,
+        "tracks_loaded": bot.catalog.stats.total,
+        "catalog_version": bot.catalog_version,
+        "singleflight": completion_flights.stats() if completion_flights else None,
         "server_time": int(time.time())
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of the request, stage, cache and upstream metrics"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/chat', methods=['POST'])
+@app.route('/chat/stream', methods=['POST'])
 def chat():
     """Main chat endpoint for music recommendations and conversations"""
     if bot is None:
@@ -100,20 +325,27 @@ def chat():
                 "example": {"message": "I need upbeat music for Instagram reels"}
             }), 400
         
+        session_id = get_session_id(data)
+        
         # Log the request
-        logger.info(f"Chat request: {user_message}")
+        logger.info(f"Chat request [{session_id}]: {log_body(user_message)}")
+        
+        if request.path == '/chat/stream' or data.get('stream'):
+            return stream_chat_response(user_message, session_id)
         
         # Get bot response
-        response = bot.chat(user_message)
+        response = bot.chat(user_message, session_id)
         
-        return jsonify({
-            "success": True,
-            "user_message": user_message,
-            "bot_response": response,
-            "bot_name": bot.bot_name,
-            "timestamp": int(time.time()),
-            "conversation_length": len(bot.conversation)
-        })
+        with stage("serialize"):
+            return jsonify({
+                "success": True,
+                "user_message": user_message,
+                "bot_response": response,
+                "bot_name": bot.bot_name,
+                "session_id": session_id,
+                "timestamp": int(time.time()),
+                "conversation_length": bot.conversations.length(session_id)
+            })
         
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
@@ -121,6 +353,52 @@ def chat():
             "error": f"Internal server error: {str(e)}"
         }), 500
 
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer a batch of independent messages, as one JSON document or NDJSON as items complete"""
+    if bot is None:
+        return jsonify({
+            "error": "Bot not initialized. Please restart the server or call /init endpoint."
+        }), 503
+
+    data = request.get_json(silent=True)
+    try:
+        ids, messages = parse_batch(data)
+    except ValueError as e:
+        return jsonify({
+            "error": str(e),
+            "example": {"messages": ["upbeat music for a gym reel", {"id": "brief-7", "message": "calm piano for a spa ad"}]}
+        }), 400
+
+    logger.info(f"Batch chat request: {len(messages)} messages")
+    current_bot = bot
+    started = time.perf_counter()
+
+    if data.get('stream'):
+        def generate():
+            results = []
+            for result in current_bot.chat_batch(messages):
+                result["id"] = ids[result["index"]]
+                results.append(result)
+                yield ndjson_line(result)
+            yield ndjson_line({"done": True, **batch_summary(results, started)})
+
+        return Response(generate(), mimetype='application/x-ndjson', headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+
+    results = [None] * len(messages)
+    for result in current_bot.chat_batch(messages):
+        result["id"] = ids[result["index"]]
+        results[result["index"]] = result
+    with stage("serialize"):
+        return jsonify({
+            "success": True,
+            "results": results,
+            **batch_summary(results, started)
+        })
+
 @app.route('/reset', methods=['POST'])
 def reset_conversation():
     """Reset the conversation history"""
@@ -130,11 +408,13 @@ def reset_conversation():
         }), 503
     
     try:
-        bot.reset()
-        logger.info("Conversation history reset")
+        session_id = get_session_id(request.get_json(silent=True))
+        bot.reset(session_id)
+        logger.info(f"Conversation history reset for session {session_id}")
         return jsonify({
             "success": True,
             "message": "Conversation history reset successfully",
+            "session_id": session_id,
             "timestamp": int(time.time())
         })
     except Exception as e:
@@ -152,23 +432,17 @@ def get_stats():
         }), 503
     
     try:
-        stats_text = bot.get_stats()
-        
-        # Parse stats for structured response
-        total_tracks = len(bot.tracks_data) if bot.tracks_data else 0
-        with_vocals = sum(1 for track in bot.tracks_data if track.get('hasVocals', '').lower() in ['true', '1', 'yes'])
-        explicit = sum(1 for track in bot.tracks_data if track.get('isExplicit', '').lower() in ['true', '1', 'yes'])
-        
-        return jsonify({
-            "success": True,
-            "total_tracks": total_tracks,
-            "tracks_with_vocals": with_vocals,
-            "explicit_tracks": explicit,
-            "non_explicit_tracks": total_tracks - explicit,
-            "instrumental_tracks": total_tracks - with_vocals,
-            "stats_text": stats_text,
-            "timestamp": int(time.time())
-        })
+        # Aggregates are precomputed per catalog, so the ETag (and the rendered body) only change with the catalog;
+        # one reference keeps a concurrent reload from pairing this ETag with another catalog's body
+        catalog = bot.catalog
+        etag = catalog.version
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(stats_body(bot, catalog), mimetype="application/json")
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
         
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
@@ -178,28 +452,16 @@ def get_stats():
 
 @app.route('/conversation', methods=['GET'])
 def get_conversation():
-    """Get current conversation history"""
+    """Get one page of the conversation history, newest first; follow next_cursor with ?before= for older turns"""
     if bot is None:
         return jsonify({
             "error": "Bot not initialized"
         }), 503
     
     try:
-        conversation = []
-        for role, message in bot.conversation:
-            conversation.append({
-                "role": role,
-                "message": message,
-                "timestamp": int(time.time())  # In real implementation, store actual timestamps
-            })
-        
-        return jsonify({
-            "success": True,
-            "conversation": conversation,
-            "length": len(bot.conversation),
-            "max_length": 20,  # From the bot's conversation limit
-            "timestamp": int(time.time())
-        })
+        session_id = get_session_id()
+        before, limit = conversation_page_args(request.args)
+        return jsonify(conversation_page(bot.conversations, session_id, before, limit))
         
     except Exception as e:
         logger.error(f"Error getting conversation: {e}")
@@ -209,26 +471,52 @@ def get_conversation():
 
 @app.route('/init', methods=['POST'])
 def initialize():
-    """Initialize or reinitialize the bot with a different JSON file"""
+    """Start a background reload of the track catalog, optionally from a different JSON file"""
     try:
-        data = request.get_json()
-        json_file_path = data.get('json_file_path') if data else None
-        
-        logger.info(f"Reinitializing bot with file: {json_file_path or 'default'}")
-        success = initialize_bot(json_file_path)
+        data = request.get_json(silent=True)
+        json_file_path = (data.get('json_file_path') if data else None) or DEFAULT_JSON_FILE_PATH
         
-        if success:
+        # Pre-forked workers share the parent's catalog: the parent reloads it and replaces every worker
+        if prefork.in_worker():
+            if not os.path.exists(json_file_path):
+                return jsonify({
+                    "error": f"JSON file not found: {json_file_path}"
+                }), 400
+            prefork.request_reload(json_file_path)
+            logger.info(f"Forwarded catalog reload from {json_file_path} to the pre-fork parent")
             return jsonify({
                 "success": True,
-                "message": "Bot initialized successfully",
-                "tracks_loaded": len(bot.tracks_data),
-                "bot_name": bot.bot_name,
+                "message": "Catalog reload forwarded to the parent; workers are replaced once it completes",
+                "reload": {"state": "forwarded", "json_file_path": json_file_path},
                 "timestamp": int(time.time())
+            }), 202
+        
+        with reload_lock:
+            if reload_status["state"] == "running":
+                return jsonify({
+                    "error": "A catalog reload is already in progress",
+                    "reload": dict(reload_status)
+                }), 409
+            reload_status.update({
+                "state": "running",
+                "stage": "queued",
+                "tracks_processed": 0,
+                "json_file_path": json_file_path,
+                "started_at": time.time(),
+                "finished_at": None,
+                "error": None
             })
-        else:
-            return jsonify({
-                "error": "Failed to initialize bot. Check server logs for details."
-            }), 500
+        
+        logger.info(f"Reloading catalog in the background from: {json_file_path}")
+        reload_executor.submit(reload_catalog, json_file_path)
+        
+        return jsonify({
+            "success": True,
+            "message": "Catalog reload started; the current catalog keeps serving until it completes",
+            "status_url": "/init/status",
+            "reload": get_reload_status(),
+            "timestamp": int(time.time())
+        }), 202
             
     except Exception as e:
         logger.error(f"Error initializing bot: {e}")
@@ -236,6 +524,15 @@ def initialize():
             "error": f"Initialization failed: {str(e)}"
         }), 500
 
+@app.route('/init/status', methods=['GET'])
+def initialize_status():
+    """Progress of the latest catalog reload"""
+    return jsonify({
+        "success": True,
+        "reload": get_reload_status(),
+        "timestamp": int(time.time())
+    })
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
@@ -246,10 +543,12 @@ def not_found(error):
             "GET /": "API information",
             "GET /health": "Server health check",
             "POST /chat": "Send messages to MIRA",
+            "POST /chat/stream": "Stream MIRA's reply as Server-Sent Events",
             "POST /reset": "Reset conversation history",
             "GET /stats": "Get track statistics",
             "GET /conversation": "Get conversation history",
-            "POST /init": "Reinitialize bot"
+            "POST /init": "Reload the track catalog in the background",
+            "GET /init/status": "Progress of the latest catalog reload"
         }
     }), 404
 
@@ -306,6 +605,14 @@ if __name__ == '__main__':
         # print("=" * 50)/
         print("sucessful")
         
+        # MIRA_WORKERS > 1: serve from pre-forked workers sharing this process's catalog (see prefork.py)
+        workers = int(os.getenv("MIRA_WORKERS", "1"))
+        if workers > 1:
+            from prefork import serve
+            serve(app, workers, host='0.0.0.0', port=5000, warm_up=warm_up, on_exit=flush_writes,
+                  reload=lambda requested=None: bot.reload_catalog(requested or json_file or DEFAULT_JSON_FILE_PATH))
+            sys.exit(0)
+        
         # Start Flask server
         app.run(
             host='0.0.0.0',  # Allow external connections
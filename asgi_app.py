@@ -0,0 +1,353 @@
+from quart import Quart, request, jsonify, Response, g
+from quart_cors import cors
+import asyncio
+import os
+import sys
+import time
+import logging
+import app as wsgi
+from app import sse_event, ndjson_line, parse_batch, batch_summary, get_reload_status, reload_catalog, reload_lock, reload_status, reload_executor
+from app import conversation_page_args, conversation_page, stats_body
+from conversation_store import DEFAULT_SESSION
+from mylogger import log_body
+from llm_limiter import Overloaded
+from openai_utils import llm_limiter, request_deadline, completion_flights
+import metrics
+from metrics import stage
+
+# asyncio serving mode for the same API as app.py: chats wait on the model without
+# holding a thread each, upstream calls are capped by llm_limiter, and excess load
+# is shed with 429/503 + Retry-After. The bot and reload state are shared with app.py.
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+#
+# MIRA_JSON_FILE_PATH selects the catalog when started by an ASGI server.
+# Batch items each get MIRA_REQUEST_DEADLINE from when they start; MIRA_BATCH_DEADLINE (seconds, 0 = none)
+# caps a whole batch.
+batch_deadline = float(os.getenv("MIRA_BATCH_DEADLINE", "0"))
+
+# Routed through the queued "hoopr" pipeline set up in mylogger
+logger = logging.getLogger("hoopr.asgi")
+
+app = cors(Quart(__name__))
+
+
+def get_session_id(data=None):
+    """Resolve the conversation session id from the body, query string or X-Session-Id header"""
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if not session_id:
+        session_id = request.args.get('session_id') or request.headers.get('X-Session-Id')
+    return str(session_id) if session_id else DEFAULT_SESSION
+
+def shed_response(error: Overloaded):
+    """429/503 with Retry-After for a request that was shed instead of served"""
+    return jsonify({
+        "error": str(error),
+        "retry_after": error.retry_after
+    }), error.status_code, {"Retry-After": str(error.retry_after)}
+
+def bot_not_initialized():
+    return jsonify({
+        "error": "Bot not initialized. Please restart the server or call /init endpoint."
+    }), 503
+
+@app.before_serving
+async def load_bot():
+    """Load the catalog once when started directly by an ASGI server"""
+    if wsgi.bot is None:
+        json_file_path = os.getenv("MIRA_JSON_FILE_PATH", wsgi.DEFAULT_JSON_FILE_PATH)
+        if not wsgi.initialize_bot(json_file_path):
+            logger.error("MIRA bot is not initialized; POST /init to load a catalog")
+
+def stream_chat_response(user_message, session_id, deadline):
+    """Stream a MIRA reply as Server-Sent Events from the async bot"""
+    current_bot = wsgi.bot
+
+    async def generate():
+        try:
+            async for chunk in current_bot.chat_stream_async(user_message, session_id, deadline):
+                yield sse_event({"delta": chunk})
+            yield sse_event({
+                "success": True,
+                "bot_name": current_bot.bot_name,
+                "session_id": session_id,
+                "timestamp": int(time.time()),
+                "conversation_length": current_bot.conversations.length(session_id)
+            }, event="done")
+        except Overloaded as e:
+            yield sse_event({"error": str(e), "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            logger.error(f"Error in streaming chat: {e}")
+            yield sse_event({"error": f"Internal server error: {str(e)}"}, event="error")
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.before_request
+async def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+async def finish_request_timing(response):
+    """Record request latency and, when enabled, attach the Server-Timing header"""
+    started = g.get('request_started')
+    if started is not None and metrics.enabled:
+        elapsed = time.perf_counter() - started
+        metrics.request_seconds.observe(elapsed, request.endpoint or "unmatched", str(response.status_code))
+        timing = metrics.server_timing_header(elapsed)
+        if timing:
+            response.headers["Server-Timing"] = timing
+    return response
+
+@app.route('/', methods=['GET'])
+async def home():
+    """Home endpoint with API information"""
+    return jsonify({
+        "message": "🎵 MIRA - Hoopr Music Recommender API (async)",
+        "version": "1.0.0",
+        "status": "active" if wsgi.bot else "bot_not_initialized",
+        "endpoints": {
+            "health": "GET /health - Check server health and model queue",
+            "chat": "POST /chat - Send messages to MIRA",
+            "chat_stream": "POST /chat/stream (or /chat with stream: true) - Stream MIRA's reply as Server-Sent Events",
+            "metrics": "GET /metrics - Prometheus metrics (per-stage latency, sizes, cache and upstream counters)",
+            "chat_batch": "POST /chat/batch - Answer many independent messages in parallel (stream: true for NDJSON)",
+            "stats": "GET /stats - Get track statistics",
+            "reset": "POST /reset - Reset conversation (optional session_id)",
+            "conversation": "GET /conversation?session_id=...&limit=50&before=<next_cursor> - Get conversation history, a page at a time",
+            "init": "POST /init - Reload the track catalog in the background",
+            "init_status": "GET /init/status - Progress of the latest catalog reload"
+        }
+    })
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """Health check endpoint"""
+    bot = wsgi.bot
+    if bot is None:
+        return jsonify({
+            "status": "error",
+            "message": "Bot not initialized"
+        }), 503
+
+    return jsonify({
+        "status": "healthy",
+        "bot_name": bot.bot_name,
+        "tracks_loaded": bot.catalog.stats.total,
+        "catalog_version": bot.catalog_version,
+        "llm": llm_limiter.stats(),
+        "singleflight": completion_flights.stats() if completion_flights else None,
+        "server_time": int(time.time())
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    """Prometheus text exposition of the request, stage, cache and upstream metrics"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/chat', methods=['POST'])
+@app.route('/chat/stream', methods=['POST'])
+async def chat():
+    """Main chat endpoint; waits on the model asynchronously within the request deadline"""
+    bot = wsgi.bot
+    if bot is None:
+        return bot_not_initialized()
+
+    deadline = time.monotonic() + request_deadline
+    try:
+        data = await request.get_json(silent=True)
+
+        if not data or 'message' not in data:
+            return jsonify({
+                "error": "Missing 'message' field in request body",
+                "example": {"message": "I need music for my video"}
+            }), 400
+
+        user_message = data['message'].strip()
+
+        if not user_message:
+            return jsonify({
+                "error": "Message cannot be empty",
+                "example": {"message": "I need upbeat music for Instagram reels"}
+            }), 400
+
+        session_id = get_session_id(data)
+        logger.info(f"Chat request [{session_id}]: {log_body(user_message)}")
+
+        if request.path == '/chat/stream' or data.get('stream'):
+            # Shed before the 200 and event-stream headers go out
+            llm_limiter.admit()
+            return stream_chat_response(user_message, session_id, deadline)
+
+        response = await bot.chat_async(user_message, session_id, deadline)
+
+        with stage("serialize"):
+            return jsonify({
+                "success": True,
+                "user_message": user_message,
+                "bot_response": response,
+                "bot_name": bot.bot_name,
+                "session_id": session_id,
+                "timestamp": int(time.time()),
+                "conversation_length": bot.conversations.length(session_id)
+            })
+
+    except Overloaded as e:
+        logger.warning(f"Shedding chat request: {e}")
+        return shed_response(e)
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {e}")
+        return jsonify({
+            "error": f"Internal server error: {str(e)}"
+        }), 500
+
+@app.route('/chat/batch', methods=['POST'])
+async def chat_batch():
+    """Answer a batch of independent messages, as one JSON document or NDJSON as items complete"""
+    bot = wsgi.bot
+    if bot is None:
+        return bot_not_initialized()
+
+    deadline = time.monotonic() + batch_deadline if batch_deadline else None
+    data = await request.get_json(silent=True)
+    try:
+        ids, messages = parse_batch(data)
+    except ValueError as e:
+        return jsonify({
+            "error": str(e),
+            "example": {"messages": ["upbeat music for a gym reel", {"id": "brief-7", "message": "calm piano for a spa ad"}]}
+        }), 400
+
+    logger.info(f"Batch chat request: {len(messages)} messages")
+    started = time.perf_counter()
+
+    if data.get('stream'):
+        async def generate():
+            results = []
+            async for result in bot.chat_batch_async(messages, deadline):
+                result["id"] = ids[result["index"]]
+                results.append(result)
+                yield ndjson_line(result)
+            yield ndjson_line({"done": True, **batch_summary(results, started)})
+
+        return Response(generate(), mimetype='application/x-ndjson', headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+
+    results = [None] * len(messages)
+    async for result in bot.chat_batch_async(messages, deadline):
+        result["id"] = ids[result["index"]]
+        results[result["index"]] = result
+    with stage("serialize"):
+        return jsonify({
+            "success": True,
+            "results": results,
+            **batch_summary(results, started)
+        })
+
+@app.route('/reset', methods=['POST'])
+async def reset_conversation():
+    """Reset the conversation history"""
+    bot = wsgi.bot
+    if bot is None:
+        return bot_not_initialized()
+
+    session_id = get_session_id(await request.get_json(silent=True))
+    bot.reset(session_id)
+    return jsonify({
+        "success": True,
+        "message": "Conversation history reset successfully",
+        "session_id": session_id,
+        "timestamp": int(time.time())
+    })
+
+@app.route('/stats', methods=['GET'])
+async def get_stats():
+    """Get statistics about loaded tracks"""
+    bot = wsgi.bot
+    if bot is None:
+        return bot_not_initialized()
+
+    catalog = bot.catalog
+    etag = catalog.version
+    if request.if_none_match.contains_weak(etag):
+        response = Response("", status=304)
+    else:
+        response = Response(stats_body(bot, catalog), mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route('/conversation', methods=['GET'])
+async def get_conversation():
+    """Get one page of the conversation history, newest first; follow next_cursor with ?before= for older turns"""
+    bot = wsgi.bot
+    if bot is None:
+        return bot_not_initialized()
+
+    session_id = get_session_id()
+    before, limit = conversation_page_args(request.args)
+    # Paging may read the conversation log; keep it off the event loop
+    page = await asyncio.to_thread(conversation_page, bot.conversations, session_id, before, limit)
+    return jsonify(page)
+
+@app.route('/init', methods=['POST'])
+async def initialize():
+    """Start a background reload of the track catalog, optionally from a different JSON file"""
+    data = await request.get_json(silent=True)
+    json_file_path = (data.get('json_file_path') if data else None) or wsgi.DEFAULT_JSON_FILE_PATH
+
+    with reload_lock:
+        if reload_status["state"] == "running":
+            return jsonify({
+                "error": "A catalog reload is already in progress",
+                "reload": dict(reload_status)
+            }), 409
+        reload_status.update({
+            "state": "running",
+            "stage": "queued",
+            "tracks_processed": 0,
+            "json_file_path": json_file_path,
+            "started_at": time.time(),
+            "finished_at": None,
+            "error": None
+        })
+
+    logger.info(f"Reloading catalog in the background from: {json_file_path}")
+    reload_executor.submit(reload_catalog, json_file_path)
+    return jsonify({
+        "success": True,
+        "message": "Catalog reload started; the current catalog keeps serving until it completes",
+        "status_url": "/init/status",
+        "reload": get_reload_status(),
+        "timestamp": int(time.time())
+    }), 202
+
+@app.route('/init/status', methods=['GET'])
+async def initialize_status():
+    """Progress of the latest catalog reload"""
+    return jsonify({
+        "success": True,
+        "reload": get_reload_status(),
+        "timestamp": int(time.time())
+    })
+
+@app.errorhandler(404)
+async def not_found(error):
+    """Handle 404 errors"""
+    return jsonify({
+        "error": "Endpoint not found",
+        "message": "The requested endpoint does not exist"
+    }), 404
+
+if __name__ == '__main__':
+    import uvicorn
+
+    if len(sys.argv) > 1:
+        os.environ["MIRA_JSON_FILE_PATH"] = sys.argv[1]
+    print("MIRA async server starting...")
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv("PORT", "5000")))
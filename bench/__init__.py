@@ -0,0 +1 @@
+# Offline benchmark suite: python -m bench.gen_catalog | bench.micro | bench.stub_llm | bench.load | bench.compare
@@ -0,0 +1,141 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+DATA_DIR = os.path.join(ROOT, "bench", "data")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: list, scale: float = 1.0, digits: int = 3) -> dict:
+    """count / mean / p50 / p95 / p99 / max of timing samples, multiplied by scale"""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+
+    def fmt(value):
+        return round(value * scale, digits)
+
+    return {
+        "count": len(values),
+        "mean": fmt(sum(values) / len(values)),
+        "p50": fmt(percentile(values, 0.50)),
+        "p95": fmt(percentile(values, 0.95)),
+        "p99": fmt(percentile(values, 0.99)),
+        "max": fmt(values[-1]),
+    }
+
+
+def peak_rss_mb(pid: int = None) -> float:
+    """Peak resident set size in MiB of a process (this one by default), or None if unknown"""
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _child_pids(pid: int) -> list:
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def tree_pss_mb(pid: int) -> float:
+    """Proportional set size in MiB of a process and all its descendants (Linux), or None if unknown
+
+    Unlike RSS, pages shared between processes (e.g. a catalog shared by
+    pre-forked workers) are split between them instead of counted once each.
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            if current == pid:
+                return None
+            continue  # A child that exited meanwhile
+        pending.extend(_child_pids(current))
+    return round(total / 1024, 1)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def load_messages(path: str) -> list:
+    """Messages to replay from a JSONL file: each line's "message" (or "body"/"title" for backlog-style files)"""
+    messages = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            message = record.get("message") or record.get("body") or record.get("title")
+            if message:
+                messages.append(message)
+    return messages
+
+
+def save_results(kind: str, results: dict, output: str = None) -> str:
+    """Write results plus run metadata as JSON (bench/results/<kind>-<time>.json by default)"""
+    document = {
+        "kind": kind,
+        "timestamp": int(time.time()),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "argv": sys.argv[1:],
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    return output
@@ -0,0 +1,45 @@
+import argparse
+import json
+
+# Compare two results files from bench.micro or bench.load, metric by metric.
+#
+#   python -m bench.compare bench/results/load-before.json bench/results/load-after.json
+
+
+def flatten(value, prefix: str = "") -> dict:
+    """Numeric leaves of a results tree, keyed by dotted path"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, child in value.items():
+            flat.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(before: dict, after: dict) -> list:
+    """(metric, before, after, percent change) for metrics present in both runs"""
+    old, new = flatten(before["results"]), flatten(after["results"])
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else None
+        rows.append((metric, old[metric], new[metric], change))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--filter", default="", help="only metrics whose path contains this text (e.g. p99)")
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{before.get('git_revision')} -> {after.get('git_revision')}")
+    for metric, old, new, change in compare(before, after):
+        if args.filter in metric:
+            delta = f"{change:+.1f}%" if change is not None else "n/a"
+            print(f"{metric:<60} {old:>12} {new:>12} {delta:>9}")
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import random
+
+from bench.common import DATA_DIR
+
+# Synthetic catalog exports in the shapes the catalog loader accepts:
+#   array   - a top-level array of tracks with the export's field names
+#   object  - {"tracks": [...]} with the export's field names
+#   aliases - {"data": [...]} using the alternative field names (id, title, tempo, tags, ...)
+#
+#   python -m bench.gen_catalog 100000
+#   python -m bench.gen_catalog 1000000 --shape aliases --output /tmp/catalog-1m.json
+
+SHAPES = ("array", "object", "aliases")
+
+_WORDS = (
+    "sunset groove dream night city fire rain drive summer love party chill vibe dance gold neon wave ocean storm "
+    "heart road river sky morning shadow echo pulse velvet thunder spark bloom desert monsoon festival journey"
+).split()
+_TAGS = (
+    "Upbeat,Chill,Energetic,Romantic,Devotional,Lofi,EDM,Hip Hop,Acoustic,Cinematic,Corporate,Fitness,Travel,Festive,"
+    "Instrumental,Happy,Sad,Emotional,Motivational,Inspiring,Dark,Dreamy,Bollywood,Punjabi,Indie,Pop,Rock,Jazz,"
+    "Classical,Ambient,Piano,Guitar,Wedding,Diwali,Holi,Kids,Food,Fashion,Tech,Sports,Gaming,Nature,Vlog"
+).split(",")
+
+
+def make_track(index: int, rng: random.Random, shape: str) -> dict:
+    name = " ".join(rng.sample(_WORDS, rng.randint(1, 3))).title()
+    slug = name.lower().replace(" ", "-")
+    year = rng.randint(2015, 2025)
+    tags = ", ".join(rng.sample(_TAGS, rng.randint(2, 8)))
+    has_vocals = rng.random() < 0.55
+    explicit = rng.random() < 0.08
+    bpm = rng.randint(60, 180)
+    if shape == "aliases":
+        return {
+            "id": f"BT{index:08d}", "title": name, "tempo": str(bpm), "key": rng.choice("ABCDEFG"),
+            "release_date": f"{year}-{rng.randint(1, 12):02d}-01", "year": year,
+            "vocals": "yes" if has_vocals else "no", "slug": slug, "explicit": int(explicit), "tags": tags,
+        }
+    return {
+        "trackCode": f"BT{index:08d}", "name": name, "bpm": bpm, "songKey": rng.choice("ABCDEFG"),
+        "releaseDate": f"{year}-{rng.randint(1, 12):02d}-01", "releaseYear": year, "hasVocals": has_vocals,
+        "name_slug": slug, "isExplicit": explicit, "displayTags": tags,
+    }
+
+
+def generate(count: int, output: str, shape: str = "object", seed: int = 1) -> str:
+    """Write a synthetic catalog of `count` tracks, streaming so 1M tracks stay cheap to produce"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        if shape == "array":
+            f.write("[")
+        else:
+            f.write('{"source": "bench", "%s": [' % ("data" if shape == "aliases" else "tracks"))
+        for index in range(count):
+            if index:
+                f.write(",\n")
+            f.write(json.dumps(make_track(index, rng, shape)))
+        f.write("]" if shape == "array" else "]}")
+    return output
+
+
+def default_path(count: int, shape: str = "object") -> str:
+    return os.path.join(DATA_DIR, f"catalog-{count}-{shape}.json")
+
+
+def ensure_catalog(count: int, shape: str = "object") -> str:
+    """Path of a generated catalog, creating it on first use"""
+    path = default_path(count, shape)
+    if not os.path.exists(path):
+        generate(count, path, shape)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic MIRA catalog export")
+    parser.add_argument("count", type=int, help="number of tracks (e.g. 1000 to 1000000)")
+    parser.add_argument("--shape", choices=SHAPES, default="object")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="defaults to bench/data/catalog-<count>-<shape>.json")
+    args = parser.parse_args()
+    path = generate(args.count, args.output or default_path(args.count, args.shape), args.shape, args.seed)
+    print(f"Wrote {args.count} tracks to {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
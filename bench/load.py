@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import collections
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.common import ROOT, RESULTS_DIR, summarize, peak_rss_mb, tree_pss_mb, save_results, load_messages
+from bench.gen_catalog import ensure_catalog
+
+# End-to-end load generator: replays messages from a JSONL file against /chat.
+#
+# Against a running server:
+#   python -m bench.load --url http://127.0.0.1:5000 --concurrency 32 --requests 500
+#
+# Or let it start the stub LLM and a server (asgi, wsgi or prefork) on a synthetic catalog:
+#   python -m bench.load --spawn asgi --size 100000 --stub-latency 1.0 --concurrency 64 --requests 1000 --stream
+#
+# The completion cache is off in spawned servers so every request reaches the stub.
+
+SERVER_COMMANDS = {
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", "{port}", "--log-level", "warning", "--backlog", "2048"],
+    "wsgi": [sys.executable, "-c", "import app; app.initialize_bot(r'{catalog}') or exit(1); "
+                                   "app.app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    "prefork": [sys.executable, "prefork.py", "{catalog}", "--host", "127.0.0.1", "--port", "{port}"],
+}
+
+
+class Spawned:
+    """Stub LLM plus a MIRA server in child processes, torn down on exit"""
+
+    def __init__(self, kind: str, catalog: str, port: int, stub_port: int, stub_args: list, extra_env: dict):
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        self.log = open(os.path.join(RESULTS_DIR, f"server-{kind}.log"), "w")
+        self.stub = subprocess.Popen(
+            [sys.executable, "-m", "bench.stub_llm", "--port", str(stub_port)] + stub_args,
+            cwd=ROOT, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        # A fresh conversation log per run, so earlier runs' history never reaches the prompts
+        conversation_db = os.path.join(RESULTS_DIR, f"conversations-{kind}.sqlite3")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(conversation_db + suffix):
+                os.remove(conversation_db + suffix)
+        env = dict(os.environ)
+        env.update({
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+            "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "bench",
+            "MIRA_JSON_FILE_PATH": catalog,
+            "MIRA_COMPLETION_CACHE": "0",
+            "MIRA_CONVERSATION_DB": conversation_db,
+        })
+        env.update(extra_env)
+        command = [part.format(port=port, catalog=catalog) for part in SERVER_COMMANDS[kind]]
+        self.server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.stub_url = f"http://127.0.0.1:{stub_port}"
+
+    def close(self):
+        for process in (self.server, self.stub):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.log.close()
+
+
+def wait_until_healthy(url: str, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not become healthy within {timeout:.0f}s")
+
+
+async def run_load(url: str, messages: list, total: int, concurrency: int, stream: bool, timeout: float) -> dict:
+    latencies, first_bytes = [], []
+    statuses = collections.Counter()
+    errors = collections.Counter()
+    issued = 0
+
+    async def worker(client, worker_id):
+        nonlocal issued
+        session_id = f"bench-{worker_id}"
+        while issued < total:
+            message = messages[issued % len(messages)]
+            issued += 1
+            started = time.perf_counter()
+            try:
+                if stream:
+                    async with client.stream("POST", f"{url}/chat/stream", json={"message": message, "session_id": session_id}) as response:
+                        first = None
+                        async for _ in response.aiter_raw():
+                            if first is None:
+                                first = time.perf_counter() - started
+                        status = response.status_code
+                    if first is not None:
+                        first_bytes.append(first)
+                else:
+                    response = await client.post(f"{url}/chat", json={"message": message, "session_id": session_id})
+                    status = response.status_code
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] += 1
+                continue
+            statuses[status] += 1
+            if status < 400:
+                latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client, worker_id) for worker_id in range(concurrency)])
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "stream": stream,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(latencies) / wall, 2) if wall else None,
+        "status_counts": {str(status): count for status, count in sorted(statuses.items())},
+        "transport_errors": dict(errors),
+        "latency_ms": summarize(latencies, 1000, 1),
+        "first_byte_ms": summarize(first_bytes, 1000, 1) if stream else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay messages against /chat and report latency percentiles and throughput")
+    parser.add_argument("--url", help="server to load (omit with --spawn)")
+    parser.add_argument("--spawn", choices=sorted(SERVER_COMMANDS), help="start the stub LLM and this server locally")
+    parser.add_argument("--catalog", help="catalog for --spawn (default: a synthetic one of --size tracks)")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--stub-latency", type=float, default=1.0)
+    parser.add_argument("--stub-jitter", type=float, default=0.1)
+    parser.add_argument("--stub-chunks", type=int, default=20)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-model-latency", nargs="*", default=[], metavar="MODEL=SECONDS")
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE", help="extra environment for the spawned server")
+    parser.add_argument("--server-pid", type=int, help="report this process's peak RSS when using --url")
+    parser.add_argument("--messages", default=os.path.join(ROOT, "requests.jsonl"))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream and also report time to first byte")
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--output", help="results file (defaults to bench/results/load-<time>.json)")
+    args = parser.parse_args()
+    if not args.url and not args.spawn:
+        parser.error("pass --url or --spawn")
+
+    messages = load_messages(args.messages)
+    if not messages:
+        parser.error(f"no messages in {args.messages}")
+
+    spawned = None
+    url = args.url
+    server_pid = args.server_pid
+    try:
+        if args.spawn:
+            catalog = args.catalog or ensure_catalog(args.size)
+            stub_args = ["--latency", str(args.stub_latency), "--jitter", str(args.stub_jitter),
+                         "--chunks", str(args.stub_chunks), "--error-rate", str(args.stub_error_rate)]
+            if args.stub_model_latency:
+                stub_args += ["--model-latency"] + args.stub_model_latency
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            spawned = Spawned(args.spawn, catalog, args.port, args.stub_port, stub_args, extra_env)
+            url = f"http://127.0.0.1:{args.port}"
+            server_pid = spawned.server.pid
+        wait_until_healthy(url)
+
+        results = asyncio.run(run_load(url, messages, args.requests, args.concurrency, args.stream, args.timeout))
+        results["server"] = args.spawn or url
+        results["server_peak_rss_mb"] = peak_rss_mb(server_pid) if server_pid else None
+        # Whole process tree, so pre-forked workers are included and shared pages counted once
+        results["server_tree_pss_mb"] = tree_pss_mb(server_pid) if server_pid else None
+        results["loadgen_peak_rss_mb"] = peak_rss_mb()
+        if spawned is not None:
+            results["stub"] = httpx.get(spawned.stub_url, timeout=5).json()
+    finally:
+        if spawned is not None:
+            spawned.close()
+
+    latency = results["latency_ms"]
+    print(f"{results['requests_per_second']} req/s over {results['wall_seconds']}s; statuses {results['status_counts']}")
+    print(f"latency ms p50={latency.get('p50')} p95={latency.get('p95')} p99={latency.get('p99')}; "
+          f"server peak RSS {results['server_peak_rss_mb']} MiB, process tree PSS {results['server_tree_pss_mb']} MiB")
+    print(f"Results in {save_results('load', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import logging
+import time
+
+from bench.common import summarize, peak_rss_mb, save_results, load_messages
+from bench.gen_catalog import ensure_catalog
+from catalog_snapshot import load_catalog
+from chatbot import MiraMusicRecommendationBot
+
+# In-process microbenchmarks of the request hot path on synthetic catalogs.
+#
+#   python -m bench.micro --sizes 1000 100000
+#   python -m bench.micro --catalog my_export.json --modes bm25 tfidf
+#
+# "prompt" times _build_prompt, which replaced _build_tracks_context (track
+# selection, context fallback and budgeted prompt assembly).
+
+QUERIES = [
+    "upbeat music for my instagram reel", "chill lofi beats for a study vlog", "energetic edm for a gym ad 128 bpm",
+    "romantic bollywood song with vocals for a wedding teaser", "instrumental cinematic track for a short film",
+    "happy acoustic guitar for a cafe promo", "dark ambient music for a horror trailer", "festive diwali campaign music",
+    "corporate background music without vocals", "hip hop beat for a sneaker launch", "piano for a real estate walkthrough",
+    "travel montage songs released after 2022", "clean kids friendly music for a toy ad", "punjabi dance track for reels",
+    "motivational music for a startup pitch video", "what is hoopr", "how does licensing work", "thanks!", "hello",
+    "what's the weather in mumbai",
+]
+
+
+def time_calls(fn, args_list: list, rounds: int) -> list:
+    samples = []
+    for _ in range(rounds):
+        for args in args_list:
+            started = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_catalog_load(path: str, repeats: int) -> dict:
+    results = {}
+    results["catalog_load_json_ms"] = summarize(
+        time_calls(lambda: load_catalog(path, use_snapshot=False), [()], repeats), 1000, 1
+    )
+    load_catalog(path, use_snapshot=True)  # make sure the snapshot exists
+    results["catalog_load_snapshot_ms"] = summarize(
+        time_calls(lambda: load_catalog(path, use_snapshot=True), [()], repeats), 1000, 1
+    )
+    return results
+
+
+def bench_bot(path: str, mode: str, queries: list, rounds: int) -> dict:
+    bot = MiraMusicRecommendationBot(path, retrieval_mode=mode)
+    if bot.retrieval_mode != mode:
+        return {"skipped": f"{mode} retrieval is unavailable"}
+    args = [(query,) for query in queries]
+
+    def build_uncached(query):
+        bot.retrieval_cache.clear()
+        return bot._build_prompt(query, "bench")
+
+    return {
+        "retrieval_us": summarize(time_calls(bot._get_relevant_tracks, args, rounds), 1e6, 1),
+        "prompt_uncached_us": summarize(time_calls(build_uncached, args, rounds), 1e6, 1),
+        # Repeated queries are served from the retrieval cache
+        "prompt_us": summarize(time_calls(lambda query: bot._build_prompt(query, "bench"), args, rounds), 1e6, 1),
+        "intent_us": summarize(time_calls(bot._detect_recommendation_intent, args, rounds), 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for catalog load, retrieval, prompt building and intent detection")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000], help="synthetic catalog sizes")
+    parser.add_argument("--catalog", help="benchmark this export instead of synthetic catalogs")
+    parser.add_argument("--modes", nargs="+", default=["bm25"], choices=["bm25", "tfidf", "substring"])
+    parser.add_argument("--messages", help="JSONL of messages to use as queries (see bench.common.load_messages)")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--load-repeats", type=int, default=3)
+    parser.add_argument("--output", help="results file (defaults to bench/results/micro-<time>.json)")
+    args = parser.parse_args()
+
+    logging.getLogger("hoopr").setLevel(logging.WARNING)
+    queries = load_messages(args.messages) if args.messages else QUERIES
+    catalogs = [(args.catalog, args.catalog)] if args.catalog else [(size, ensure_catalog(size)) for size in args.sizes]
+
+    results = {}
+    for label, path in catalogs:
+        entry = bench_catalog_load(path, args.load_repeats)
+        for mode in args.modes:
+            entry[mode] = bench_bot(path, mode, queries, args.rounds)
+        results[str(label)] = entry
+        print(f"{label}: " + ", ".join(
+            f"{name} p50={value['p50']}" for name, value in entry.items() if isinstance(value, dict) and "p50" in value
+        ))
+        for mode in args.modes:
+            print(f"  {mode}: " + ", ".join(
+                f"{name} p50={value['p50']} p99={value['p99']}" for name, value in entry[mode].items() if isinstance(value, dict)
+            ))
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"Peak RSS {results['peak_rss_mb']} MiB; results in {save_results('micro', results, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
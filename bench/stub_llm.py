@@ -0,0 +1,156 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the OpenAI responses API, so load tests never reach the real model.
+# Point the server at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 (any OPENAI_API_KEY).
+#
+#   python -m bench.stub_llm --port 8765 --latency 1.0 --jitter 0.2 --chunks 20 --error-rate 0.02
+#
+# --model-latency gives individual models their own latency, e.g. a slow reasoning model and a fast
+# one for exercising model routes, fallbacks and hedging:
+#
+#   python -m bench.stub_llm --latency 0.3 --model-latency o3-2025-04-16=4 --jitter 2
+
+REPLY = (
+    "Great brief! These tracks match the energy you described.\n\n"
+    "1. Track: Neon Pulse - [Hoopr Smash Link](https://hooprsmash.com/tracks/neon-pulse/BT00000001)\n"
+    "   Why it works: driving beat, clean drop for transitions.\n"
+    "2. Track: Summer Drive - [Hoopr Smash Link](https://hooprsmash.com/tracks/summer-drive/BT00000002)\n"
+    "   Why it works: bright hook that lifts product shots.\n"
+    "3. Track: Velvet Echo - [Hoopr Smash Link](https://hooprsmash.com/tracks/velvet-echo/BT00000003)\n"
+    "   Why it works: warm texture for the closing frames.\n\n"
+    "Want something slower or with vocals?"
+)
+
+
+class StubConfig:
+    def __init__(self, latency: float, jitter: float, chunks: int, error_rate: float, seed: int = 0,
+                 model_latency: dict = None):
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.jitter = jitter
+        self.chunks = max(1, chunks)
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.requests_by_model = {}
+
+    def draw(self, model: str = None):
+        """(total latency for this call, whether it should fail)"""
+        with self._lock:
+            self.requests += 1
+            self.requests_by_model[model] = self.requests_by_model.get(model, 0) + 1
+            base = self.model_latency.get(model, self.latency)
+            latency = max(0.0, base + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return latency, fail
+
+
+def response_body(model: str, text: str) -> dict:
+    return {
+        "id": "resp_stub", "object": "response", "created_at": int(time.time()), "model": model,
+        "status": "completed", "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+        "output": [{
+            "type": "message", "id": "msg_stub", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+    }
+
+
+def _split(text: str, parts: int) -> list:
+    words = text.split(" ")
+    size = max(1, -(-len(words) // parts))
+    pieces = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+    return [piece + (" " if i < len(pieces) - 1 else "") for i, piece in enumerate(pieces)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send_json(200, {"status": "ok", "requests": self.config.requests, "errors": self.config.errors,
+                              "requests_by_model": self.config.requests_by_model})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "stub")
+        latency, fail = self.config.draw(model)
+        if fail:
+            time.sleep(latency / 4)
+            self._send_json(503, {"error": {"message": "stub overloaded", "type": "server_error"}},
+                            {"Retry-After": "0.1"})
+            return
+
+        if not request.get("stream"):
+            time.sleep(latency)
+            self._send_json(200, response_body(model, REPLY))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        pieces = _split(REPLY, self.config.chunks)
+        for sequence, piece in enumerate(pieces):
+            time.sleep(latency / len(pieces))
+            event = {"type": "response.output_text.delta", "delta": piece, "item_id": "msg_stub",
+                     "output_index": 0, "content_index": 0, "sequence_number": sequence, "logprobs": []}
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+        done = {"type": "response.completed", "sequence_number": len(pieces), "response": response_body(model, REPLY)}
+        self.wfile.write(f"event: {done['type']}\ndata: {json.dumps(done)}\n\n".encode())
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(port: int, config: StubConfig) -> StubServer:
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    return StubServer(("127.0.0.1", port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub OpenAI responses API with configurable latency")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion (spread over chunks when streaming)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds added to each completion")
+    parser.add_argument("--chunks", type=int, default=20, help="deltas per streamed completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered 503")
+    parser.add_argument("--model-latency", nargs="*", default=[], metavar="MODEL=SECONDS",
+                        help="latency for specific models (others use --latency)")
+    args = parser.parse_args()
+    model_latency = {name: float(seconds) for name, seconds in (item.split("=", 1) for item in args.model_latency)}
+    server = serve(args.port, StubConfig(args.latency, args.jitter, args.chunks, args.error_rate, model_latency=model_latency))
+    print(f"Stub LLM on http://127.0.0.1:{args.port}/v1 (latency {args.latency}s, errors {args.error_rate:.0%})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
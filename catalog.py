@@ -0,0 +1,400 @@
+import json
+import re
+import sys
+from collections import Counter
+from track_index import TrackIndex
+from tfidf_index import TfidfIndex
+from facets import FacetIndex
+
+_TRUE_VALUES = frozenset(['true', '1', 'yes', 'y'])
+_FALSE_VALUES = frozenset(['false', '0', 'no', 'n'])
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_JSON_DELIMITERS = frozenset(" \t\r\n,]}:")
+
+# Dict key exposed to prompts/API -> Track attribute
+FIELD_NAMES = (
+    ('trackCode', 'track_code'),
+    ('name', 'name'),
+    ('bpm', 'bpm'),
+    ('songKey', 'song_key'),
+    ('releaseDate', 'release_date'),
+    ('releaseYear', 'release_year'),
+    ('hasVocals', 'has_vocals'),
+    ('name_slug', 'name_slug'),
+    ('isExplicit', 'is_explicit'),
+    ('displayTags', 'display_tags'),
+)
+_ATTRIBUTES = dict(FIELD_NAMES)
+
+# Top-level keys that may hold the track list in object-shaped exports: 'tracks' if present, else 'data';
+# 'results' only when that list is missing or empty (see _chosen_track_list)
+TRACK_LIST_KEYS = ('tracks', 'data', 'results')
+
+
+def parse_bool(value):
+    """Parse a catalog flag into True/False, or None when unknown"""
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    if text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return False
+    return None
+
+
+def parse_number(value):
+    """Parse a numeric catalog field into an int (or float), or None when missing"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        # Tolerate values like "120 BPM" or "2023-05-01"
+        match = _NUMBER_RE.search(str(value))
+        if match is None:
+            return None
+        number = float(match.group())
+    if isinstance(number, float):
+        if number != number:  # NaN
+            return None
+        if number.is_integer():
+            return int(number)
+    return number
+
+
+def _format(value) -> str:
+    """Render a typed field the way the stringified catalog used to"""
+    if value is None:
+        return ''
+    return str(value)
+
+
+class Track:
+    """One catalog entry with typed fields and precomputed lowercase search text
+
+    Attribute access gives typed values (numeric bpm/year, real booleans);
+    item access (track['bpm']) gives the string view the prompts and API
+    have always used.
+    """
+
+    __slots__ = (
+        'track_code', 'name', 'bpm', 'song_key', 'release_date', 'release_year',
+        'has_vocals', 'name_slug', 'is_explicit', 'display_tags',
+        'search_name', 'search_tags',
+    )
+
+    def __init__(self, track_code, name, bpm=None, song_key='', release_date='', release_year=None,
+                 has_vocals=None, name_slug='', is_explicit=None, display_tags=''):
+        self.track_code = track_code
+        self.name = name
+        self.bpm = bpm
+        self.song_key = sys.intern(song_key)
+        self.release_date = sys.intern(release_date)
+        self.release_year = release_year
+        self.has_vocals = has_vocals
+        self.name_slug = name_slug
+        self.is_explicit = is_explicit
+        self.display_tags = sys.intern(display_tags)
+        self.search_name = name.lower()
+        self.search_tags = sys.intern(self.display_tags.lower())
+
+    @classmethod
+    def from_raw(cls, track: dict) -> "Track":
+        """Normalize one raw JSON track, accepting the alternative key names seen in exports"""
+        return cls(
+            track_code=str(track.get('trackCode', track.get('id', track.get('code', '')))),
+            name=str(track.get('name', track.get('title', track.get('track_name', '')))),
+            bpm=parse_number(track.get('bpm', track.get('tempo'))),
+            song_key=str(track.get('songKey', track.get('key', track.get('music_key', '')))),
+            release_date=str(track.get('releaseDate', track.get('release_date', ''))),
+            release_year=parse_number(track.get('releaseYear', track.get('release_year', track.get('year')))),
+            has_vocals=parse_bool(track.get('hasVocals', track.get('has_vocals', track.get('vocals')))),
+            name_slug=str(track.get('name_slug', track.get('slug', track.get('url_slug', '')))),
+            is_explicit=parse_bool(track.get('isExplicit', track.get('is_explicit', track.get('explicit')))),
+            display_tags=str(track.get('displayTags', track.get('tags', track.get('genres', track.get('categories', ''))))),
+        )
+
+    def __getitem__(self, key: str) -> str:
+        try:
+            return _format(getattr(self, _ATTRIBUTES[key]))
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=''):
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is None:
+            return default
+        return _format(getattr(self, attribute))
+
+    def keys(self):
+        return [key for key, _ in FIELD_NAMES]
+
+    def values(self):
+        return [_format(getattr(self, attribute)) for _, attribute in FIELD_NAMES]
+
+    def as_dict(self) -> dict:
+        """The stringified dict view of this track"""
+        return {key: _format(getattr(self, attribute)) for key, attribute in FIELD_NAMES}
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return f"Track({self.track_code!r}, {self.name!r})"
+
+
+def split_tags(display_tags: str) -> list:
+    """Split a displayTags string into individual tags"""
+    return [tag.strip() for tag in display_tags.split(',') if tag.strip()]
+
+
+class CatalogStats:
+    """Catalog aggregates computed once when a catalog is built
+
+    Catalogs are immutable and replaced whole, so the aggregates (and their
+    JSON view) never change after construction.
+    """
+
+    BPM_BUCKET = 10
+
+    def __init__(self, tracks: list = ()):
+        self.total = 0
+        self.with_vocals = 0
+        self.explicit = 0
+        self.bpm_histogram = Counter()
+        self.year_histogram = Counter()
+        self.tag_counts = Counter()
+        self._views = {}
+        for track in tracks:
+            self._add(track)
+
+    def _add(self, track: Track):
+        self.total += 1
+        if track.has_vocals:
+            self.with_vocals += 1
+        if track.is_explicit:
+            self.explicit += 1
+        if track.bpm is not None:
+            self.bpm_histogram[int(track.bpm) // self.BPM_BUCKET * self.BPM_BUCKET] += 1
+        if track.release_year is not None:
+            self.year_histogram[int(track.release_year)] += 1
+        for tag in split_tags(track.display_tags):
+            self.tag_counts[tag] += 1
+
+    def as_dict(self, top_tags: int = 20) -> dict:
+        """JSON-ready view of the aggregates, built on first use (treat it as read-only)"""
+        view = self._views.get(top_tags)
+        if view is None:
+            view = self._views[top_tags] = self._build_view(top_tags)
+        return view
+
+    def _build_view(self, top_tags: int) -> dict:
+        return {
+            "total_tracks": self.total,
+            "tracks_with_vocals": self.with_vocals,
+            "explicit_tracks": self.explicit,
+            "non_explicit_tracks": self.total - self.explicit,
+            "instrumental_tracks": self.total - self.with_vocals,
+            "bpm_histogram": {
+                f"{bucket}-{bucket + self.BPM_BUCKET - 1}": count
+                for bucket, count in sorted(self.bpm_histogram.items())
+            },
+            "release_year_histogram": {str(year): count for year, count in sorted(self.year_histogram.items())},
+            "top_tags": [{"tag": tag, "count": count} for tag, count in self.tag_counts.most_common(top_tags)],
+        }
+
+
+class Catalog:
+    """A loaded track catalog together with its search indexes and aggregates"""
+
+    def __init__(self, tracks: list, version: str = "", index: TrackIndex = None):
+        self.tracks = tracks
+        self.version = version
+        self.index = index if index is not None else TrackIndex(tracks)
+        # Hash index for validating track codes the model returns
+        self.by_code = {track.track_code: track for track in tracks}
+        self.facets = FacetIndex(tracks)
+        self.stats = CatalogStats(tracks)
+        # Optional NumPy TF-IDF engine, built on demand by build_tfidf()
+        self.tfidf = None
+
+    def build_tfidf(self) -> TfidfIndex:
+        if self.tfidf is None:
+            self.tfidf = TfidfIndex(self.tracks)
+        return self.tfidf
+
+
+class _JsonStream:
+    """Incremental reader that decodes one JSON value at a time from a text file"""
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Read another chunk, discarding what has already been consumed"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at EOF)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expected {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut at the chunk boundary ("12" of "12.5") may continue in the next chunk
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in _JSON_DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def array_items(self):
+        """Yield the items of the array starting at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise json.JSONDecodeError("Expected ',' or ']'", self.buffer, self.pos - 1)
+
+
+def _object_keys(stream: _JsonStream):
+    """Yield the keys of the object at the current position; the caller consumes each value before resuming"""
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.pos += 1
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        yield key
+        separator = stream.peek()
+        stream.pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise json.JSONDecodeError("Expected ',' or '}'", stream.buffer, stream.pos - 1)
+
+
+def _skip_array(stream: _JsonStream) -> bool:
+    """Consume the array at the current position one item at a time; whether it had any items"""
+    found = False
+    for _ in stream.array_items():
+        found = True
+    return found
+
+
+def _chosen_track_list(present: dict):
+    """The key the track list is read from, given {key: whether it holds a non-empty list} for the keys present"""
+    primary = 'tracks' if 'tracks' in present else 'data' if 'data' in present else None
+    if primary is not None and present[primary]:
+        return primary
+    return 'results' if present.get('results') else None
+
+
+def iter_json_tracks(json_file_path: str, chunk_size: int = 1 << 16):
+    """Stream raw track objects out of a catalog export without parsing the whole document
+
+    Accepts a top-level array of tracks, or an object holding the array under
+    one of TRACK_LIST_KEYS. A list that wins whatever follows it ('tracks',
+    or 'results' after an empty 'tracks') is streamed as it is read; otherwise
+    the lists are skipped item by item and the chosen one is streamed in a
+    second pass over the file.
+    """
+    with open(json_file_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_size)
+        first = stream.peek()
+        if first == '[':
+            yield from stream.array_items()
+            return
+        if first != '{':
+            raise ValueError("Invalid JSON structure")
+
+        present = {}
+        for key in _object_keys(stream):
+            if key not in TRACK_LIST_KEYS or stream.peek() != '[':
+                if key in TRACK_LIST_KEYS:
+                    present[key] = False
+                stream.value()
+            elif key == 'tracks' or (key == 'results' and present.get('tracks') is False):
+                found = False
+                for track in stream.array_items():
+                    found = True
+                    yield track
+                if found:
+                    return
+                present[key] = False
+            else:
+                present[key] = _skip_array(stream)
+        chosen = _chosen_track_list(present)
+    if chosen is not None:
+        yield from _iter_track_list(json_file_path, chosen, chunk_size)
+
+
+def _iter_track_list(json_file_path: str, list_key: str, chunk_size: int):
+    """Stream the items of one top-level array of an object-shaped export"""
+    with open(json_file_path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_size)
+        for key in _object_keys(stream):
+            if key == list_key:
+                yield from stream.array_items()
+                return
+            if key in TRACK_LIST_KEYS and stream.peek() == '[':
+                _skip_array(stream)
+            else:
+                stream.value()
+
+
+def read_tracks(json_file_path: str, progress=None, progress_every: int = 10000) -> list:
+    """Stream a catalog export and normalize each track as it is decoded
+
+    `progress`, if given, is called with the number of tracks read so far.
+    """
+    tracks = []
+    for raw_track in iter_json_tracks(json_file_path):
+        tracks.append(Track.from_raw(raw_track))
+        if progress is not None and len(tracks) % progress_every == 0:
+            progress(len(tracks))
+    return tracks
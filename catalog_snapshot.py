@@ -0,0 +1,197 @@
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import struct
+import threading
+import logging
+from catalog import Catalog, read_tracks
+
+logger = logging.getLogger("hoopr")
+
+# Snapshots live in a directory the server owns, never next to the source (whose path may come from POST /init):
+#
+#   MAGIC | HMAC-SHA256 of the rest | header length | header (JSON) | pickled Catalog
+#
+# The HMAC is checked before anything is unpickled, so only snapshots this server (or one sharing
+# MIRA_SNAPSHOT_KEY) wrote are ever loaded. Without MIRA_SNAPSHOT_KEY a random key is kept in the directory.
+SNAPSHOT_MAGIC = b"MIRASNAP"
+# Bump whenever Track, TrackIndex or Catalog change shape so stale snapshots are rebuilt
+SNAPSHOT_FORMAT = 7
+SNAPSHOT_SUFFIX = ".mira-snapshot"
+SNAPSHOT_KEY_FILE = "snapshot.key"
+
+_MAC_SIZE = hashlib.sha256().digest_size
+_HEADER_LENGTH = struct.Struct(">I")
+_keys = {}
+_keys_lock = threading.Lock()
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash a file in fixed-size chunks so memory stays flat"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_dir() -> str:
+    """Directory holding catalog snapshots (MIRA_SNAPSHOT_DIR, by default `snapshots` beside this module)"""
+    return os.getenv("MIRA_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+
+
+def snapshot_path_for(json_file_path: str) -> str:
+    """Snapshot location for a catalog export, keyed by its absolute path"""
+    source = os.path.abspath(json_file_path)
+    name = f"{os.path.basename(source)}.{hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]}{SNAPSHOT_SUFFIX}"
+    return os.path.join(snapshot_dir(), name)
+
+
+def _snapshot_key(directory: str) -> bytes:
+    """The HMAC key for snapshots in a directory: MIRA_SNAPSHOT_KEY, else a random key created there once"""
+    secret = os.getenv("MIRA_SNAPSHOT_KEY")
+    if secret:
+        return secret.encode('utf-8')
+    with _keys_lock:
+        key = _keys.get(directory)
+        if key is None:
+            key_path = os.path.join(directory, SNAPSHOT_KEY_FILE)
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            try:
+                fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                with open(key_path, 'rb') as f:
+                    key = f.read()
+            else:
+                key = os.urandom(32)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(key)
+            if len(key) < 32:
+                raise ValueError(f"Snapshot key {key_path} is too short")
+            _keys[directory] = key
+        return key
+
+
+def _mac(key: bytes, f, chunk_size: int = 1 << 20) -> bytes:
+    """HMAC of the rest of an open file"""
+    mac = hmac.new(key, digestmod=hashlib.sha256)
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        mac.update(chunk)
+    return mac.digest()
+
+
+def _read_header(f):
+    """(stored HMAC, header, offset of the pickled Catalog) of a snapshot, or None if it is not of the current format"""
+    if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        return None
+    mac = f.read(_MAC_SIZE)
+    (length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length))
+    if header.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return mac, header, f.tell()
+
+
+def load_snapshot(snapshot_path: str, json_file_path: str):
+    """Return the Catalog stored in a snapshot if it is authentic and still matches the source file, else None
+
+    A matching mtime and size is trusted without rehashing; otherwise the
+    source is rehashed and the snapshot is used only if the content is unchanged.
+    """
+    try:
+        with open(snapshot_path, 'rb') as f:
+            stored = _read_header(f)
+            if stored is None:
+                return None
+            mac, header, offset = stored
+            stat = os.stat(json_file_path)
+            if header['source'] != os.path.abspath(json_file_path) or header['size'] != stat.st_size:
+                return None
+            if header['mtime_ns'] != stat.st_mtime_ns and header['sha256'] != file_sha256(json_file_path):
+                return None
+            f.seek(len(SNAPSHOT_MAGIC) + _MAC_SIZE)
+            if not hmac.compare_digest(mac, _mac(_snapshot_key(os.path.dirname(snapshot_path)), f)):
+                logger.warning(f"Ignoring catalog snapshot {snapshot_path}: signature mismatch")
+                return None
+            f.seek(offset)
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable catalog snapshot {snapshot_path}: {e}")
+        return None
+
+
+def write_snapshot(snapshot_path: str, json_file_path: str, catalog: Catalog, sha256: str):
+    """Atomically write a signed catalog snapshot keyed on the source file's path, mtime, size and hash"""
+    stat = os.stat(json_file_path)
+    header = json.dumps({
+        'format': SNAPSHOT_FORMAT,
+        'source': os.path.abspath(json_file_path),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': sha256,
+    }).encode('utf-8')
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), mode=0o700, exist_ok=True)
+        key = _snapshot_key(os.path.dirname(snapshot_path))
+        with os.fdopen(os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600), 'w+b') as f:
+            f.write(SNAPSHOT_MAGIC + bytes(_MAC_SIZE) + _HEADER_LENGTH.pack(len(header)) + header)
+            pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.seek(len(SNAPSHOT_MAGIC) + _MAC_SIZE)
+            mac = _mac(key, f)
+            f.seek(len(SNAPSHOT_MAGIC))
+            f.write(mac)
+        os.replace(tmp_path, snapshot_path)
+        logger.info(f"Wrote catalog snapshot {snapshot_path}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not write catalog snapshot {snapshot_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_catalog(json_file_path: str, use_snapshot: bool = None, progress=None, with_tfidf: bool = False) -> Catalog:
+    """Load a catalog from its snapshot when fresh, otherwise stream the JSON and snapshot it
+
+    `progress`, if given, is called as progress(stage, tracks_done) while loading.
+    With `with_tfidf` the TF-IDF matrix is built too and stored in the snapshot.
+    """
+    def report(stage, tracks_done=0):
+        if progress is not None:
+            progress(stage, tracks_done)
+
+    if use_snapshot is None:
+        use_snapshot = os.getenv("MIRA_CATALOG_SNAPSHOT", "1") != "0"
+
+    snapshot_path = snapshot_path_for(json_file_path)
+    if use_snapshot:
+        report("snapshot")
+        catalog = load_snapshot(snapshot_path, json_file_path)
+        if catalog is not None:
+            logger.info(f"Loaded {len(catalog.tracks)} tracks from snapshot {snapshot_path}")
+            if with_tfidf and catalog.tfidf is None:
+                report("indexing_tfidf", len(catalog.tracks))
+                catalog.build_tfidf()
+                write_snapshot(snapshot_path, json_file_path, catalog, file_sha256(json_file_path))
+            report("loaded", len(catalog.tracks))
+            return catalog
+
+    report("hashing")
+    sha256 = file_sha256(json_file_path)
+    report("parsing")
+    tracks = read_tracks(json_file_path, progress=lambda count: report("parsing", count))
+    report("indexing", len(tracks))
+    catalog = Catalog(tracks, version=sha256[:16])
+    if with_tfidf:
+        report("indexing_tfidf", len(tracks))
+        catalog.build_tfidf()
+    if use_snapshot:
+        report("writing_snapshot", len(tracks))
+        write_snapshot(snapshot_path, json_file_path, catalog, sha256)
+    report("loaded", len(tracks))
+    return catalog
@@ -1,13 +1,63 @@
+import asyncio
 import json
+import os
+import threading
 import time
-from openai_utils import get_completion
-from mylogger import logger
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai_utils import get_completion, get_completion_stream, get_completion_async, get_completion_stream_async, completion_cache, request_deadline
+from llm_limiter import Overloaded
+from mylogger import logger, log_body, sampled, VERBOSE
+from catalog import Catalog
+from catalog_snapshot import load_catalog
+from tfidf_index import np
+from facets import parse_facets
+from prompt_budget import PromptBuilder, BuiltPrompt, RenderedTracks
+from retrieval_cache import RetrievalCache, RetrievalEntry, normalize_query
+from metrics import registry, stage, intents_total, prompt_tokens
+from recommendation_format import STRUCTURED_INSTRUCTIONS, render_recommendations
+from model_routing import RECOMMEND_ROUTE, CHAT_ROUTE
+from conversation_store import ConversationStore, DEFAULT_SESSION
+from conversation_log import conversation_log_from_env
+from conversation_summary import ConversationSummarizer
+from intent_router import IntentRouter, Intent, RECOMMEND, GREETING, OFF_TOPIC
 
 class MiraMusicRecommendationBot:
-    def __init__(self, json_file_path: str, bot_name="MIRA - Hoopr Music AI"):
+    def __init__(self, json_file_path: str, bot_name="MIRA - Hoopr Music AI", retrieval_mode=None):
         self.bot_name = bot_name
-        self.conversation = []
-        self.tracks_data = self._load_tracks_from_json(json_file_path)
+        # Turns are also written behind the request path to SQLite and reloaded lazily after a restart
+        self.conversations = ConversationStore(log=conversation_log_from_env())
+        if self.conversations.log is not None:
+            log = self.conversations.log
+            registry.callback("mira_conversation_log_written_total", "Conversation log operations committed", lambda: log.written, "counter")
+            registry.callback("mira_conversation_log_dropped_total", "Conversation log writes dropped because the writer was behind", lambda: log.dropped, "counter")
+            registry.callback("mira_conversation_log_queued", "Conversation log operations waiting to be written", lambda: log.stats()["queued"])
+        # Older turns are folded into a per-session summary in the background
+        self.summaries = ConversationSummarizer(self.conversations)
+        self.prompt_builder = PromptBuilder()
+        # Ranked tracks and their rendered prompt lines per catalog version, facets and normalized query
+        self.retrieval_cache = RetrievalCache(int(os.getenv("MIRA_RETRIEVAL_CACHE_SIZE", "2048")))
+        registry.callback("mira_retrieval_cache_hits_total", "Retrieval cache hits", lambda: self.retrieval_cache.hits, "counter")
+        registry.callback("mira_retrieval_cache_misses_total", "Retrieval cache misses", lambda: self.retrieval_cache.misses, "counter")
+        registry.callback("mira_retrieval_cache_entries", "Queries held in the retrieval cache", lambda: self.retrieval_cache.stats()["entries"])
+        # Local classifier; greetings and off-topic messages are answered without the model
+        self.router = IntentRouter()
+        # Completions for /chat/batch fan out over this shared pool (or this many tasks per batch in async mode)
+        self.batch_concurrency = int(os.getenv("MIRA_BATCH_CONCURRENCY", "16"))
+        self.batch_executor = ThreadPoolExecutor(max_workers=self.batch_concurrency, thread_name_prefix="chat-batch")
+        os.register_at_fork(after_in_child=self._new_batch_executor)
+
+        # "bm25" uses the inverted index, "tfidf" the NumPy TF-IDF engine,
+        # "substring" keeps the original linear scan for parity testing
+        self.retrieval_mode = retrieval_mode or os.getenv("MIRA_RETRIEVAL", "bm25")
+        # "structured" asks the model for track codes and short reasoning as JSON and renders the reply locally
+        self.structured_output = os.getenv("MIRA_RECOMMENDATION_OUTPUT", "markdown") == "structured"
+        if self.retrieval_mode == "tfidf" and np is None:
+            logger.warning("NumPy is not installed; falling back to BM25 retrieval")
+            self.retrieval_mode = "bm25"
+
+        self._swap_lock = threading.Lock()
+        self.catalog = None
+        self.swap_catalog(self._load_catalog(json_file_path))
         
         # Updated MIRA system prompt for recommendations
         self.recommendation_prompt = """You are MIRA - Copyright Safe Music Recommender, owned by Hoopr.You provide information and recommendations related to hoopr only,you dont reply to anthing else than music related questions
@@ -37,6 +87,14 @@ IMPORTANT RULES:
 * DON'T use web search or placeholder links
 * Verify links match the track names"""
 
+        # System prompt for structured recommendations (see recommendation_format)
+        self.structured_prompt = """You are MIRA - Copyright Safe Music Recommender, owned by Hoopr. You recommend tracks from Hoopr's catalog only.
+
+Pick the 3 tracks from AVAILABLE TRACKS that best fit the user's request:
+* Make brand-appropriate picks (don't recommend devotional songs for alcohol brands)
+* Base the ROI estimates (engagement rate, watch time, CTR), audience and reels views on the brief and each track's tags and tempo
+* If the request is not about music or Hoopr, reply {"intro": "this is not related to hoopr or music", "picks": []}"""
+
         # Conversational system prompt
         self.conversation_prompt = """You are MIRA - Copyright Safe Music Recommender from Hoopr.
 
@@ -45,87 +103,141 @@ Do NOT provide music recommendations unless specifically asked for songs/tracks/
 
 Keep responses short, witty, and engaging. You can be a bit sarcastic but always helpful."""
 
+        # Replies the intent router sends without calling the model
+        self.greeting_reply = ("Hey! I'm MIRA, Hoopr's copyright-safe music recommender. "
+                               "Tell me about your video, reel or campaign and I'll find tracks that fit.")
+        self.off_topic_reply = "this is not related to hoopr or music"
+
         logger.info(f"MIRA initialized with {len(self.tracks_data)} tracks from JSON")
 
-    def _load_tracks_from_json(self, json_file_path: str) -> list:
-        """Load tracks from JSON file"""
+    def _new_batch_executor(self):
+        """Replace the batch pool in a forked child, where the inherited one has no threads"""
+        self.batch_executor = ThreadPoolExecutor(max_workers=self.batch_concurrency, thread_name_prefix="chat-batch")
+
+    @property
+    def tracks_data(self) -> list:
+        return self.catalog.tracks
+
+    @property
+    def track_index(self):
+        return self.catalog.index
+
+    @property
+    def catalog_version(self) -> str:
+        return self.catalog.version
+
+    def swap_catalog(self, catalog: Catalog):
+        """Atomically publish a new catalog; requests already running keep the one they started with"""
+        with self._swap_lock:
+            # Cached completions are only valid for the catalog they were generated against
+            if completion_cache is not None:
+                completion_cache.set_catalog_version(catalog.version)
+            self.catalog = catalog
+            self.retrieval_cache.clear()
+        logger.info(f"MIRA serving catalog {catalog.version} with {len(catalog.tracks)} tracks")
+
+    def reload_catalog(self, json_file_path: str, progress=None) -> Catalog:
+        """Build a catalog from json_file_path and swap it in, keeping conversations intact"""
+        catalog = load_catalog(json_file_path, progress=progress, with_tfidf=self.retrieval_mode == "tfidf")
+        if not catalog.tracks:
+            raise ValueError("No tracks were loaded from the JSON file")
+        self.swap_catalog(catalog)
+        return catalog
+
+    def _load_catalog(self, json_file_path: str) -> Catalog:
+        """Load tracks and their search index from the catalog snapshot or the JSON file"""
         try:
-            with open(json_file_path, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
-
-            # Handle different JSON structures
-            if isinstance(json_data, list):
-                tracks = json_data
-            elif isinstance(json_data, dict):
-                tracks = json_data.get('tracks', json_data.get('data', []))
-                if not tracks and 'results' in json_data:
-                    tracks = json_data['results']
-            else:
-                logger.error("Invalid JSON structure")
-                return []
-
-            # Normalize track data structure
-            normalized_tracks = []
-            for track in tracks:
-                normalized_track = {
-                    'trackCode': str(track.get('trackCode', track.get('id', track.get('code', '')))),
-                    'name': str(track.get('name', track.get('title', track.get('track_name', '')))),
-                    'bpm': str(track.get('bpm', track.get('tempo', ''))),
-                    'songKey': str(track.get('songKey', track.get('key', track.get('music_key', '')))),
-                    'releaseDate': str(track.get('releaseDate', track.get('release_date', ''))),
-                    'releaseYear': str(track.get('releaseYear', track.get('release_year', track.get('year', '')))),
-                    'hasVocals': str(track.get('hasVocals', track.get('has_vocals', track.get('vocals', '')))),
-                    'name_slug': str(track.get('name_slug', track.get('slug', track.get('url_slug', '')))),
-                    'isExplicit': str(track.get('isExplicit', track.get('is_explicit', track.get('explicit', '')))),
-                    'displayTags': str(track.get('displayTags', track.get('tags', track.get('genres', track.get('categories', '')))))
-                }
-                normalized_tracks.append(normalized_track)
-
-            logger.info(f"Successfully loaded {len(normalized_tracks)} tracks from JSON")
-            return normalized_tracks
+            catalog = load_catalog(json_file_path, with_tfidf=self.retrieval_mode == "tfidf")
+            logger.info(f"Successfully loaded {len(catalog.tracks)} tracks from JSON")
+            return catalog
 
         except FileNotFoundError:
             logger.error(f"JSON file not found: {json_file_path}")
-            return []
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON format in {json_file_path}: {e}")
-            return []
         except Exception as e:
             logger.error(f"Error loading JSON file {json_file_path}: {e}")
-            return []
+        return Catalog([])
+
+    def _classify(self, user_message: str, session_id: str = None) -> Intent:
+        """Route a message; within a session that already has turns, follow-ups are never refused locally"""
+        in_conversation = session_id is not None and self.conversations.length(session_id) > 0
+        with stage("intent"):
+            intent = self.router.classify(user_message, in_conversation)
+        intents_total.inc(intent.label)
+        return intent
 
     def _detect_recommendation_intent(self, user_message: str) -> bool:
         """Detect if user is asking for music recommendations"""
-        music_keywords = [
-            'recommend', 'suggestion', 'music', 'song', 'track', 'audio',
-            'reel', 'video', 'background', 'instrumental', 'vocal',
-            'upbeat', 'chill', 'energetic', 'mood', 'vibe', 'genre',
-            'license', 'copyright', 'commercial', 'brand', 'campaign',
-            'ad', 'advertisement', 'content', 'youtube', 'instagram',
-            'tiktok', 'social media', 'beats', 'sound', 'playlist',
-            'give me', 'need', 'want', 'looking for', 'find'
+        return self._classify(user_message).label == RECOMMEND
+
+    def _local_reply(self, user_message: str, session_id: str, intent: Intent, started_at: float = None):
+        """Canned reply for greetings and off-topic messages (recorded like any exchange), else None"""
+        if intent.label == GREETING:
+            response = self.greeting_reply
+        elif intent.label == OFF_TOPIC:
+            response = self.off_topic_reply
+        else:
+            return None
+        if sampled():
+            logger.info(f"Answered locally as {intent}", extra=VERBOSE)
+        self._record_exchange(session_id, user_message, response, started_at)
+        return response
+
+    def _get_relevant_tracks(self, user_message: str, limit: int = 15, catalog: Catalog = None, allowed=None) -> list:
+        """Find tracks relevant to user message using the inverted index
+
+        `allowed` is the FacetMask of tracks matching the message's structured
+        filters; only those tracks are ranked.
+        """
+        catalog = catalog or self.catalog
+        if self.retrieval_mode == "substring":
+            return self._get_relevant_tracks_substring(user_message, limit, catalog, allowed)
+
+        if self.retrieval_mode == "tfidf" and catalog.tfidf is not None:
+            results = catalog.tfidf.search(user_message, limit, allowed=allowed)
+        else:
+            results = catalog.index.search(user_message, limit, allowed=allowed)
+        return [catalog.tracks[position] for position, _ in results]
+
+    def _get_relevant_tracks_batch(self, user_messages: list, limit: int = 15, catalog: Catalog = None, allowed=None) -> list:
+        """Retrieve tracks for many messages at once (one vectorized pass with the TF-IDF engine)
+
+        `allowed`, if given, holds one FacetMask (or None) per message.
+        """
+        catalog = catalog or self.catalog
+        if allowed is None:
+            allowed = [None] * len(user_messages)
+        if self.retrieval_mode == "tfidf" and catalog.tfidf is not None:
+            return [
+                [catalog.tracks[position] for position, _ in results]
+                for results in catalog.tfidf.search_batch(user_messages, limit, allowed=allowed)
+            ]
+        return [
+            self._get_relevant_tracks(message, limit, catalog, mask)
+            for message, mask in zip(user_messages, allowed)
         ]
-        
-        user_lower = user_message.lower()
-        return any(keyword in user_lower for keyword in music_keywords)
 
-    def _get_relevant_tracks(self, user_message: str, limit: int = 15) -> list:
-        """Find tracks relevant to user message with better scoring"""
+    def _get_relevant_tracks_substring(self, user_message: str, limit: int = 15, catalog: Catalog = None, allowed=None) -> list:
+        """Find tracks relevant to user message by substring scan over every track"""
+        catalog = catalog or self.catalog
         keywords = user_message.lower().split()
         relevant_tracks = []
 
-        for track in self.tracks_data:
-            track_text = f"{track['name']} {track['displayTags']} {track.get('bpm', '')}".lower()
+        for position, track in enumerate(catalog.tracks):
+            if allowed is not None and position not in allowed:
+                continue
+            track_text = f"{track.search_name} {track.search_tags} {track['bpm']}"
             
             # Enhanced scoring system
             score = 0
             for keyword in keywords:
                 if keyword in track_text:
                     # Higher score for exact matches in name
-                    if keyword in track['name'].lower():
+                    if keyword in track.search_name:
                         score += 3
                     # Medium score for tags
-                    elif keyword in track['displayTags'].lower():
+                    elif keyword in track.search_tags:
                         score += 2
                     else:
                         score += 1
@@ -137,98 +249,469 @@ Keep responses short, witty, and engaging. You can be a bit sarcastic but always
         relevant_tracks.sort(key=lambda x: x[1], reverse=True)
         return [track for track, _ in relevant_tracks[:limit]]
 
-    def _build_tracks_context(self, tracks: list) -> str:
-        """Build context string from track data"""
+    def _context_tracks(self, tracks: list, catalog: Catalog = None, allowed=None, exclude=frozenset()) -> list:
+        """Tracks to offer the model, falling back to the start of the catalog when nothing matched"""
+        catalog = catalog or self.catalog
+        if tracks:
+            return tracks
+        if allowed is None:
+            fallback = catalog.tracks[:15 + len(exclude)]  # Default to first 15
+        else:
+            # Never fall back to tracks that break the requested filters
+            fallback = [catalog.tracks[position] for position in allowed.positions(15 + len(exclude))]
+        return [track for track in fallback if track.track_code not in exclude][:15]
+
+    def _retrieval_query(self, user_message: str) -> str:
+        """The text retrieval ranks and caches on: the normalized query, or the raw message in substring parity mode"""
+        # The substring scan must see the message exactly as the original implementation did
+        return user_message if self.retrieval_mode == "substring" else normalize_query(user_message)
+
+    def _retrieval_key(self, query: str, facets, catalog: Catalog) -> tuple:
+        return (catalog.version, self.retrieval_mode, query, facets.key())
+
+    def _offered_tracks(self, entry: RetrievalEntry, facets, catalog: Catalog, exclude=frozenset()) -> RenderedTracks:
+        """The cached ranking as rendered prompt lines, minus tracks this session was already offered
+
+        Lines for the full ranking are rendered once and kept on the entry.
+        """
+        if not exclude and entry.rendered is not None:
+            return entry.rendered
+        tracks = [track for track in entry.tracks if track.track_code not in exclude][:15]
         if not tracks:
-            tracks = self.tracks_data[:15]  # Default to first 15
-
-        context = "AVAILABLE TRACKS:\n"
-        for track in tracks:
-            context += f"trackCode: {track['trackCode']}, name: {track['name']}, "
-            context += f"bpm: {track['bpm']}, hasVocals: {track['hasVocals']}, "
-            context += f"name_slug: {track['name_slug']}, displayTags: {track['displayTags']}\n"
-        
-        return context
+            tracks = self._context_tracks(tracks, catalog, catalog.facets.match(facets), exclude)
+        rendered = self.prompt_builder.render(tracks)
+        if not exclude:
+            entry.rendered = rendered
+        return rendered
+
+    def _recommendation_tracks(self, user_message: str, catalog: Catalog, exclude=frozenset()) -> RenderedTracks:
+        """Tracks to offer for a recommendation request, skipping ones this session was already offered
+
+        Rankings are memoized per catalog version, facets and normalized query,
+        so a popular query skips both retrieval and rendering the track lines.
+        """
+        # Structured filters (BPM range, vocals, explicit, year) narrow the candidates before ranking
+        facets = parse_facets(user_message)
+        query = self._retrieval_query(user_message)
+        key = self._retrieval_key(query, facets, catalog)
+        limit = 15 + len(exclude)
+        entry = self.retrieval_cache.get(key, limit)
+        if entry is None:
+            allowed = catalog.facets.match(facets)
+            if allowed is not None:
+                if sampled():
+                    logger.info(f"Facet filters {facets} match {len(allowed)} tracks", extra=VERBOSE)
+            entry = RetrievalEntry(self._get_relevant_tracks(query, limit, catalog, allowed), limit)
+            self.retrieval_cache.put(key, entry)
+        return self._offered_tracks(entry, facets, catalog, exclude)
+
+    def _recent_history(self, session_id: str):
+        """Turns not yet folded into the session summary (at most the last 8), plus the summary memory"""
+        epoch, first_seq, turns = self.conversations.window(session_id)
+        memory = self.summaries.get(session_id, epoch)
+        if memory is not None:
+            turns = turns[max(0, memory.folded_upto - first_seq):]
+        return turns[-8:], memory
+
+    def _record_exchange(self, session_id: str, user_message: str, response: str, started_at: float = None):
+        """Store a completed exchange and refresh the session summary off the request path
+
+        The user turn is stamped with the time the request started (time.time()),
+        the reply with the time it completed and how long it took.
+        """
+        now = time.time()
+        started_at = started_at or now
+        self.conversations.append(session_id, ("User", user_message, started_at, None),
+                                  ("MIRA", response, now, round((now - started_at) * 1000, 1)))
+        self.summaries.schedule(session_id)
+
+    def _build_prompt(self, user_message: str, session_id: str = DEFAULT_SESSION, catalog: Catalog = None,
+                      intent: Intent = None) -> BuiltPrompt:
+        """Build the model prompt for a user message within the token budget"""
+        catalog = catalog or self.catalog
 
-    def chat(self, user_message: str) -> str:
-        """Send message and get MIRA response"""
-        logger.info(f"User message: {user_message}")
-        
         # Check if this is a recommendation request
-        needs_recommendation = self._detect_recommendation_intent(user_message)
+        intent = intent or self._classify(user_message, session_id)
+        needs_recommendation = intent.label == RECOMMEND
         
-        # Build conversation context
-        conversation_context = self._build_conversation_context()
+        # Recent turns verbatim (trimmed to the budget by the prompt builder), older ones as a summary
+        history, memory = self._recent_history(session_id)
+        summary = memory.summary if memory is not None else None
+        exclude = memory.recommended_codes if memory is not None else frozenset()
         
         if needs_recommendation:
-            # Get relevant tracks for recommendations
-            relevant_tracks = self._get_relevant_tracks(user_message)
-            tracks_context = self._build_tracks_context(relevant_tracks)
+            with stage("retrieval"):
+                tracks = self._recommendation_tracks(user_message, catalog, exclude)
             
-            prompt = f"""{self.recommendation_prompt}
-
-{tracks_context}
-
-CONVERSATION HISTORY:
-{conversation_context}
-
-USER REQUEST: {user_message}
-
-Provide a brief intro explaining why these tracks work for the request, then exactly 3 track recommendations using the specified format with detailed ROI analysis, audience demographics, and proper Hoopr Smash links. End with a helpful follow-up question."""
+            prompt = self._recommendation_request(user_message, history, tracks, summary)
         
         else:
             # Conversational response without recommendations
-            prompt = f"""{self.conversation_prompt}
-
-CONVERSATION HISTORY:
-{conversation_context}
-
-USER MESSAGE: {user_message}
-
-Respond naturally and conversationally. Keep it brief and engaging."""
+            prompt = self._conversation_request(user_message, history, summary)
+        
+        if sampled():
+            logger.info(f"Prompt tokens: {prompt.token_counts}", extra=VERBOSE)
+        return prompt
+
+    def _recommendation_request(self, user_message: str, history: list, tracks, summary: str = None) -> BuiltPrompt:
+        if self.structured_output:
+            return self._structured_request(user_message, history, tracks, summary)
+        with stage("prompt"):
+            prompt = self.prompt_builder.build(
+                self.recommendation_prompt,
+                history,
+                f"""USER REQUEST: {user_message}
+
+Provide a brief intro explaining why these tracks work for the request, then exactly 3 track recommendations using the specified format with detailed ROI analysis, audience demographics, and proper Hoopr Smash links. End with a helpful follow-up question.""",
+                tracks=tracks,
+                empty_tracks_note="No tracks in the catalog match the requested filters.",
+                summary=summary
+            )
+        prompt.route = RECOMMEND_ROUTE
+        prompt_tokens.observe(prompt.token_counts["total"])
+        return prompt
+
+    def _structured_request(self, user_message: str, history: list, tracks, summary: str = None) -> BuiltPrompt:
+        with stage("prompt"):
+            prompt = self.prompt_builder.build(
+                self.structured_prompt,
+                history,
+                f"USER REQUEST: {user_message}\n\n{STRUCTURED_INSTRUCTIONS}",
+                tracks=tracks,
+                empty_tracks_note="No tracks in the catalog match the requested filters.",
+                summary=summary
+            )
+        prompt.output = "json"
+        prompt.route = RECOMMEND_ROUTE
+        prompt_tokens.observe(prompt.token_counts["total"])
+        return prompt
+
+    def _finish_reply(self, prompt: BuiltPrompt, response: str, catalog: Catalog) -> str:
+        """The reply to send for a completion; structured ones are checked against the catalog and rendered"""
+        if prompt.output != "json":
+            return response
+        with stage("render"):
+            return render_recommendations(response, catalog.by_code, prompt.track_codes)
+
+    def _completion_chunks(self, prompt: BuiltPrompt, catalog: Catalog):
+        """Stream a completion; a structured reply arrives whole, once rendered"""
+        if prompt.output == "json":
+            response = get_completion(prompt.text, is_json=False, track_codes=prompt.track_codes, catalog_version=catalog.version, route=prompt.route)
+            yield self._finish_reply(prompt, response, catalog)
+            return
+        yield from get_completion_stream(prompt.text, is_json=False, track_codes=prompt.track_codes, catalog_version=catalog.version, route=prompt.route)
+
+    async def _completion_chunks_async(self, prompt: BuiltPrompt, catalog: Catalog, deadline: float = None):
+        if prompt.output == "json":
+            response = await get_completion_async(prompt.text, is_json=False, track_codes=prompt.track_codes,
+                                                  catalog_version=catalog.version, deadline=deadline, route=prompt.route)
+            yield self._finish_reply(prompt, response, catalog)
+            return
+        async for chunk in get_completion_stream_async(prompt.text, is_json=False, track_codes=prompt.track_codes,
+                                                       catalog_version=catalog.version, deadline=deadline, route=prompt.route):
+            yield chunk
+
+    def _conversation_request(self, user_message: str, history: list, summary: str = None) -> BuiltPrompt:
+        with stage("prompt"):
+            prompt = self.prompt_builder.build(
+                self.conversation_prompt,
+                history,
+                f"""USER MESSAGE: {user_message}
+
+Respond naturally and conversationally. Keep it brief and engaging.""",
+                summary=summary
+            )
+        prompt.route = CHAT_ROUTE
+        prompt_tokens.observe(prompt.token_counts["total"])
+        return prompt
+
+    def chat(self, user_message: str, session_id: str = DEFAULT_SESSION) -> str:
+        """Send message and get MIRA response"""
+        started_at = time.time()
+        logger.debug(f"User message: {log_body(user_message)}")
+        intent = self._classify(user_message, session_id)
+        local = self._local_reply(user_message, session_id, intent, started_at)
+        if local is not None:
+            return local
+        # Pin the catalog for the whole request so a concurrent reload cannot mix versions
+        catalog = self.catalog
+        prompt = self._build_prompt(user_message, session_id, catalog, intent)
         
         try:
-            response = get_completion(prompt, is_json=False)
+            response = get_completion(prompt.text, is_json=False, track_codes=prompt.track_codes, catalog_version=catalog.version, route=prompt.route)
+            response = self._finish_reply(prompt, response, catalog)
             
-            # Store conversation
-            self.conversation.append(("User", user_message))
-            self.conversation.append(("MIRA", response))
-            
-            # Keep conversation manageable
-            if len(self.conversation) > 20:
-                self.conversation = self.conversation[-20:]
+            # Store conversation (the store keeps it to the last 20 turns)
+            self._record_exchange(session_id, user_message, response, started_at)
                 
-            logger.info(f"MIRA response generated successfully")
+            if sampled():
+                logger.info("MIRA response generated successfully", extra=VERBOSE)
             return response
             
         except Exception as e:
             logger.error(f"MIRA chat error: {e}")
             return "I'm having trouble right now. Please try again!"
 
-    def _build_conversation_context(self) -> str:
-        """Build conversation history"""
-        if not self.conversation:
-            return "This is the start of our conversation."
-
-        context_lines = []
-        for role, message in self.conversation[-8:]:  # Last 4 exchanges
-            context_lines.append(f"{role}: {message}")
+    def chat_stream(self, user_message: str, session_id: str = DEFAULT_SESSION):
+        """Send message and yield the MIRA response in chunks as it is generated"""
+        started_at = time.time()
+        logger.debug(f"User message (streaming): {log_body(user_message)}")
+        intent = self._classify(user_message, session_id)
+        local = self._local_reply(user_message, session_id, intent, started_at)
+        if local is not None:
+            yield local
+            return
+        catalog = self.catalog
+        prompt = self._build_prompt(user_message, session_id, catalog, intent)
         
-        return "\n".join(context_lines)
+        chunks = []
+        try:
+            for chunk in self._completion_chunks(prompt, catalog):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error(f"MIRA streaming chat error: {e}")
+            if not chunks:
+                yield "I'm having trouble right now. Please try again!"
+            return
+        
+        # Only record the exchange once the full reply has arrived
+        self._record_exchange(session_id, user_message, "".join(chunks), started_at)
+        if sampled():
+            logger.info("MIRA streamed response generated successfully", extra=VERBOSE)
+
+    async def _load_session_async(self, session_id: str):
+        """Do the conversation log read the next access to a session would make on a worker thread"""
+        if self.conversations.needs_load(session_id):
+            await asyncio.to_thread(self.conversations.load, session_id)
+
+    async def chat_async(self, user_message: str, session_id: str = DEFAULT_SESSION, deadline: float = None) -> str:
+        """chat() for the asyncio server; load-shedding errors propagate so the caller can answer 429/503"""
+        started_at = time.time()
+        logger.debug(f"User message (async): {log_body(user_message)}")
+        await self._load_session_async(session_id)
+        intent = self._classify(user_message, session_id)
+        local = self._local_reply(user_message, session_id, intent, started_at)
+        if local is not None:
+            return local
+        catalog = self.catalog
+        # Retrieval is CPU work; keep it off the event loop
+        prompt = await asyncio.to_thread(self._build_prompt, user_message, session_id, catalog, intent)
 
-    def reset(self):
+        try:
+            response = await get_completion_async(prompt.text, is_json=False, track_codes=prompt.track_codes,
+                                                  catalog_version=catalog.version, deadline=deadline, route=prompt.route)
+            response = self._finish_reply(prompt, response, catalog)
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"MIRA async chat error: {e}")
+            return "I'm having trouble right now. Please try again!"
+
+        await self._load_session_async(session_id)
+        self._record_exchange(session_id, user_message, response, started_at)
+        if sampled():
+            logger.info("MIRA async response generated successfully", extra=VERBOSE)
+        return response
+
+    async def chat_stream_async(self, user_message: str, session_id: str = DEFAULT_SESSION, deadline: float = None):
+        """chat_stream() for the asyncio server, as an async generator of chunks"""
+        started_at = time.time()
+        logger.debug(f"User message (async streaming): {log_body(user_message)}")
+        await self._load_session_async(session_id)
+        intent = self._classify(user_message, session_id)
+        local = self._local_reply(user_message, session_id, intent, started_at)
+        if local is not None:
+            yield local
+            return
+        catalog = self.catalog
+        prompt = await asyncio.to_thread(self._build_prompt, user_message, session_id, catalog, intent)
+
+        chunks = []
+        try:
+            async for chunk in self._completion_chunks_async(prompt, catalog, deadline):
+                chunks.append(chunk)
+                yield chunk
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"MIRA async streaming chat error: {e}")
+            if not chunks:
+                yield "I'm having trouble right now. Please try again!"
+            return
+
+        await self._load_session_async(session_id)
+        self._record_exchange(session_id, user_message, "".join(chunks), started_at)
+        if sampled():
+            logger.info("MIRA async streamed response generated successfully", extra=VERBOSE)
+
+    def _prepare_batch(self, user_messages: list, catalog: Catalog) -> list:
+        """(intent, local reply, prompt) for each message of a batch; exactly one of reply / prompt is set
+
+        Batch messages are independent: no session history is used. Retrieval
+        cache misses across the batch are ranked in one _get_relevant_tracks_batch
+        call.
+        """
+        intents = [self._classify(message) for message in user_messages]
+        wanted = [index for index, intent in enumerate(intents) if intent.label == RECOMMEND]
+        with stage("retrieval"):
+            lookups = {}
+            missed = {}
+            for index in wanted:
+                facets = parse_facets(user_messages[index])
+                query = self._retrieval_query(user_messages[index])
+                key = self._retrieval_key(query, facets, catalog)
+                entry = self.retrieval_cache.get(key, 15)
+                if entry is None and key not in missed:
+                    missed[key] = (query, facets)
+                lookups[index] = (key, facets, entry)
+            if missed:
+                queries = [query for query, _ in missed.values()]
+                allowed = [catalog.facets.match(facets) for _, facets in missed.values()]
+                for key, relevant_tracks in zip(missed, self._get_relevant_tracks_batch(queries, 15, catalog, allowed)):
+                    missed[key] = RetrievalEntry(relevant_tracks, 15)
+                    self.retrieval_cache.put(key, missed[key])
+            tracks = {
+                index: self._offered_tracks(entry or missed[key], facets, catalog)
+                for index, (key, facets, entry) in lookups.items()
+            }
+
+        plans = []
+        for index, (message, intent) in enumerate(zip(user_messages, intents)):
+            if intent.label == GREETING:
+                plans.append((intent, self.greeting_reply, None))
+            elif intent.label == OFF_TOPIC:
+                plans.append((intent, self.off_topic_reply, None))
+            elif index in tracks:
+                plans.append((intent, None, self._recommendation_request(message, [], tracks[index])))
+            else:
+                plans.append((intent, None, self._conversation_request(message, [])))
+        return plans
+
+    @staticmethod
+    def _batch_result(index: int, intent: Intent, response: str, error: str, started: float,
+                      queued: float = None, completed: float = None) -> dict:
+        """One /chat/batch item; timings are milliseconds since the batch started"""
+        finished = time.perf_counter()
+        queued = queued or finished
+        completed = completed or finished
+        return {
+            "index": index,
+            "intent": intent.label,
+            "response": response,
+            "error": error,
+            "timing": {
+                "queue_ms": round((queued - started) * 1000, 1),
+                "completion_ms": round((completed - queued) * 1000, 1),
+                "total_ms": round((finished - started) * 1000, 1)
+            }
+        }
+
+    def chat_batch(self, user_messages: list):
+        """Answer many independent messages, yielding each result as soon as it completes
+
+        Intent detection and retrieval run once for the whole batch, then the
+        completions fan out over the shared batch pool, so throughput scales
+        with MIRA_BATCH_CONCURRENCY. Conversations are not touched.
+        """
+        started = time.perf_counter()
+        catalog = self.catalog
+        plans = self._prepare_batch(user_messages, catalog)
+        logger.info(f"Prepared batch of {len(plans)} messages in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        def complete(index, intent, prompt):
+            queued = time.perf_counter()
+            try:
+                response = get_completion(prompt.text, is_json=False, track_codes=prompt.track_codes,
+                                          catalog_version=catalog.version, route=prompt.route)
+                response = self._finish_reply(prompt, response, catalog)
+                return self._batch_result(index, intent, response, None, started, queued)
+            except Exception as e:
+                logger.error(f"MIRA batch item {index} error: {e}")
+                return self._batch_result(index, intent, None, str(e), started, queued)
+
+        futures = []
+        for index, (intent, reply, prompt) in enumerate(plans):
+            if prompt is None:
+                yield self._batch_result(index, intent, reply, None, started)
+            else:
+                futures.append(self.batch_executor.submit(complete, index, intent, prompt))
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # The consumer went away (e.g. the client disconnected); drop work that has not started
+            for future in futures:
+                future.cancel()
+
+    async def chat_batch_async(self, user_messages: list, deadline: float = None, item_seconds: float = None):
+        """chat_batch() for the asyncio server, as an async generator of results
+
+        At most MIRA_BATCH_CONCURRENCY completions of one batch wait on the
+        model at a time; a shed or timed-out item reports its error (and
+        retry_after) without failing the rest. Each item gets `item_seconds`
+        (MIRA_REQUEST_DEADLINE by default) from when its turn comes, so items
+        waiting for one never run out of time; `deadline`, if given, caps
+        the whole batch.
+        """
+        started = time.perf_counter()
+        catalog = self.catalog
+        plans = await asyncio.to_thread(self._prepare_batch, user_messages, catalog)
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def complete(index, intent, prompt):
+            async with semaphore:
+                queued = time.perf_counter()
+                item_deadline = time.monotonic() + (item_seconds or request_deadline)
+                if deadline is not None:
+                    item_deadline = min(item_deadline, deadline)
+                try:
+                    response = await get_completion_async(prompt.text, is_json=False, track_codes=prompt.track_codes,
+                                                          catalog_version=catalog.version, deadline=item_deadline,
+                                                          route=prompt.route)
+                    response = self._finish_reply(prompt, response, catalog)
+                    return self._batch_result(index, intent, response, None, started, queued)
+                except Overloaded as e:
+                    result = self._batch_result(index, intent, None, str(e), started, queued)
+                    result["retry_after"] = e.retry_after
+                    return result
+                except Exception as e:
+                    logger.error(f"MIRA async batch item {index} error: {e}")
+                    return self._batch_result(index, intent, None, str(e), started, queued)
+
+        tasks = []
+        for index, (intent, reply, prompt) in enumerate(plans):
+            if prompt is None:
+                yield self._batch_result(index, intent, reply, None, started)
+            else:
+                tasks.append(asyncio.ensure_future(complete(index, intent, prompt)))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @property
+    def conversation(self) -> list:
+        """History of the default session, as used by the REPL"""
+        return self.conversations.history(DEFAULT_SESSION)
+
+    def reset(self, session_id: str = DEFAULT_SESSION):
         """Clear conversation history"""
-        self.conversation = []
-        logger.info("MIRA conversation reset")
+        self.conversations.reset(session_id)
+        self.summaries.reset(session_id)
+        logger.info(f"MIRA conversation reset for session {session_id}")
         print(" MIRA: Let's start fresh! What can I help you with?")
 
-    def get_stats(self):
-        """Get statistics about loaded tracks"""
-        if not self.tracks_data:
+    def get_stats(self, catalog: Catalog = None):
+        """Get statistics about loaded tracks (of `catalog`, by default the current one)"""
+        stats = (catalog or self.catalog).stats
+        if not stats.total:
             return "No tracks loaded"
 
-        total = len(self.tracks_data)
-        with_vocals = sum(1 for track in self.tracks_data if track.get('hasVocals', '').lower() in ['true', '1', 'yes'])
-        explicit = sum(1 for track in self.tracks_data if track.get('isExplicit', '').lower() in ['true', '1', 'yes'])
+        total = stats.total
+        with_vocals = stats.with_vocals
+        explicit = stats.explicit
         
         return f"📊 Stats: {total} tracks loaded | {with_vocals} with vocals | {explicit} explicit"
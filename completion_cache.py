@@ -0,0 +1,248 @@
+import atexit
+import hashlib
+import queue
+import re
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+import sqlite_fork
+
+logger = logging.getLogger("hoopr")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def make_cache_key(prompt: str, model: str, track_codes=(), catalog_version: str = "") -> str:
+    """Hash of the normalized prompt, model name, candidate track codes and catalog version"""
+    normalized = _WHITESPACE_RE.sub(" ", prompt).strip().casefold()
+    digest = hashlib.sha256()
+    for part in (model, catalog_version, ",".join(track_codes), normalized):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+_SET = "set"
+_RETAIN = "retain"
+_STOP = None
+
+
+class CompletionCache:
+    """Two-tier completion cache: a bounded in-memory LRU in front of SQLite
+
+    Entries expire after `ttl_seconds`. Every entry remembers the catalog
+    version it was produced for, and switching catalogs drops entries from
+    other versions in both tiers.
+
+    The memory tier is checked under a lock that never waits on the disk;
+    disk lookups run outside it, and disk writes are queued for a writer
+    thread that commits them in batches and prunes expired rows and rows
+    beyond `max_disk_entries`.
+    """
+
+    def __init__(self, db_path: str = None, max_entries: int = 1024, ttl_seconds: float = 86400,
+                 max_disk_entries: int = 100000, max_queue: int = 10000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.max_queue = max_queue
+        self.catalog_version = ""
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.dropped_writes = 0
+        self._memory = OrderedDict()
+        self.db_path = db_path
+        self._reset_state()
+        self._db = self._open_db()
+        if db_path:
+            # SQLite connections must not be used across fork(); pre-forked workers open their own
+            sqlite_fork.register(self._reopen_after_fork)
+            atexit.register(self.close)
+
+    def _reset_state(self):
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._queue = queue.Queue(self.max_queue)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def _open_db(self):
+        if not self.db_path:
+            return None
+        try:
+            db = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "catalog_version TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS completions_created ON completions (created_at)")
+            db.commit()
+            return db
+        except sqlite3.Error as e:
+            logger.error(f"Completion cache disk tier disabled ({self.db_path}): {e}")
+            return None
+
+    def _reopen_after_fork(self):
+        sqlite_fork.abandon(self._db)
+        self._reset_state()
+        self._db = self._open_db()
+
+    def get(self, key: str):
+        """Return the cached completion for key, or None on a miss"""
+        value = self.get_memory(key)
+        return value if value is not None else self.get_disk(key)
+
+    def get_memory(self, key: str):
+        """Memory-tier lookup; a miss here is not counted, since get_disk() decides it"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+        return None
+
+    def get_disk(self, key: str):
+        """Disk-tier lookup after a memory miss; blocks on SQLite, so keep it off an event loop"""
+        row = None
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT value, created_at FROM completions WHERE key = ?", (key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Completion cache disk lookup failed: {e}")
+        with self._lock:
+            if row is not None and time.time() - row[1] < self.ttl_seconds:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    @property
+    def has_disk(self) -> bool:
+        return self._db is not None
+
+    def set(self, key: str, value: str, catalog_version: str = None):
+        """Store a completion in memory and queue it for the disk tier
+
+        catalog_version is the version the completion was generated against
+        (the one in its key). A completion that finishes after the catalog
+        was swapped is dropped instead of being kept under the new version.
+        """
+        now = time.time()
+        with self._lock:
+            if catalog_version is None:
+                catalog_version = self.catalog_version
+            elif catalog_version != self.catalog_version:
+                return
+            self._remember(key, value, now)
+        if self._db is not None:
+            self._enqueue((_SET, key, value, catalog_version, now))
+
+    def _remember(self, key: str, value: str, created_at: float):
+        """Insert into the memory tier, evicting the least recently used entry (caller holds the lock)"""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def set_catalog_version(self, catalog_version: str):
+        """Switch to a new track catalog, dropping completions made for any other version"""
+        with self._lock:
+            if catalog_version == self.catalog_version:
+                return
+            self.catalog_version = catalog_version
+            self._memory.clear()
+        if self._db is not None:
+            self._enqueue((_RETAIN, catalog_version))
+        logger.info(f"Completion cache bound to catalog version {catalog_version}")
+
+    def _enqueue(self, operation: tuple):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, name="completion-cache", daemon=True)
+                    self._writer.start()
+        try:
+            self._queue.put_nowait(operation)
+        except queue.Full:
+            # Only the disk copy is lost; the memory tier already has the entry
+            self.dropped_writes += 1
+
+    def _run(self):
+        db = self._open_db()
+        if db is None:
+            return
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(db, [operation for operation in batch if operation is not _STOP])
+            if _STOP in batch:
+                db.close()
+                return
+
+    def _write(self, db, batch: list):
+        """Commit queued writes in one transaction, then prune if it is time"""
+        now = time.time()
+        prune = now - self._pruned_at >= 600
+        try:
+            with db:
+                for operation in batch:
+                    if operation[0] == _SET:
+                        db.execute(
+                            "INSERT OR REPLACE INTO completions (key, value, catalog_version, created_at) VALUES (?, ?, ?, ?)",
+                            operation[1:]
+                        )
+                    else:
+                        db.execute("DELETE FROM completions WHERE catalog_version != ?", operation[1:])
+                        prune = True
+                if prune:
+                    self._pruned_at = now
+                    db.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+                    db.execute(
+                        "DELETE FROM completions WHERE key IN "
+                        "(SELECT key FROM completions ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"Failed to persist {len(batch)} cached completions: {e}")
+
+    def close(self, timeout: float = 5.0):
+        """Commit queued writes and stop the writer"""
+        writer = self._writer
+        if writer is None or not writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        writer.join(timeout)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "queued_writes": self._queue.qsize(),
+                "dropped_writes": self.dropped_writes,
+            }
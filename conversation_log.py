@@ -0,0 +1,262 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from collections import Counter
+import sqlite_fork
+
+logger = logging.getLogger("hoopr")
+
+_APPEND = "append"
+_RESET = "reset"
+_STOP = None
+
+
+class ConversationLog:
+    """Durable conversation turns in SQLite (WAL mode), written behind the request path
+
+    append() and reset() only put an operation on a queue. One writer thread
+    drains the queue and commits everything waiting in a single transaction,
+    so under load turns are written in batches and a request never waits on
+    the disk. If the writer falls `max_queue` operations behind, new writes
+    are dropped (and counted) rather than blocking a request.
+
+    Reads (lazy reloads, pagination) query the database directly after
+    waiting, briefly, for that session's queued writes. Rows are ordered by
+    their rowid, which also serves as the pagination cursor.
+
+    A `shared` log is written by several processes (pre-forked workers
+    always share their parent's). A ConversationStore then polls changes()
+    every `sync_seconds` and re-reads the sessions written to or reset
+    elsewhere; resets leave a row in `resets` for that.
+    """
+
+    def __init__(self, db_path: str, max_queue: int = 50000, batch_size: int = 512, retention_days: float = 30,
+                 shared: bool = False, sync_seconds: float = 1.0):
+        self.db_path = db_path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.retention_seconds = retention_days * 86400
+        self.shared = shared
+        self.sync_seconds = sync_seconds
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed = 0
+        self._reset_state()
+        self._read_db = self._connect()
+        sqlite_fork.register(self._reopen_after_fork)
+        atexit.register(self.close)
+
+    def _reset_state(self):
+        self._queue = queue.Queue(self.max_queue)
+        # Queued operations per session; reads wait for them to be committed
+        self._pending = Counter()
+        self._pending_changed = threading.Condition()
+        self._read_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL stays consistent on a crash; only the last commits may be lost
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, "
+            "message TEXT NOT NULL, created_at REAL NOT NULL, latency_ms REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS resets ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        db.commit()
+        return db
+
+    def _reopen_after_fork(self):
+        # The parent's queue and writer thread do not exist here
+        sqlite_fork.abandon(self._read_db)
+        self._reset_state()
+        # The parent and any sibling workers write to the same database
+        self.shared = True
+        self._read_db = self._connect()
+
+    def append(self, session_id: str, role: str, message: str, created_at: float, latency_ms: float = None):
+        """Queue one turn for writing"""
+        self._enqueue(session_id, (_APPEND, session_id, role, message, created_at, latency_ms))
+
+    def reset(self, session_id: str):
+        """Queue the deletion of a session's turns"""
+        self._enqueue(session_id, (_RESET, session_id))
+
+    def _enqueue(self, session_id: str, operation: tuple):
+        self._start_writer()
+        with self._pending_changed:
+            try:
+                self._queue.put_nowait(operation)
+            except queue.Full:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"Conversation log is {self.max_queue} writes behind; dropped {self.dropped} so far")
+                return
+            self._pending[session_id] += 1
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            self._write(db, [operation for operation in batch if operation is not _STOP])
+            if stop:
+                db.close()
+                return
+
+    def _write(self, db, batch: list):
+        """Commit a batch in one transaction, then release readers waiting on those sessions"""
+        if batch:
+            try:
+                with db:
+                    for operation in batch:
+                        if operation[0] == _APPEND:
+                            db.execute("INSERT INTO turns (session_id, role, message, created_at, latency_ms) "
+                                       "VALUES (?, ?, ?, ?, ?)", operation[1:])
+                        else:
+                            db.execute("DELETE FROM turns WHERE session_id = ?", operation[1:])
+                            db.execute("INSERT INTO resets (session_id, created_at) VALUES (?, ?)",
+                                       (operation[1], time.time()))
+                self.written += len(batch)
+                self.batches += 1
+            except sqlite3.Error as e:
+                self.failed += len(batch)
+                logger.error(f"Conversation log write of {len(batch)} operations failed: {e}")
+            with self._pending_changed:
+                self._pending.subtract(operation[1] for operation in batch)
+                self._pending += Counter()
+                self._pending_changed.notify_all()
+        self._prune(db)
+
+    def _prune(self, db):
+        """Delete turns older than the retention period, at most once an hour"""
+        now = time.time()
+        if not self.retention_seconds or now - self._pruned_at < 3600:
+            return
+        self._pruned_at = now
+        try:
+            with db:
+                db.execute("DELETE FROM turns WHERE created_at < ?", (now - self.retention_seconds,))
+                db.execute("DELETE FROM resets WHERE created_at < ?", (now - self.retention_seconds,))
+        except sqlite3.Error as e:
+            logger.warning(f"Conversation log pruning failed: {e}")
+
+    def _wait_for(self, session_id: str, timeout: float = 1.0):
+        """Wait until a session's queued writes are committed (or the timeout passes)"""
+        with self._pending_changed:
+            self._pending_changed.wait_for(lambda: not self._pending[session_id], timeout)
+
+    def _query(self, sql: str, params: tuple) -> list:
+        try:
+            with self._read_lock:
+                return self._read_db.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Conversation log read failed: {e}")
+            return []
+
+    def recent(self, session_id: str, limit: int) -> list:
+        """The last `limit` turns of a session as (id, role, message, created_at, latency_ms), oldest first"""
+        self._wait_for(session_id)
+        rows = self._query(
+            "SELECT id, role, message, created_at, latency_ms FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit)
+        )
+        rows.reverse()
+        return rows
+
+    def page(self, session_id: str, before: int = None, limit: int = 50) -> list:
+        """Up to `limit` turns older than the turn with id `before` (or the newest ones), oldest first"""
+        if before is None:
+            return self.recent(session_id, limit)
+        self._wait_for(session_id)
+        rows = self._query(
+            "SELECT id, role, message, created_at, latency_ms FROM turns WHERE session_id = ? AND id < ? "
+            "ORDER BY id DESC LIMIT ?",
+            (session_id, before, limit)
+        )
+        rows.reverse()
+        return rows
+
+    def cursor(self) -> tuple:
+        """The (newest turn id, newest reset id) to start polling changes() from"""
+        rows = self._query("SELECT (SELECT MAX(id) FROM turns), (SELECT MAX(id) FROM resets)", ())
+        turn_id, reset_id = rows[0] if rows else (None, None)
+        return turn_id or 0, reset_id or 0
+
+    def changes(self, cursor: tuple):
+        """(sessions written to, sessions reset, new cursor) since `cursor`, by any process using the database"""
+        turn_id, reset_id = cursor
+        written = self._query("SELECT session_id, MAX(id) FROM turns WHERE id > ? GROUP BY session_id", (turn_id,))
+        cleared = self._query("SELECT id, session_id FROM resets WHERE id > ?", (reset_id,))
+        cursor = (max([turn_id] + [row[1] for row in written]), max([reset_id] + [row[0] for row in cleared]))
+        return {row[0] for row in written}, {row[1] for row in cleared}, cursor
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is committed"""
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Commit what is queued and stop the writer"""
+        writer = self._writer
+        if writer is None or not writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        writer.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+def conversation_log_from_env():
+    """The log configured by MIRA_CONVERSATION_DB ("" to keep conversations in memory only), or None
+
+    Set MIRA_CONVERSATION_SHARED=1 when separately started processes write
+    to the same database.
+    """
+    db_path = os.getenv("MIRA_CONVERSATION_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.sqlite3"))
+    if not db_path:
+        return None
+    try:
+        return ConversationLog(
+            db_path,
+            max_queue=int(os.getenv("MIRA_CONVERSATION_LOG_QUEUE", "50000")),
+            retention_days=float(os.getenv("MIRA_CONVERSATION_RETENTION_DAYS", "30")),
+            shared=os.getenv("MIRA_CONVERSATION_SHARED", "0") == "1",
+            sync_seconds=float(os.getenv("MIRA_CONVERSATION_SYNC_SECONDS", "1"))
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Conversation persistence disabled ({db_path}): {e}")
+        return None
@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import count, islice
+
+DEFAULT_SESSION = "default"
+
+_epochs = count(1)
+
+
+class _Session:
+    __slots__ = ('turns', 'times', 'last_access', 'appended', 'epoch', 'log_id', 'unsynced')
+
+    def __init__(self, max_turns: int):
+        self.turns = deque(maxlen=max_turns)
+        # (created_at, latency_ms) of each turn, kept alongside `turns`
+        self.times = deque(maxlen=max_turns)
+        self.last_access = time.monotonic()
+        # Turns ever appended, so turn i of `turns` has sequence number appended - len(turns) + i
+        self.appended = 0
+        # Distinguishes a recreated session from the one it replaced under the same id
+        self.epoch = next(_epochs)
+        # With a log: id of the newest logged turn held, and turns appended here since it was read
+        self.log_id = 0
+        self.unsynced = 0
+
+
+class _Shard:
+    __slots__ = ('lock', 'sessions')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+
+class ConversationStore:
+    """Session-keyed conversation history with LRU and idle-TTL eviction
+
+    Sessions are spread over independently locked shards so concurrent
+    requests for different sessions never contend on one lock. Each shard
+    keeps its sessions in access order, which makes both LRU eviction and
+    expiry of idle sessions O(1) per evicted entry.
+
+    With a ConversationLog, every turn is also queued for durable storage,
+    and a session that is not in memory (after a restart or eviction) is
+    reloaded from the log the first time it is accessed. When the log is
+    shared with other processes, a background thread asks it every
+    `log.sync_seconds` which sessions were written to or reset since, and
+    re-reads those held here; requests only read the log on a miss.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 3600, max_turns: int = 20, num_shards: int = 16,
+                 log=None):
+        self.max_turns = max_turns
+        self.log = log
+        self.ttl_seconds = ttl_seconds
+        self.num_shards = num_shards
+        self.max_sessions_per_shard = max(1, max_sessions // num_shards)
+        self._shards = [_Shard() for _ in range(num_shards)]
+        self._reset_refresher()
+        os.register_at_fork(after_in_child=self._reset_refresher)
+
+    def _reset_refresher(self):
+        # Threads do not survive fork(); each process starts its own
+        self._refresher = None
+        self._refresher_lock = threading.Lock()
+        # Rounds of changes() polled so far, and sessions loaded while one ran (their read may predate it)
+        self._rounds = 0
+        self._recheck = set()
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[hash(session_id) % self.num_shards]
+
+    def _evict(self, shard: _Shard, now: float):
+        """Drop idle sessions and trim the shard to capacity (caller holds the lock)"""
+        sessions = shard.sessions
+        while sessions:
+            oldest = next(iter(sessions.values()))
+            if now - oldest.last_access < self.ttl_seconds:
+                break
+            sessions.popitem(last=False)
+        while len(sessions) > self.max_sessions_per_shard:
+            sessions.popitem(last=False)
+
+    def _get(self, shard: _Shard, session_id: str, create: bool):
+        """Look up a session and mark it most recently used (caller holds the lock)"""
+        now = time.monotonic()
+        session = shard.sessions.get(session_id)
+        if session is not None and now - session.last_access >= self.ttl_seconds:
+            del shard.sessions[session_id]
+            session = None
+        if session is None:
+            if not create:
+                return None
+            session = _Session(self.max_turns)
+            shard.sessions[session_id] = session
+            self._evict(shard, now)
+        else:
+            shard.sessions.move_to_end(session_id)
+        session.last_access = now
+        return session
+
+    def needs_load(self, session_id: str) -> bool:
+        """Whether the next access to a session reads the log (so async callers can do it off the event loop)"""
+        if self.log is None:
+            return False
+        shard = self._shard(session_id)
+        with shard.lock:
+            return self._get(shard, session_id, create=False) is None
+
+    def load(self, session_id: str):
+        """Reload a session from the log if it is not in memory; the read happens outside the shard lock
+
+        A session the log has no turns for is created empty, so later
+        accesses to a new session stay in memory.
+        """
+        if not self.needs_load(session_id):
+            return
+        if self.log.shared:
+            # Started before the read, so nothing written elsewhere after it goes unnoticed
+            self._start_refresher()
+        shard = self._shard(session_id)
+        rounds = self._rounds
+        rows = self.log.recent(session_id, self.max_turns)
+        with shard.lock:
+            if self._get(shard, session_id, create=False) is not None:
+                return
+            self._sync(self._get(shard, session_id, create=True), rows)
+        if self._rounds != rounds:
+            with self._refresher_lock:
+                self._recheck.add(session_id)
+
+    def _start_refresher(self):
+        if self._refresher is not None:
+            return
+        with self._refresher_lock:
+            if self._refresher is None:
+                cursor = self.log.cursor()
+                self._refresher = threading.Thread(target=self._refresh, args=(cursor,), name="conversation-refresh",
+                                                   daemon=True)
+                self._refresher.start()
+
+    def _refresh(self, cursor: tuple):
+        """Re-read the sessions held here that were written to or reset through the log since the last round"""
+        stale, reset = set(), set()
+        while True:
+            time.sleep(self.log.sync_seconds)
+            written, cleared, cursor = self.log.changes(cursor)
+            self._rounds += 1
+            with self._refresher_lock:
+                stale |= written | cleared | self._recheck
+                self._recheck.clear()
+            reset |= cleared
+            for session_id in list(stale):
+                if self._resync(session_id, session_id in reset):
+                    stale.discard(session_id)
+                    reset.discard(session_id)
+
+    def _resync(self, session_id: str, reset: bool) -> bool:
+        """Re-read one session if it is held here; False to retry next round (it was appended to meanwhile)"""
+        shard = self._shard(session_id)
+        with shard.lock:
+            session = shard.sessions.get(session_id)
+            if session is None:
+                return True
+            appended = session.appended
+        rows = self.log.recent(session_id, self.max_turns)
+        with shard.lock:
+            if shard.sessions.get(session_id) is not session:
+                return True
+            if session.appended != appended:
+                return False
+            self._sync(session, rows, reset)
+        return True
+
+    def _sync(self, session: _Session, rows: list, reset: bool = False):
+        """Replace a session's turns with the newest logged ones (caller holds the lock)"""
+        # The log holds fewer turns than memory, or lost the newest one seen here before the window filled: reset elsewhere
+        reset = reset or len(rows) < len(session.turns) or (
+            session.log_id and rows and rows[0][0] > session.log_id and len(rows) < self.max_turns)
+        if reset or not session.log_id and not session.turns:
+            if session.turns:
+                session.epoch = next(_epochs)
+            session.appended = len(rows)
+        else:
+            # Logged turns newer than the last re-read include the ones appended here, already counted
+            fresh = sum(1 for row in rows if row[0] > session.log_id)
+            session.appended += max(0, fresh - session.unsynced)
+        session.turns.clear()
+        session.times.clear()
+        for _, role, message, created_at, latency_ms in rows:
+            session.turns.append((role, message))
+            session.times.append((created_at, latency_ms))
+        session.log_id = rows[-1][0] if rows else 0
+        session.unsynced = 0
+
+    def append(self, session_id: str, *turns):
+        """Append (role, message) or (role, message, created_at, latency_ms) turns, trimming the oldest ones"""
+        self.load(session_id)
+        now = time.time()
+        shard = self._shard(session_id)
+        with shard.lock:
+            session = self._get(shard, session_id, create=True)
+            for role, message, *times in turns:
+                created_at, latency_ms = times if times else (now, None)
+                session.turns.append((role, message))
+                session.times.append((created_at, latency_ms))
+                if self.log is not None:
+                    self.log.append(session_id, role, message, created_at, latency_ms)
+            session.appended += len(turns)
+            session.unsynced += len(turns)
+
+    def history(self, session_id: str, limit: int = None) -> list:
+        """Return a copy of the last `limit` turns of a session"""
+        self.load(session_id)
+        shard = self._shard(session_id)
+        with shard.lock:
+            session = self._get(shard, session_id, create=False)
+            if session is None:
+                return []
+            turns = session.turns
+            if limit is None or limit >= len(turns):
+                return list(turns)
+            return list(islice(turns, len(turns) - limit, None))
+
+    def window(self, session_id: str):
+        """Return (epoch, sequence number of the first stored turn, turns) for a session
+
+        epoch is None when the session does not exist.
+        """
+        self.load(session_id)
+        shard = self._shard(session_id)
+        with shard.lock:
+            session = self._get(shard, session_id, create=False)
+            if session is None:
+                return None, 0, []
+            return session.epoch, session.appended - len(session.turns), list(session.turns)
+
+    def page(self, session_id: str, before: int = None, limit: int = 50):
+        """(turns, next cursor) for paging backwards through a session, newest page first
+
+        Turns are dicts with an id, role, message, created_at and latency_ms,
+        oldest first. Pass the returned cursor as `before` to get the page
+        preceding this one; it is None on the oldest page. With a log the
+        whole durable history is paged, otherwise the turns held in memory.
+        """
+        if self.log is not None:
+            rows = self.log.page(session_id, before, limit + 1)
+        else:
+            shard = self._shard(session_id)
+            with shard.lock:
+                session = self._get(shard, session_id, create=False)
+                first_seq = session.appended - len(session.turns) if session is not None else 0
+                rows = [(first_seq + i, role, message, created_at, latency_ms)
+                        for i, ((role, message), (created_at, latency_ms))
+                        in enumerate(zip(session.turns, session.times) if session is not None else ())]
+            if before is not None:
+                rows = [row for row in rows if row[0] < before]
+            rows = rows[-(limit + 1):]
+        more = len(rows) > limit
+        rows = rows[-limit:] if limit > 0 else []
+        turns = [{"id": turn_id, "role": role, "message": message, "created_at": created_at, "latency_ms": latency_ms}
+                 for turn_id, role, message, created_at, latency_ms in rows]
+        return turns, (rows[0][0] if more and rows else None)
+
+    def length(self, session_id: str) -> int:
+        """Number of turns stored for a session"""
+        self.load(session_id)
+        shard = self._shard(session_id)
+        with shard.lock:
+            session = shard.sessions.get(session_id)
+            return len(session.turns) if session is not None else 0
+
+    def reset(self, session_id: str):
+        """Forget a session's history"""
+        shard = self._shard(session_id)
+        with shard.lock:
+            shard.sessions.pop(session_id, None)
+        if self.log is not None:
+            self.log.reset(session_id)
+
+    def __len__(self) -> int:
+        return sum(len(shard.sessions) for shard in self._shards)
@@ -0,0 +1,179 @@
+import os
+import re
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from prompt_budget import truncate_to_tokens
+
+logger = logging.getLogger("hoopr")
+
+# "Track: Name - [Hoopr Smash Link](https://hooprsmash.com/tracks/slug/CODE)" as MIRA formats recommendations
+_RECOMMENDATION_RE = re.compile(
+    r"Track:\**\s*(?P<name>[^\n\[]+?)\s*-\s*\[[^\]]*\]\(https?://hooprsmash\.com/tracks/[^/\s)]+/(?P<code>[^/\s)]+)\)"
+)
+_LINK_CODE_RE = re.compile(r"hooprsmash\.com/tracks/[^/\s)]+/([^/\s)\]]+)")
+
+
+def extract_recommendations(message: str) -> list:
+    """(track_code, name) pairs recommended in a MIRA reply, in order"""
+    found = OrderedDict()
+    for match in _RECOMMENDATION_RE.finditer(message):
+        found.setdefault(match.group('code'), match.group('name').strip('*[] '))
+    for code in _LINK_CODE_RE.findall(message):
+        found.setdefault(code, '')
+    return list(found.items())
+
+
+class SessionMemory:
+    """Folded-away history of one session: recent requests and every track already recommended"""
+
+    __slots__ = ('epoch', 'requests', 'recommended', 'folded_upto', 'scanned_upto', 'folded_turns',
+                 'summary', 'recommended_codes')
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.requests = []
+        self.recommended = OrderedDict()
+        # Turns with sequence numbers below these are folded into the summary / scanned for tracks
+        self.folded_upto = 0
+        self.scanned_upto = 0
+        self.folded_turns = 0
+        # Rendered once per fold and reused by every prompt until the next one
+        self.summary = ""
+        self.recommended_codes = frozenset()
+
+    def copy(self) -> "SessionMemory":
+        memory = SessionMemory(self.epoch)
+        memory.requests = list(self.requests)
+        memory.recommended = OrderedDict(self.recommended)
+        memory.folded_upto = self.folded_upto
+        memory.scanned_upto = self.scanned_upto
+        memory.folded_turns = self.folded_turns
+        return memory
+
+
+class ConversationSummarizer:
+    """Rolling per-session summaries maintained off the request path
+
+    After each exchange a background worker folds turns older than the
+    last `keep_recent` into a compact summary (the user's earlier requests)
+    and records every track MIRA has recommended, so prompts stay about the
+    same size however long a session runs and tracks are not repeated.
+    Summaries are cached per session and rebuilt only for new turns.
+    """
+
+    def __init__(self, store, keep_recent: int = 4, max_requests: int = 6, max_recommended: int = 60,
+                 max_sessions: int = 10000, max_summary_tokens: int = 300, summary_tracks: int = 15):
+        self.store = store
+        self.keep_recent = keep_recent
+        self.max_requests = max_requests
+        self.max_recommended = max_recommended
+        self.max_sessions = max_sessions
+        self.max_summary_tokens = max_summary_tokens
+        self.summary_tracks = summary_tracks
+        self._memories = OrderedDict()
+        self._pending = set()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+        # A forked child inherits the executor without its thread; start over with a fresh one
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._dirty = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+
+    def schedule(self, session_id: str):
+        """Queue a background fold for a session; repeated calls while one is queued are merged"""
+        with self._lock:
+            if session_id in self._pending:
+                self._dirty.add(session_id)
+                return
+            self._pending.add(session_id)
+        self._executor.submit(self._run, session_id)
+
+    def _run(self, session_id: str):
+        while True:
+            try:
+                self.fold(session_id)
+            except Exception as e:
+                logger.error(f"Conversation summary for session {session_id} failed: {e}")
+            with self._lock:
+                if session_id not in self._dirty:
+                    self._pending.discard(session_id)
+                    return
+                self._dirty.discard(session_id)
+
+    def fold(self, session_id: str):
+        """Bring a session's memory up to date with its stored turns"""
+        epoch, first_seq, turns = self.store.window(session_id)
+        if epoch is None:
+            self.reset(session_id)
+            return
+        with self._lock:
+            memory = self._memories.get(session_id)
+        # Work on a copy and publish it whole, so readers never see a half-updated memory
+        if memory is None or memory.epoch != epoch:
+            memory = SessionMemory(epoch)
+        else:
+            memory = memory.copy()
+
+        end_seq = first_seq + len(turns)
+        for seq in range(max(memory.scanned_upto, first_seq), end_seq):
+            role, message = turns[seq - first_seq]
+            if role != "User":
+                for code, name in extract_recommendations(message):
+                    memory.recommended.pop(code, None)
+                    memory.recommended[code] = name
+        while len(memory.recommended) > self.max_recommended:
+            memory.recommended.popitem(last=False)
+        memory.scanned_upto = end_seq
+
+        fold_end = end_seq - self.keep_recent
+        for seq in range(max(memory.folded_upto, first_seq), fold_end):
+            role, message = turns[seq - first_seq]
+            if role == "User":
+                request = truncate_to_tokens(message, 25)
+                # Repeated requests are listed once, at their latest position
+                if request in memory.requests:
+                    memory.requests.remove(request)
+                memory.requests.append(request)
+            memory.folded_turns += 1
+        del memory.requests[:-self.max_requests]
+        memory.folded_upto = max(memory.folded_upto, fold_end)
+        memory.summary = self.summary_text(memory)
+        memory.recommended_codes = frozenset(memory.recommended)
+
+        with self._lock:
+            self._memories[session_id] = memory
+            self._memories.move_to_end(session_id)
+            while len(self._memories) > self.max_sessions:
+                self._memories.popitem(last=False)
+
+    def get(self, session_id: str, epoch):
+        """The current memory for a session, or None if nothing is cached for this incarnation of it"""
+        with self._lock:
+            memory = self._memories.get(session_id)
+        if memory is None or memory.epoch != epoch:
+            return None
+        return memory
+
+    def summary_text(self, memory: SessionMemory) -> str:
+        """Compact prompt text for a session's folded history ('' when nothing is folded)"""
+        parts = []
+        if memory.requests:
+            earlier = memory.folded_turns // 2
+            parts.append(f"{earlier} earlier exchanges. The user previously asked for: " + "; ".join(memory.requests))
+        if memory.recommended:
+            # The prompt lists the latest picks; retrieval already excludes every remembered one
+            recent = list(memory.recommended.items())[-self.summary_tracks:]
+            tracks = ", ".join(f"{name} [{code}]" if name else code for code, name in recent)
+            parts.append(f"Already recommended (do not repeat): {tracks}")
+        return truncate_to_tokens("\n".join(parts), self.max_summary_tokens)
+
+    def reset(self, session_id: str):
+        with self._lock:
+            self._memories.pop(session_id, None)
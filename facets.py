@@ -0,0 +1,212 @@
+import re
+
+_BPM = r"(\d{2,3}(?:\.\d+)?)"
+_YEAR = r"((?:19|20)\d{2})"
+
+_BPM_RANGE_RES = (
+    re.compile(_BPM + r"\s*(?:-|–|to)\s*" + _BPM + r"\s*bpm"),
+    re.compile(r"bpm\s*(?:of\s*|between\s*)?" + _BPM + r"\s*(?:-|–|to|and)\s*" + _BPM),
+    re.compile(r"between\s*" + _BPM + r"\s*and\s*" + _BPM + r"\s*bpm"),
+)
+_BPM_MIN_RE = re.compile(r"(?:above|over|more than|faster than|at least|>=?)\s*" + _BPM + r"\s*bpm")
+_BPM_MAX_RE = re.compile(r"(?:below|under|less than|slower than|at most|<=?)\s*" + _BPM + r"\s*bpm")
+_BPM_EXACT_RE = re.compile(_BPM + r"\s*bpm|bpm\s*(?:of\s*)?" + _BPM)
+
+_YEAR_RANGE_RE = re.compile(_YEAR + r"\s*(?:-|–|to)\s*" + _YEAR)
+_YEAR_AFTER_RE = re.compile(r"(?:post|after)[\s-]*" + _YEAR)
+_YEAR_SINCE_RE = re.compile(r"(?:since|from)\s*" + _YEAR + r"|" + _YEAR + r"\s*(?:onwards?|or later|and later|or newer|\+)")
+_YEAR_BEFORE_RE = re.compile(r"(?:pre|before)[\s-]*" + _YEAR)
+_YEAR_UNTIL_RE = re.compile(r"(?:until|up to|till|by)\s*" + _YEAR + r"|" + _YEAR + r"\s*(?:or earlier|and earlier|or older)")
+_YEAR_IN_RE = re.compile(r"\b(?:in|released in|from year)\s*" + _YEAR + r"\b")
+
+_NO_VOCALS_RE = re.compile(r"\b(?:instrumentals?|no vocals?|without vocals?|no lyrics|without lyrics|vocal[\s-]?free|non[\s-]?vocal)\b")
+_VOCALS_RE = re.compile(r"\b(?:with vocals?|vocal tracks?|with lyrics|has vocals?|sung|singing)\b")
+_CLEAN_RE = re.compile(r"\b(?:clean|non[\s-]?explicit|not explicit|no explicit|family[\s-]?friendly|kid[\s-]?friendly|safe for work)\b")
+_EXPLICIT_RE = re.compile(r"\bexplicit\b")
+
+# Tolerance applied to a single BPM value ("120 bpm" means roughly 120)
+BPM_TOLERANCE = 5
+
+
+class FacetFilter:
+    """Structured constraints pulled out of a user message"""
+
+    __slots__ = ('bpm_min', 'bpm_max', 'has_vocals', 'is_explicit', 'year_min', 'year_max')
+
+    def __init__(self, bpm_min=None, bpm_max=None, has_vocals=None, is_explicit=None, year_min=None, year_max=None):
+        self.bpm_min = bpm_min
+        self.bpm_max = bpm_max
+        self.has_vocals = has_vocals
+        self.is_explicit = is_explicit
+        self.year_min = year_min
+        self.year_max = year_max
+
+    def key(self) -> tuple:
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __bool__(self):
+        return any(value is not None for value in self.key())
+
+    def __repr__(self):
+        constraints = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__ if getattr(self, slot) is not None)
+        return f"FacetFilter({constraints})"
+
+
+def parse_facets(message: str) -> FacetFilter:
+    """Extract BPM, vocals, explicit and release-year constraints from a message"""
+    text = message.lower()
+    facets = FacetFilter()
+
+    for pattern in _BPM_RANGE_RES:
+        match = pattern.search(text)
+        if match:
+            low, high = sorted((float(match.group(1)), float(match.group(2))))
+            facets.bpm_min, facets.bpm_max = low, high
+            break
+    else:
+        minimum = _BPM_MIN_RE.search(text)
+        maximum = _BPM_MAX_RE.search(text)
+        if minimum:
+            facets.bpm_min = float(minimum.group(1))
+        if maximum:
+            facets.bpm_max = float(maximum.group(1))
+        if not minimum and not maximum:
+            exact = _BPM_EXACT_RE.search(text)
+            if exact:
+                value = float(exact.group(1) or exact.group(2))
+                facets.bpm_min, facets.bpm_max = value - BPM_TOLERANCE, value + BPM_TOLERANCE
+
+    match = _YEAR_RANGE_RE.search(text)
+    if match:
+        facets.year_min, facets.year_max = sorted((int(match.group(1)), int(match.group(2))))
+    else:
+        match = _YEAR_AFTER_RE.search(text)
+        if match:
+            facets.year_min = int(match.group(1)) + 1
+        else:
+            match = _YEAR_SINCE_RE.search(text)
+            if match:
+                facets.year_min = int(match.group(1) or match.group(2))
+        match = _YEAR_BEFORE_RE.search(text)
+        if match:
+            facets.year_max = int(match.group(1)) - 1
+        else:
+            match = _YEAR_UNTIL_RE.search(text)
+            if match:
+                facets.year_max = int(match.group(1) or match.group(2))
+        if facets.year_min is None and facets.year_max is None:
+            match = _YEAR_IN_RE.search(text)
+            if match:
+                facets.year_min = facets.year_max = int(match.group(1))
+
+    if _NO_VOCALS_RE.search(text):
+        facets.has_vocals = False
+    elif _VOCALS_RE.search(text):
+        facets.has_vocals = True
+
+    if _CLEAN_RE.search(text):
+        facets.is_explicit = False
+    elif _EXPLICIT_RE.search(text):
+        facets.is_explicit = True
+
+    return facets
+
+
+_NONZERO_BYTE_RE = re.compile(rb"[^\x00]")
+
+
+class FacetMask:
+    """The set of catalog positions satisfying a FacetFilter, as a bitmap"""
+
+    __slots__ = ('bits', 'size', 'count')
+
+    def __init__(self, bitmap: int, size: int):
+        self.bits = bitmap.to_bytes((size + 7) // 8, 'little')
+        self.size = size
+        self.count = bitmap.bit_count()
+
+    def __contains__(self, position: int) -> bool:
+        return bool(self.bits[position >> 3] >> (position & 7) & 1)
+
+    def __len__(self):
+        return self.count
+
+    def positions(self, limit: int = None) -> list:
+        """Matching positions in catalog order, stopping after `limit`"""
+        found = []
+        for match in _NONZERO_BYTE_RE.finditer(self.bits):
+            base = match.start() * 8
+            byte = self.bits[match.start()]
+            for bit in range(8):
+                if byte >> bit & 1:
+                    found.append(base + bit)
+                    if limit is not None and len(found) >= limit:
+                        return found
+        return found
+
+    def as_array(self):
+        """Boolean NumPy mask over the catalog (requires NumPy)"""
+        import numpy as np
+        return np.unpackbits(np.frombuffer(self.bits, dtype=np.uint8), bitorder='little')[:self.size].astype(bool)
+
+
+def _bitmap(positions, size: int) -> int:
+    """Build an int bitmap from catalog positions in O(len(positions))"""
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class FacetIndex:
+    """Bitmap indexes over vocals, explicit, BPM and release year, built once per catalog
+
+    Bitmaps are Python ints, so intersecting facets is a handful of
+    C-level AND/OR operations regardless of how many tracks match.
+    """
+
+    def __init__(self, tracks: list):
+        self.size = len(tracks)
+        vocals = {True: [], False: []}
+        explicit = {True: [], False: []}
+        bpm = {}
+        years = {}
+        for position, track in enumerate(tracks):
+            if track.has_vocals is not None:
+                vocals[track.has_vocals].append(position)
+            if track.is_explicit is not None:
+                explicit[track.is_explicit].append(position)
+            if track.bpm is not None:
+                bpm.setdefault(int(track.bpm), []).append(position)
+            if track.release_year is not None:
+                years.setdefault(int(track.release_year), []).append(position)
+
+        self.vocals = {value: _bitmap(positions, self.size) for value, positions in vocals.items()}
+        self.explicit = {value: _bitmap(positions, self.size) for value, positions in explicit.items()}
+        self.bpm = {value: _bitmap(positions, self.size) for value, positions in bpm.items()}
+        self.years = {value: _bitmap(positions, self.size) for value, positions in years.items()}
+
+    @staticmethod
+    def _range(bitmaps: dict, low, high) -> int:
+        result = 0
+        for value, bitmap in bitmaps.items():
+            if (low is None or value >= low) and (high is None or value <= high):
+                result |= bitmap
+        return result
+
+    def match(self, facets: FacetFilter):
+        """Mask of tracks satisfying every constraint, or None when there are no constraints"""
+        if not facets:
+            return None
+        bitmap = (1 << self.size) - 1
+        if facets.has_vocals is not None:
+            bitmap &= self.vocals[facets.has_vocals]
+        if facets.is_explicit is not None:
+            bitmap &= self.explicit[facets.is_explicit]
+        if facets.bpm_min is not None or facets.bpm_max is not None:
+            low = None if facets.bpm_min is None else int(facets.bpm_min)
+            high = None if facets.bpm_max is None else int(facets.bpm_max)
+            bitmap &= self._range(self.bpm, low, high)
+        if facets.year_min is not None or facets.year_max is not None:
+            bitmap &= self._range(self.years, facets.year_min, facets.year_max)
+        return FacetMask(bitmap, self.size)
@@ -0,0 +1,232 @@
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+
+RECOMMEND = "recommend"
+CHAT = "chat"
+OFF_TOPIC = "off_topic"
+GREETING = "greeting"
+LABELS = (RECOMMEND, CHAT, OFF_TOPIC, GREETING)
+
+INTENT_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_data.json")
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+# Whole-message greetings are answered without consulting the classifier
+_GREETING_RE = re.compile(
+    r"^\s*(?:hi+|hello+|hey+|hiya|howdy|yo|sup|hola|namaste|greetings|good\s+(?:morning|afternoon|evening|night)|morning)"
+    r"(?:\s+(?:there|mira|all|team))?"
+    r"(?:[\s,!.]+(?:how\s+are\s+you(?:\s+doing)?|how'?s\s+it\s+going|what'?s\s+up))?[\s!.?]*$"
+)
+
+# Word-boundary cue lexicons, compiled once into a single alternation each; hits become classifier features
+_CUES = {
+    "music": (
+        "recommend", "recommendation", "suggest", "suggestion", "song", "songs", "track", "tracks", "music", "beat",
+        "beats", "bgm", "playlist", "instrumental", "vocals", "vocal", "bpm", "tempo", "genre", "lofi", "edm",
+        "soundtrack", "jingle", "audio", "melody", "piano", "acoustic", "hip hop", "bollywood", "cinematic",
+        "upbeat", "chill", "energetic", "reel", "reels", "vibe", "vibes", "sound", "sounds", "mood", "ambience",
+        "violin", "guitar", "ukulele", "flute", "sitar", "tabla", "drums", "strings", "synth", "orchestral", "jazz",
+        "rock", "folk", "sufi", "classical", "sad", "happy", "romantic", "spooky", "horror", "halloween", "festive",
+        "diwali", "christmas", "epic", "dramatic", "uplifting", "emotional", "calm", "relaxing", "motivational",
+    ),
+    "brand": (
+        "ad", "ads", "advert", "advertisement", "campaign", "brand", "commercial", "promo", "launch", "video",
+        "vlog", "youtube", "instagram", "tiktok", "content", "film", "teaser", "montage", "client", "product",
+    ),
+    "followup": (
+        "more", "another", "alternative", "alternatives", "similar", "different", "slower", "faster", "options",
+        "else", "instead",
+    ),
+    "hoopr": (
+        "hoopr", "hooprsmash", "license", "licence", "licensing", "copyright", "royalty", "monetize", "monetization",
+        "subscription", "price", "pricing", "refund", "download", "credit", "claim",
+    ),
+}
+_CUE_RES = {
+    name: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True)) + r")\b")
+    for name, words in _CUES.items()
+}
+
+
+def _bucket(feature: str, dimensions: int) -> int:
+    return zlib.crc32(feature.encode('utf-8')) % dimensions
+
+
+def featurize(message: str, dimensions: int) -> dict:
+    """Hashed unigram, bigram and cue features for a message"""
+    text = message.lower()
+    tokens = _TOKEN_RE.findall(text)
+    features = {}
+
+    def add(feature, value=1.0):
+        index = _bucket(feature, dimensions)
+        features[index] = features.get(index, 0.0) + value
+
+    for token in tokens:
+        add("w:" + token)
+    for first, second in zip(tokens, tokens[1:]):
+        add("b:" + first + "_" + second)
+    for name, pattern in _CUE_RES.items():
+        hits = len(pattern.findall(text))
+        if hits:
+            add("cue:" + name, min(hits, 3))
+    add("len:" + ("short" if len(tokens) <= 3 else "long"))
+    add("bias")
+    return features
+
+
+class Intent:
+    """A routing decision: label, its probability and whether it came from the rules"""
+
+    __slots__ = ('label', 'confidence', 'rule')
+
+    def __init__(self, label: str, confidence: float, rule: bool = False):
+        self.label = label
+        self.confidence = confidence
+        self.rule = rule
+
+    def __repr__(self):
+        return f"Intent({self.label!r}, {self.confidence:.2f})"
+
+
+class IntentRouter:
+    """Classifies a message as recommend / chat / off_topic / greeting without calling the model
+
+    Greetings are caught by one anchored regex. Everything else goes to a
+    multinomial logistic regression over hashed word, bigram and keyword-cue
+    features, trained at startup on the labeled examples in intent_data.json.
+    Greetings and off-topic messages are answered without the model, so the
+    canned greeting is only used when the regex matches (a greeting-like message it misses, such as "another
+    one", goes to the likelier of recommend and chat). Off-topic predictions
+    go to chat instead when they are below `local_threshold`, when the
+    message has a music, brand or Hoopr cue, or when it continues a
+    conversation; there, chat predictions with a music or follow-up cue
+    become recommend ("any more like these?").
+    """
+
+    def __init__(self, examples: list = None, dimensions: int = 1 << 14, epochs: int = 30,
+                 learning_rate: float = 0.5, l2: float = 1e-4, local_threshold: float = 0.75):
+        self.dimensions = dimensions
+        self.local_threshold = local_threshold
+        self.weights = {label: {} for label in LABELS}
+        if examples is None:
+            examples = load_examples("train")
+        self._train(examples, epochs, learning_rate, l2)
+
+    def _scores(self, features: dict) -> dict:
+        return {
+            label: sum(weights.get(index, 0.0) * value for index, value in features.items())
+            for label, weights in self.weights.items()
+        }
+
+    @staticmethod
+    def _softmax(scores: dict) -> dict:
+        top = max(scores.values())
+        exps = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exps.values())
+        return {label: value / total for label, value in exps.items()}
+
+    def _train(self, examples: list, epochs: int, learning_rate: float, l2: float):
+        data = [(featurize(text, self.dimensions), label) for text, label in examples]
+        rng = random.Random(0)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for features, label in data:
+                probabilities = self._softmax(self._scores(features))
+                for candidate, weights in self.weights.items():
+                    gradient = probabilities[candidate] - (1.0 if candidate == label else 0.0)
+                    for index, value in features.items():
+                        weight = weights.get(index, 0.0)
+                        weights[index] = weight - rate * (gradient * value + l2 * weight)
+
+    def probabilities(self, message: str) -> dict:
+        return self._softmax(self._scores(featurize(message, self.dimensions)))
+
+    def classify(self, message: str, in_conversation: bool = False) -> Intent:
+        """Route a message; in_conversation says whether the session already has turns"""
+        text = message.lower()
+        if _GREETING_RE.match(text):
+            return Intent(GREETING, 1.0, rule=True)
+        probabilities = self.probabilities(message)
+        label = max(probabilities, key=probabilities.get)
+        if label == GREETING:
+            label = max((RECOMMEND, CHAT), key=probabilities.get)
+        elif label == OFF_TOPIC and (in_conversation or probabilities[label] < self.local_threshold
+                                     or _has_cue(text, "music", "brand", "hoopr")):
+            label = CHAT
+        if label == CHAT and in_conversation and _has_cue(text, "music", "followup"):
+            label = RECOMMEND
+        return Intent(label, probabilities[label])
+
+
+def _has_cue(text: str, *names: str) -> bool:
+    return any(_CUE_RES[name].search(text) for name in names)
+
+
+def load_examples(split: str, path: str = INTENT_DATA_PATH) -> list:
+    """(message, label) pairs from the labeled intent data ("train" or "eval")
+
+    Eval examples may carry a third element, true for a message sent in a
+    session that already has turns.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [tuple(example) for example in json.load(f)[split]]
+
+
+def evaluate(router: IntentRouter, examples: list) -> dict:
+    """Accuracy and a confusion matrix (true label -> predicted label -> count)"""
+    confusion = {label: {other: 0 for other in LABELS} for label in LABELS}
+    correct = 0
+    for text, label, *context in examples:
+        predicted = router.classify(text, bool(context and context[0])).label
+        confusion[label][predicted] += 1
+        correct += predicted == label
+    return {"accuracy": correct / len(examples), "confusion": confusion}
+
+
+def _legacy_detect(message: str) -> bool:
+    """The substring keyword check the router replaced, kept for the benchmark"""
+    keywords = [
+        'recommend', 'suggestion', 'music', 'song', 'track', 'audio',
+        'reel', 'video', 'background', 'instrumental', 'vocal',
+        'upbeat', 'chill', 'energetic', 'mood', 'vibe', 'genre',
+        'license', 'copyright', 'commercial', 'brand', 'campaign',
+        'ad', 'advertisement', 'content', 'youtube', 'instagram',
+        'tiktok', 'social media', 'beats', 'sound', 'playlist',
+        'give me', 'need', 'want', 'looking for', 'find'
+    ]
+    lower = message.lower()
+    return any(keyword in lower for keyword in keywords)
+
+
+if __name__ == '__main__':
+    # Eval report and microbenchmark: python intent_router.py
+    started = time.perf_counter()
+    router = IntentRouter()
+    print(f"Trained in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    eval_examples = load_examples("eval")
+    report = evaluate(router, eval_examples)
+    print(f"Eval accuracy: {report['accuracy']:.3f} on {len(eval_examples)} messages")
+    print("true \\ predicted".ljust(18) + "".join(label.rjust(11) for label in LABELS))
+    for label in LABELS:
+        print(label.ljust(18) + "".join(str(report['confusion'][label][other]).rjust(11) for other in LABELS))
+
+    legacy_correct = sum(_legacy_detect(text) == (label == RECOMMEND) for text, label, *_ in eval_examples)
+    print(f"Legacy keyword check, recommend vs not: {legacy_correct / len(eval_examples):.3f}")
+
+    messages = [text for text, *_ in eval_examples]
+    rounds = 200
+    for name, fn in (("router", router.classify), ("legacy", _legacy_detect)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for message in messages:
+                fn(message)
+        per_message = (time.perf_counter() - started) / (rounds * len(messages))
+        print(f"{name}: {per_message * 1e6:.1f} us/message")
@@ -0,0 +1,104 @@
+import asyncio
+import contextlib
+import math
+import time
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of waiting for the model; carries the HTTP status and Retry-After"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    """The wait queue for upstream slots is full"""
+
+    status_code = 429
+
+
+class DeadlineExceeded(Overloaded):
+    """The request's deadline passed while queued or waiting on the model"""
+
+    status_code = 503
+
+
+def remaining(deadline: float = None):
+    """Seconds left until a time.monotonic() deadline (None for no deadline)"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent upstream model calls for the asyncio server, with a bounded wait queue
+
+    Callers beyond `max_concurrency` wait for a slot; once `max_queue`
+    callers are waiting, new ones are rejected straight away. Retry-After
+    hints come from a moving average of how long a slot is held.
+    """
+
+    def __init__(self, max_concurrency: int = 64, max_queue: int = 256, service_time_estimate: float = 5.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._average_service = service_time_estimate
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def retry_after(self) -> int:
+        """Whole seconds until a newly queued request would likely get a slot"""
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(self._average_service * backlog))
+
+    def admit(self):
+        """Raise QueueFull if every slot is taken and the wait queue is full"""
+        if self.active + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise QueueFull("Too many requests are waiting for the model", self.retry_after())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, deadline: float = None):
+        """Hold one upstream slot, queueing until it is free or the deadline passes"""
+        self.admit()
+
+        self.waiting += 1
+        try:
+            timeout = remaining(deadline)
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError()
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise DeadlineExceeded("Request deadline passed while queued for the model", self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            # Exponential moving average of slot hold time, for Retry-After estimates
+            self._average_service += 0.1 * (time.monotonic() - started - self._average_service)
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "average_service_seconds": round(self._average_service, 3),
+        }
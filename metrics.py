@@ -0,0 +1,225 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+# Lightweight hot-path instrumentation exposed in Prometheus text format at /metrics.
+#
+# Request stages (mira_stage_seconds{stage=...}):
+#   intent     - intent routing
+#   retrieval  - facet filtering and track ranking
+#   prompt     - prompt assembly within the token budget
+#   cache      - completion cache lookup
+#   queue      - waiting for an upstream slot (asyncio server)
+#   upstream   - cache miss until the model's reply (includes queue and coalesced waits)
+#   render     - validating and rendering a structured recommendation reply
+#   serialize  - building the JSON response
+#
+# MIRA_METRICS=0 is the profiling toggle: every hook becomes a no-op.
+# MIRA_SERVER_TIMING=1 also reports each request's stages in a Server-Timing header.
+
+enabled = os.getenv("MIRA_METRICS", "1") != "0"
+server_timing = enabled and os.getenv("MIRA_SERVER_TIMING", "0") == "1"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_request_timings = ContextVar("mira_request_timings", default=None)
+_NULL_STAGE = nullcontext()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items()) or ([((), 0)] if not self.labelnames else [])
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Histogram:
+    """Bucketed distribution (cumulated only when rendered), optionally split by label values"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        if not enabled:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Callback:
+    """Value read from the owning component at scrape time (cache sizes, in-flight calls, ...)"""
+
+    def __init__(self, name: str, help_text: str, fn, kind: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list:
+        return [f"{self.name} {_format_value(self.fn())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        # Re-registering a name (e.g. a module imported twice) keeps the first definition
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name: str, help_text: str, fn, kind: str = "gauge") -> Callback:
+        """Register (or replace) a value computed at scrape time"""
+        metric = Callback(name, help_text, fn, kind)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception:
+                continue  # A failing callback must not break the whole scrape
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("mira_stage_seconds", "Time spent in each request stage", ("stage",))
+request_seconds = registry.histogram("mira_request_seconds", "HTTP request latency until the response is returned", ("endpoint", "status"))
+intents_total = registry.counter("mira_intents_total", "Messages routed per intent", ("intent",))
+prompt_tokens = registry.histogram("mira_prompt_tokens", "Prompt size in tokens", buckets=SIZE_BUCKETS)
+completion_chars = registry.histogram("mira_completion_chars", "Completion size in characters", buckets=SIZE_BUCKETS)
+upstream_requests_total = registry.counter("mira_upstream_requests_total", "Model calls by outcome", ("outcome",))
+upstream_errors_total = registry.counter("mira_upstream_errors_total", "Failed model call attempts by error type", ("error",))
+upstream_retries_total = registry.counter("mira_upstream_retries_total", "Model call attempts retried after a transient failure")
+route_attempts_total = registry.counter("mira_route_attempts_total", "Upstream attempts started per model route and kind", ("route", "kind"))
+route_wins_total = registry.counter("mira_route_wins_total", "Completions served per model route and attempt kind", ("route", "kind"))
+route_capped_total = registry.counter("mira_route_capped_total", "Hedge and fallback attempts held back by the racing cap", ("route", "kind"))
+
+
+def record(stage: str, seconds: float):
+    """Add a stage duration to its histogram and to the current request's Server-Timing"""
+    if not enabled:
+        return
+    stage_seconds.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class _Stage:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def stage(name: str):
+    """Context manager timing one request stage"""
+    return _Stage(name) if enabled else _NULL_STAGE
+
+
+def start_request():
+    """Start collecting stage timings for the request handled in this context"""
+    if server_timing:
+        _request_timings.set({})
+
+
+def server_timing_header(total_seconds: float = None):
+    """Server-Timing header value for the current request, or None when disabled"""
+    timings = _request_timings.get() if server_timing else None
+    if timings is None:
+        return None
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(entries)
@@ -0,0 +1,122 @@
+import math
+import os
+
+# Which model answers which kind of request. Recommendations keep the reasoning model;
+# conversational replies go to a fast one. Each route reads its settings from the environment:
+#
+#   MIRA_<ROUTE>_MODEL           model for the route
+#   MIRA_<ROUTE>_DEADLINE        seconds the route may take in total, fallback included
+#   MIRA_<ROUTE>_FALLBACK_MODEL  faster model tried when the primary fails or is too slow ("" for none)
+#   MIRA_<ROUTE>_FALLBACK_AFTER  seconds without a reply before the fallback is raced against the primary
+#                                (0 = only after the primary fails)
+#   MIRA_<ROUTE>_HEDGE_AFTER     seconds without a reply before a duplicate primary request is raced (0 = off)
+#
+# MIRA_FAST_MODEL sets the default fast model used by the chat route and as the recommend fallback.
+# In the threaded server, racing routes run their attempts on a pool that never queues them, and at most
+# MIRA_MAX_RACING_ATTEMPTS hedge / fallback attempts run alongside another attempt at once (see openai_utils).
+
+RECOMMEND_ROUTE = "recommend"
+CHAT_ROUTE = "chat"
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+FALLBACK = "fallback"
+
+
+class ModelRoute:
+    """Model, deadline and tail-latency policy for one kind of request"""
+
+    __slots__ = ('name', 'model', 'deadline', 'fallback_model', 'fallback_after', 'hedge_after')
+
+    def __init__(self, name: str, model: str, deadline: float, fallback_model: str = None,
+                 fallback_after: float = 0, hedge_after: float = 0):
+        self.name = name
+        self.model = model
+        self.deadline = deadline
+        self.fallback_model = fallback_model or None
+        self.fallback_after = fallback_after
+        self.hedge_after = hedge_after
+
+    @property
+    def races(self) -> bool:
+        """Whether a second request may start while the first is still running"""
+        return bool(self.hedge_after or (self.fallback_model and self.fallback_after))
+
+    def __repr__(self):
+        return (f"ModelRoute({self.name!r}, model={self.model!r}, deadline={self.deadline}, "
+                f"fallback={self.fallback_model!r} after {self.fallback_after}, hedge_after={self.hedge_after})")
+
+
+def route_from_env(name: str, model: str, deadline: float, fallback_model: str = None,
+                   fallback_after: float = 0, hedge_after: float = 0) -> ModelRoute:
+    """A route with the given defaults, overridden by MIRA_<NAME>_* variables"""
+    prefix = f"MIRA_{name.upper()}_"
+    return ModelRoute(
+        name,
+        os.getenv(prefix + "MODEL", model),
+        float(os.getenv(prefix + "DEADLINE", deadline)),
+        os.getenv(prefix + "FALLBACK_MODEL", fallback_model or ""),
+        float(os.getenv(prefix + "FALLBACK_AFTER", fallback_after)),
+        float(os.getenv(prefix + "HEDGE_AFTER", hedge_after))
+    )
+
+
+def load_routes(default_model: str, default_deadline: float) -> dict:
+    """The configured routes by name"""
+    fast_model = os.getenv("MIRA_FAST_MODEL", "gpt-4.1-mini")
+    return {
+        RECOMMEND_ROUTE: route_from_env(RECOMMEND_ROUTE, default_model, default_deadline, fast_model, fallback_after=45),
+        CHAT_ROUTE: route_from_env(CHAT_ROUTE, fast_model, min(30.0, default_deadline)),
+    }
+
+
+class RacePlan:
+    """When to start each upstream attempt for one routed completion
+
+    The primary starts at once, a hedge after `hedge_after` and the fallback
+    after `fallback_after`. When every running attempt has failed, the next
+    planned one starts straight away (hedges are skipped then, since the
+    primary already had its retries). Times are time.monotonic() values.
+    """
+
+    def __init__(self, route: ModelRoute, started: float):
+        self.started = started
+        self.deadline = started + route.deadline
+        self.attempts = [(0.0, route.model, PRIMARY)]
+        if route.hedge_after:
+            self.attempts.append((route.hedge_after, route.model, HEDGE))
+        if route.fallback_model:
+            self.attempts.append((route.fallback_after or math.inf, route.fallback_model, FALLBACK))
+        self.attempts.sort(key=lambda attempt: attempt[0])
+        self._next = 0
+
+    def due(self, now: float, running: int) -> list:
+        """(model, kind) of the attempts to start now, given how many are still running"""
+        started = []
+        while self._next < len(self.attempts):
+            delay, model, kind = self.attempts[self._next]
+            if self.started + delay <= now:
+                started.append((model, kind))
+            elif running + len(started) == 0:
+                if kind == HEDGE:
+                    self._next += 1
+                    continue
+                started.append((model, kind))
+            else:
+                break
+            self._next += 1
+        return started
+
+    def postpone(self, model_name: str, kind: str):
+        """Hold an attempt back until every running attempt has failed"""
+        self.attempts.append((math.inf, model_name, kind))
+
+    def wait_until(self) -> float:
+        """When to wake up next: the next planned start or the deadline, whichever comes first"""
+        if self._next < len(self.attempts):
+            return min(self.deadline, self.started + self.attempts[self._next][0])
+        return self.deadline
+
+    @property
+    def exhausted(self) -> bool:
+        return self._next >= len(self.attempts)
@@ -1,18 +1,117 @@
+import atexit
+import hashlib
+import json
 import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+# The "hoopr" logger hands records to a background thread through a bounded queue,
+# so request threads never format or write log lines themselves.
+#
+#   MIRA_LOG_LEVEL        INFO (default), DEBUG, WARNING, ...
+#   MIRA_LOG_FORMAT       json (default, one object per line) or text
+#   MIRA_LOG_BODIES       truncate (default), hash or full - how prompts and replies are logged
+#   MIRA_LOG_BODY_CHARS   characters kept when truncating (default 160)
+#   MIRA_LOG_SAMPLE_RATE  fraction of verbose per-request records emitted (default 0.05)
+#   MIRA_LOG_QUEUE_SIZE   records buffered before new ones are dropped (default 10000)
+
+LOG_LEVEL = os.getenv("MIRA_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("MIRA_LOG_FORMAT", "json")
+BODY_MODE = os.getenv("MIRA_LOG_BODIES", "truncate")
+BODY_CHARS = int(os.getenv("MIRA_LOG_BODY_CHARS", "160"))
+SAMPLE_RATE = float(os.getenv("MIRA_LOG_SAMPLE_RATE", "0.05"))
+QUEUE_SIZE = int(os.getenv("MIRA_LOG_QUEUE_SIZE", "10000"))
+
+# Tags sampled records (extra=VERBOSE) so readers can scale counts back up by 1 / sample_rate
+VERBOSE = {"verbose": True}
+
+
+def sampled() -> bool:
+    """Whether to emit the next verbose per-request record
+
+    Checked before the message is built, so skipped records cost nothing:
+    if sampled(): logger.info(f"...", extra=VERBOSE)
+    """
+    return SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE
+
+
+def log_body(text) -> str:
+    """A prompt or model reply as it should appear in the logs: truncated, hashed or in full"""
+    if text is None or BODY_MODE == "full":
+        return str(text)
+    if BODY_MODE != "hash" and len(text) <= BODY_CHARS:
+        return text
+    digest = hashlib.blake2b(text.encode('utf-8', 'replace'), digest_size=6).hexdigest()
+    if BODY_MODE == "hash" or BODY_CHARS <= 0:
+        return f"<{len(text)} chars #{digest}>"
+    return f"{text[:BODY_CHARS]}… <{len(text)} chars #{digest}>"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "verbose", False):
+            entry["sample_rate"] = SAMPLE_RATE
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the writer falls behind"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
-# Create your app-specific logger and set it to DEBUG
 logger = logging.getLogger("hoopr")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(LOG_LEVEL)
 logger.propagate = False
 
-# 3️⃣ (Optional) Add a console handler if you want custom formatting
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+if LOG_FORMAT == "json":
+    console_handler.setFormatter(JsonFormatter())
+else:
+    console_handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"))
+
+queue_handler = None
+listener = None
+
+
+def _start_listener():
+    global listener
+    queue_handler.queue = queue.Queue(QUEUE_SIZE)
+    listener = QueueListener(queue_handler.queue, console_handler, respect_handler_level=True)
+    listener.start()
+
+
+def stop_listener():
+    """Write out whatever is still queued and stop the writer thread"""
+    if listener is not None:
+        listener.stop()
 
-formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] %(name)s: %(message)s")
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
 
-# 4️⃣ Avoid adding multiple handlers if you re-run this in notebooks or REPLs
-# if not logger.hasHandlers():
-  # logger.addHandler(console_handler)
\ No newline at end of file
+# Avoid adding a second pipeline if this module is imported again (notebooks, REPLs)
+if not logger.handlers:
+    queue_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    _start_listener()
+    # Flush what is still queued when the process exits
+    atexit.register(stop_listener)
+    # A forked worker (see prefork.py) inherits no writer thread; give it a fresh queue and its own
+    os.register_at_fork(after_in_child=_start_listener)
+    logger.addHandler(queue_handler)
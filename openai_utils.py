@@ -1,39 +1,863 @@
+import asyncio
 import os
+import queue
+import random
+import socket
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
 import logging
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+from completion_cache import CompletionCache, make_cache_key
+from llm_limiter import ConcurrencyLimiter, Overloaded, DeadlineExceeded, remaining
+from singleflight import SingleFlight
+from model_routing import ModelRoute, RacePlan, load_routes, RECOMMEND_ROUTE, PRIMARY, HEDGE, FALLBACK
+from mylogger import log_body, sampled, VERBOSE
+from metrics import (registry, stage, record, completion_chars, upstream_requests_total, upstream_errors_total,
+                     upstream_retries_total, route_attempts_total, route_wins_total, route_capped_total)
 
 logger = logging.getLogger("hoopr")
 
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
+# Point at a local OpenAI-compatible server (e.g. a fake streaming server) for offline runs
+base_url = os.getenv("OPENAI_BASE_URL") or None
+model = os.getenv("OPENAI_MODEL", "o3-2025-04-16")
+
+# Connection pool, timeout and retry settings for the shared client
+pool_size = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+keepalive_seconds = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "120"))
+connect_timeout = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+request_timeout = float(os.getenv("OPENAI_TIMEOUT", "180"))
+max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+retry_base_delay = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+retry_max_delay = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+# Async serving mode: cap on concurrent upstream calls, wait queue length and per-request deadline
+llm_limiter = ConcurrencyLimiter(
+    max_concurrency=int(os.getenv("MIRA_LLM_CONCURRENCY", "64")),
+    max_queue=int(os.getenv("MIRA_LLM_QUEUE", "256"))
+)
+request_deadline = float(os.getenv("MIRA_REQUEST_DEADLINE", "120"))
+
+# Model, deadline, fallback and hedging per kind of request (see model_routing);
+# OPENAI_MODEL remains the recommendation model
+routes = load_routes(model, request_deadline)
+# Cap on hedge / fallback attempts running alongside another attempt of the same request, across the process
+_racing_slots = threading.BoundedSemaphore(int(os.getenv("MIRA_MAX_RACING_ATTEMPTS", "16")))
+_race_executor = None
+
+# Identical prompts already in flight share one upstream call instead of issuing their own
+completion_flights = SingleFlight() if os.getenv("MIRA_SINGLEFLIGHT", "1") != "0" else None
+
+# Completion cache: in-memory LRU backed by SQLite so entries survive restarts
+completion_cache = None
+if os.getenv("MIRA_COMPLETION_CACHE", "1") != "0":
+    completion_cache = CompletionCache(
+        db_path=os.getenv("MIRA_COMPLETION_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "completion_cache.sqlite3")),
+        max_entries=int(os.getenv("MIRA_COMPLETION_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.getenv("MIRA_COMPLETION_CACHE_TTL", "86400")),
+        max_disk_entries=int(os.getenv("MIRA_COMPLETION_CACHE_DISK_SIZE", "100000"))
+    )
+    registry.callback("mira_completion_cache_hits_total", "Completion cache hits", lambda: completion_cache.hits, "counter")
+    registry.callback("mira_completion_cache_misses_total", "Completion cache misses", lambda: completion_cache.misses, "counter")
+    registry.callback("mira_completion_cache_entries", "Completions held in memory", lambda: completion_cache.stats()["memory_entries"])
+
+registry.callback("mira_llm_active", "Upstream calls holding a slot", lambda: llm_limiter.active)
+registry.callback("mira_llm_waiting", "Upstream calls queued for a slot", lambda: llm_limiter.waiting)
+registry.callback("mira_llm_rejected_total", "Requests shed by the upstream limiter", lambda: llm_limiter.rejected, "counter")
+if completion_flights is not None:
+    registry.callback("mira_singleflight_in_flight", "Distinct completions in flight",
+                      lambda: completion_flights.stats()["in_flight"])
+    registry.callback("mira_singleflight_coalesced_total", "Completions that joined an identical call in flight",
+                      lambda: completion_flights.coalesced, "counter")
+
+def get_route(name: str = None) -> ModelRoute:
+    """The named route, or the recommendation route for unknown names and direct callers"""
+    return routes.get(name or RECOMMEND_ROUTE) or routes[RECOMMEND_ROUTE]
+
+def _race_pool():
+    """Threads for the attempts of racing routes in the threaded server
+
+    It never queues an attempt, since time spent queued would count against
+    fallback_after and the deadline. Its size is bounded by its callers
+    instead: one primary per request thread, plus at most
+    MIRA_MAX_RACING_ATTEMPTS hedges and fallbacks. Idle threads are reused.
+    """
+    global _race_executor
+    if _race_executor is None:
+        with _client_lock:
+            if _race_executor is None:
+                _race_executor = ThreadPoolExecutor(max_workers=sys.maxsize, thread_name_prefix="mira-race")
+    return _race_executor
+
+def _forget_race_pool():
+    # A forked child inherits the pool without its threads; the next race builds a new one
+    global _race_executor
+    _race_executor = None
+
+os.register_at_fork(after_in_child=_forget_race_pool)
 
 def get_openai_client():
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-    return client
+    """Return the process-wide OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=pool_size,
+                        max_keepalive_connections=pool_size,
+                        keepalive_expiry=keepalive_seconds
+                    ),
+                    timeout=httpx.Timeout(request_timeout, connect=connect_timeout)
+                )
+                # Retries are handled by call_with_retries so the backoff policy lives in one place
+                _client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    return _client
+
+def get_async_openai_client():
+    """Return the AsyncOpenAI client for the serving event loop, creating it on first use"""
+    global _async_client
+    if _async_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=llm_limiter.max_concurrency,
+                max_keepalive_connections=llm_limiter.max_concurrency,
+                keepalive_expiry=keepalive_seconds
+            ),
+            timeout=httpx.Timeout(request_timeout, connect=connect_timeout)
+        )
+        _async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    return _async_client
+
+def _is_retryable(error: Exception) -> bool:
+    """Connection failures, timeouts, 429s and 5xx responses are worth retrying"""
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when the server sends one"""
+    if isinstance(error, APIStatusError):
+        try:
+            return min(float(error.response.headers.get("retry-after")), retry_max_delay)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(retry_max_delay, retry_base_delay * (2 ** attempt)))
+
+def call_with_retries(call, deadline: float = None):
+    """Run an upstream call, retrying transient failures with jittered backoff until the deadline is near"""
+    attempt = 0
+    while True:
+        try:
+            response = call()
+            upstream_requests_total.inc("ok")
+            return response
+        except Exception as e:
+            upstream_errors_total.inc(type(e).__name__)
+            if attempt >= max_retries or not _is_retryable(e):
+                upstream_requests_total.inc("error")
+                raise
+            delay = _retry_delay(attempt, e)
+            left = remaining(deadline)
+            if left is not None and delay >= left:
+                upstream_requests_total.inc("error")
+                raise
+            attempt += 1
+            upstream_retries_total.inc()
+            logger.warning(f"Upstream call failed ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+async def call_with_retries_async(call, deadline: float = None):
+    """Async call_with_retries that also stops retrying once the deadline is near"""
+    attempt = 0
+    while True:
+        try:
+            response = await call()
+            upstream_requests_total.inc("ok")
+            return response
+        except Exception as e:
+            upstream_errors_total.inc(type(e).__name__)
+            if attempt >= max_retries or not _is_retryable(e):
+                upstream_requests_total.inc("error")
+                raise
+            delay = _retry_delay(attempt, e)
+            left = remaining(deadline)
+            if left is not None and delay >= left:
+                upstream_requests_total.inc("error")
+                raise
+            attempt += 1
+            upstream_retries_total.inc()
+            logger.warning(f"Upstream call failed ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
 
-def get_completion_openai(prompt: str):
+def _deadline_timeout(deadline: float, timeout: float = None) -> float:
+    """Upstream timeout bounded by the time left before the request deadline"""
+    timeout = timeout or request_timeout
+    left = remaining(deadline)
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline passed before the model call", llm_limiter.retry_after())
+    return min(timeout, left)
+
+def get_completion_openai(prompt: str, timeout: float = None, model_name: str = None, deadline: float = None):
     client = get_openai_client()
-    # Using responses API format
-    response = client.responses.create(
-        model="o3-2025-04-16",
-        input=prompt
-    )
+    # Using responses API format; each retry only gets the time left before the deadline
+    response = call_with_retries(lambda: client.responses.create(
+        model=model_name or model,
+        input=prompt,
+        timeout=_deadline_timeout(deadline, timeout)
+    ), deadline)
     return response.output_text
 
-def get_completion(prompt: str, is_json=True):
+def stream_completion_openai(prompt: str, timeout: float = None, model_name: str = None):
+    """Yield output text deltas from a streamed responses API call"""
+    client = get_openai_client()
+    # Only opening the stream is retried; a stream that fails midway is surfaced to the caller
+    stream = call_with_retries(lambda: client.responses.create(
+        model=model_name or model,
+        input=prompt,
+        stream=True,
+        timeout=timeout or request_timeout
+    ))
+    try:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(f"Streamed completion failed: {event}")
+    finally:
+        # Hand the connection back to the pool even if the consumer stops early
+        stream.close()
+
+def _start_attempt(route: ModelRoute, model_name: str, kind: str, plan: RacePlan = None):
+    route_attempts_total.inc(route.name, kind)
+    if kind != PRIMARY:
+        after = f" after {time.monotonic() - plan.started:.1f}s" if plan is not None else ""
+        logger.warning(f"Starting {kind} attempt for the {route.name} route on {model_name}{after}")
+
+class AttemptCancelled(Exception):
+    """A raced attempt was stopped because another one won or the request gave up"""
+
+
+def _abort_stream(stream):
+    """Close a streamed response from another thread
+
+    Closing alone does not wake a thread blocked reading the socket, so the
+    socket is shut down first.
+    """
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    stream.close()
+
+
+class _RacedAttempt:
+    """One attempt raced on the race pool
+
+    The call is streamed so an attempt that loses can be stopped: cancel()
+    aborts its response, which frees the pool thread and the connection at
+    once instead of when the model finishes. `on_delta`, if given, is called
+    with each chunk as it arrives.
+    """
+
+    def __init__(self, prompt: str, timeout: float, model_name: str, deadline: float):
+        self.prompt = prompt
+        self.timeout = timeout
+        self.model_name = model_name
+        self.deadline = deadline
+        self._stream = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._cancelled:
+            raise AttemptCancelled()
+        stream = get_openai_client().responses.create(
+            model=self.model_name,
+            input=self.prompt,
+            stream=True,
+            timeout=_deadline_timeout(self.deadline, self.timeout)
+        )
+        with self._lock:
+            if not self._cancelled:
+                self._stream = stream
+                return stream
+        stream.close()
+        raise AttemptCancelled()
+
+    def run(self, on_delta=None) -> str:
+        stream = call_with_retries(self._open, self.deadline)
+        chunks = []
+        try:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    chunks.append(event.delta)
+                    if on_delta is not None:
+                        on_delta(event.delta)
+                elif event.type in ("response.failed", "error"):
+                    raise RuntimeError(f"Completion failed: {event}")
+        except Exception:
+            if self._cancelled:
+                raise AttemptCancelled() from None
+            raise
+        finally:
+            stream.close()
+        return "".join(chunks)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            stream = self._stream
+        if stream is not None:
+            try:
+                _abort_stream(stream)
+            except Exception as e:
+                logger.debug(f"Closing a cancelled {self.model_name} attempt: {e}")
+
+
+def _racing_slot(route: ModelRoute, plan: RacePlan, model_name: str, kind: str) -> bool:
+    """Take a racing slot for a hedge / fallback that would run alongside another attempt
+
+    At the cap, hedges are skipped and fallbacks wait until the running
+    attempts have failed.
+    """
+    if _racing_slots.acquire(blocking=False):
+        return True
+    route_capped_total.inc(route.name, kind)
+    if kind == FALLBACK:
+        plan.postpone(model_name, kind)
+    logger.warning(f"Racing cap reached; {'postponed' if kind == FALLBACK else 'skipped'} the {kind} attempt "
+                   f"for the {route.name} route")
+    return False
+
+
+def _race(prompt: str, route: ModelRoute, plan: RacePlan, timeout: float = None):
+    """Run the plan's attempts on the race pool; the first reply wins and the others are cancelled"""
+    pool = _race_pool()
+    pending = {}
+    error = None
+    try:
+        while True:
+            now = time.monotonic()
+            for model_name, kind in plan.due(now, len(pending)):
+                racing = bool(pending) and kind in (HEDGE, FALLBACK)
+                if racing and not _racing_slot(route, plan, model_name, kind):
+                    continue
+                _start_attempt(route, model_name, kind, plan)
+                attempt = _RacedAttempt(prompt, timeout, model_name, plan.deadline)
+                future = pool.submit(attempt.run)
+                if racing:
+                    future.add_done_callback(lambda _: _racing_slots.release())
+                pending[future] = (model_name, kind, attempt)
+            if not pending:
+                raise error
+            done, _ = wait(pending, timeout=max(0.0, plan.wait_until() - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                model_name, kind, _ = pending.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    error = e
+                    logger.warning(f"{kind.capitalize()} attempt for the {route.name} route on {model_name} failed: {e}")
+                    continue
+                route_wins_total.inc(route.name, kind)
+                return text, model_name
+            if remaining(plan.deadline) <= 0:
+                raise DeadlineExceeded(f"The {route.name} route deadline passed while waiting on the model", llm_limiter.retry_after())
+    finally:
+        for future, (_, _, attempt) in pending.items():
+            future.cancel()
+            attempt.cancel()
+
+def routed_completion(prompt: str, route: ModelRoute, timeout: float = None):
+    """(reply, model that served it) for the route: its model first, then hedges and fallback as configured"""
+    plan = RacePlan(route, time.monotonic())
+    if route.races:
+        return _race(prompt, route, plan, timeout)
+    # Nothing runs concurrently: the primary, then the fallback once the primary has failed
+    while True:
+        model_name, kind = plan.due(time.monotonic(), 0)[0]
+        _start_attempt(route, model_name, kind, plan)
+        try:
+            text = get_completion_openai(prompt, timeout, model_name, plan.deadline)
+        except Overloaded:
+            raise
+        except Exception as e:
+            if plan.exhausted:
+                raise
+            logger.warning(f"{kind.capitalize()} attempt for the {route.name} route on {model_name} failed: {e}")
+            continue
+        route_wins_total.inc(route.name, kind)
+        return text, model_name
+
+async def routed_completion_async(prompt: str, route: ModelRoute, timeout: float = None, deadline: float = None):
+    """routed_completion for the asyncio server; attempts that lose the race are cancelled"""
+    plan = RacePlan(route, time.monotonic())
+    if deadline is not None:
+        plan.deadline = min(plan.deadline, deadline)
+    client = get_async_openai_client()
+
+    async def attempt(model_name):
+        response = await call_with_retries_async(lambda: client.responses.create(
+            model=model_name,
+            input=prompt,
+            timeout=_deadline_timeout(plan.deadline, timeout)
+        ), plan.deadline)
+        return response.output_text
+
+    pending = {}
+    error = None
+    try:
+        while True:
+            now = time.monotonic()
+            for model_name, kind in plan.due(now, len(pending)):
+                racing = bool(pending) and kind in (HEDGE, FALLBACK)
+                if racing and not _racing_slot(route, plan, model_name, kind):
+                    continue
+                _start_attempt(route, model_name, kind, plan)
+                task = asyncio.ensure_future(attempt(model_name))
+                if racing:
+                    task.add_done_callback(lambda _: _racing_slots.release())
+                pending[task] = (model_name, kind)
+            if not pending:
+                raise error
+            done, _ = await asyncio.wait(pending, timeout=max(0.0, plan.wait_until() - now), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                model_name, kind = pending.pop(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                    logger.warning(f"{kind.capitalize()} attempt for the {route.name} route on {model_name} failed: {error}")
+                    continue
+                route_wins_total.inc(route.name, kind)
+                return task.result(), model_name
+            if remaining(plan.deadline) <= 0:
+                raise DeadlineExceeded("Request deadline passed while waiting on the model", llm_limiter.retry_after())
+    finally:
+        for task in pending:
+            task.cancel()
+
+def _stream_attempts(route: ModelRoute) -> list:
+    """Attempts of a route that does not race: the fallback is only used when the primary fails before any output"""
+    attempts = [(route.model, PRIMARY)]
+    if route.fallback_model:
+        attempts.append((route.fallback_model, FALLBACK))
+    return attempts
+
+def _race_stream(prompt: str, route: ModelRoute, plan: RacePlan, timeout: float = None, served_by: list = None):
+    """Stream the plan's attempts on the race pool; the first to produce a delta is streamed and the others are cancelled"""
+    pool = _race_pool()
+    # (attempt, delta) as chunks arrive, and (attempt, future) when an attempt ends
+    events = queue.Queue()
+    pending = {}
+    error = None
+    try:
+        while True:
+            now = time.monotonic()
+            for model_name, kind in plan.due(now, len(pending)):
+                racing = bool(pending) and kind in (HEDGE, FALLBACK)
+                if racing and not _racing_slot(route, plan, model_name, kind):
+                    continue
+                _start_attempt(route, model_name, kind, plan)
+                attempt = _RacedAttempt(prompt, timeout, model_name, plan.deadline)
+                future = pool.submit(attempt.run, lambda delta, attempt=attempt: events.put((attempt, delta)))
+                future.add_done_callback(lambda future, attempt=attempt: events.put((attempt, future)))
+                if racing:
+                    future.add_done_callback(lambda _: _racing_slots.release())
+                pending[attempt] = (model_name, kind)
+            if not pending:
+                raise error
+            try:
+                attempt, item = events.get(timeout=max(0.0, plan.wait_until() - now))
+            except queue.Empty:
+                if remaining(plan.deadline) <= 0:
+                    raise DeadlineExceeded(f"The {route.name} route deadline passed while waiting on the model", llm_limiter.retry_after())
+                continue
+            if attempt not in pending:
+                continue
+            if isinstance(item, str) or item.exception() is None:
+                break
+            model_name, kind = pending.pop(attempt)
+            error = item.exception()
+            logger.warning(f"{kind.capitalize()} stream for the {route.name} route on {model_name} failed: {error}")
+
+        # Commit to the first attempt with output (or one that finished without any) and stop the rest
+        winner = attempt
+        model_name, kind = pending.pop(winner)
+        for other in pending:
+            other.cancel()
+        pending = {winner: (model_name, kind)}
+        route_wins_total.inc(route.name, kind)
+        while True:
+            if attempt is winner:
+                if not isinstance(item, str):
+                    break
+                yield item
+            attempt, item = events.get()
+        item.result()
+        if served_by is not None:
+            served_by.append(model_name)
+        pending = {}
+    finally:
+        for attempt in pending:
+            attempt.cancel()
+
+def routed_stream(prompt: str, route: ModelRoute, timeout: float = None, served_by: list = None):
+    """Yield deltas from the route's model, or from its fallback if the primary fails before the first one
+
+    On a racing route the fallback (and any hedge) also starts once its
+    delay passes without a first delta, and the first attempt to produce one
+    is streamed. The model that produced the output is appended to
+    `served_by` when given.
+    """
+    if route.races:
+        yield from _race_stream(prompt, route, RacePlan(route, time.monotonic()), timeout, served_by)
+        return
+    deadline = time.monotonic() + route.deadline
+    attempts = _stream_attempts(route)
+    for number, (model_name, kind) in enumerate(attempts, 1):
+        _start_attempt(route, model_name, kind)
+        streamed = False
+        try:
+            for chunk in stream_completion_openai(prompt, _deadline_timeout(deadline, timeout), model_name):
+                streamed = True
+                yield chunk
+        except Overloaded:
+            raise
+        except Exception as e:
+            if streamed or number == len(attempts):
+                raise
+            logger.warning(f"{kind.capitalize()} stream for the {route.name} route on {model_name} failed: {e}")
+            continue
+        route_wins_total.inc(route.name, kind)
+        if served_by is not None:
+            served_by.append(model_name)
+        return
+
+async def _stream_deltas_async(client, prompt: str, model_name: str, timeout: float, deadline: float):
+    stream = await call_with_retries_async(lambda: client.responses.create(
+        model=model_name,
+        input=prompt,
+        stream=True,
+        timeout=timeout
+    ), deadline)
+    try:
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(f"Streamed completion failed: {event}")
+            left = remaining(deadline)
+            if left is not None and left <= 0:
+                raise DeadlineExceeded("Request deadline passed while streaming from the model", llm_limiter.retry_after())
+    finally:
+        await stream.close()
+
+async def _race_stream_async(prompt: str, route: ModelRoute, plan: RacePlan, client, timeout: float = None,
+                             served_by: list = None):
+    """_race_stream for the asyncio server; attempts that lose the race are cancelled"""
+    # (task, delta) as chunks arrive, and (task, task) when an attempt ends
+    events = asyncio.Queue()
+    pending = {}
+    error = None
+
+    async def attempt(model_name):
+        task = asyncio.current_task()
+        deltas = _stream_deltas_async(client, prompt, model_name, _deadline_timeout(plan.deadline, timeout), plan.deadline)
+        try:
+            async for chunk in deltas:
+                events.put_nowait((task, chunk))
+        finally:
+            await deltas.aclose()
+
+    try:
+        while True:
+            now = time.monotonic()
+            for model_name, kind in plan.due(now, len(pending)):
+                racing = bool(pending) and kind in (HEDGE, FALLBACK)
+                if racing and not _racing_slot(route, plan, model_name, kind):
+                    continue
+                _start_attempt(route, model_name, kind, plan)
+                task = asyncio.ensure_future(attempt(model_name))
+                task.add_done_callback(lambda task: events.put_nowait((task, task)))
+                if racing:
+                    task.add_done_callback(lambda _: _racing_slots.release())
+                pending[task] = (model_name, kind)
+            if not pending:
+                raise error
+            try:
+                task, item = await asyncio.wait_for(events.get(), max(0.0, plan.wait_until() - now))
+            except asyncio.TimeoutError:
+                if remaining(plan.deadline) <= 0:
+                    raise DeadlineExceeded("Request deadline passed while waiting on the model", llm_limiter.retry_after())
+                continue
+            if task not in pending:
+                continue
+            if isinstance(item, str) or item.exception() is None:
+                break
+            model_name, kind = pending.pop(task)
+            error = item.exception()
+            logger.warning(f"{kind.capitalize()} stream for the {route.name} route on {model_name} failed: {error}")
+
+        # Commit to the first attempt with output (or one that finished without any) and stop the rest
+        winner = task
+        model_name, kind = pending.pop(winner)
+        for other in pending:
+            other.cancel()
+        pending = {winner: (model_name, kind)}
+        route_wins_total.inc(route.name, kind)
+        while True:
+            if task is winner:
+                if not isinstance(item, str):
+                    break
+                yield item
+            task, item = await events.get()
+        item.result()
+        if served_by is not None:
+            served_by.append(model_name)
+        pending = {}
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def routed_stream_async(prompt: str, route: ModelRoute, timeout: float = None, deadline: float = None, served_by: list = None):
+    """routed_stream for the asyncio server"""
+    client = get_async_openai_client()
+    if route.races:
+        plan = RacePlan(route, time.monotonic())
+        if deadline is not None:
+            plan.deadline = min(plan.deadline, deadline)
+        deltas = _race_stream_async(prompt, route, plan, client, timeout, served_by)
+        try:
+            async for chunk in deltas:
+                yield chunk
+        finally:
+            await deltas.aclose()
+        return
+    attempts = _stream_attempts(route)
+    for number, (model_name, kind) in enumerate(attempts, 1):
+        _start_attempt(route, model_name, kind)
+        streamed = False
+        deltas = _stream_deltas_async(client, prompt, model_name, _deadline_timeout(deadline, timeout), deadline)
+        try:
+            async for chunk in deltas:
+                streamed = True
+                yield chunk
+        except Overloaded:
+            raise
+        except Exception as e:
+            if streamed or number == len(attempts):
+                raise
+            logger.warning(f"{kind.capitalize()} stream for the {route.name} route on {model_name} failed: {e}")
+            continue
+        finally:
+            # Close the upstream stream now rather than whenever the generator is collected
+            await deltas.aclose()
+        route_wins_total.inc(route.name, kind)
+        if served_by is not None:
+            served_by.append(model_name)
+        return
+
+def _route_deadline(route: ModelRoute, deadline: float = None) -> float:
+    """The earlier of the request deadline and the route's own"""
+    route_deadline = time.monotonic() + route.deadline
+    return route_deadline if deadline is None else min(deadline, route_deadline)
+
+def _cache_key(prompt: str, track_codes, catalog_version: str, route: ModelRoute):
+    if completion_cache is None:
+        return None
+    return make_cache_key(prompt, route.model, track_codes or (), catalog_version or "")
+
+def _cached(cache_key):
+    """Completion cache lookup, timed as the "cache" stage"""
+    if cache_key is None:
+        return None
+    with stage("cache"):
+        return completion_cache.get(cache_key)
+
+async def _cached_async(cache_key):
+    """_cached() for the event loop: the memory tier inline, the SQLite tier in a worker thread"""
+    if cache_key is None:
+        return None
+    with stage("cache"):
+        cached = completion_cache.get_memory(cache_key)
+        if cached is None:
+            cached = await asyncio.to_thread(completion_cache.get_disk, cache_key)
+        return cached
+
+def _flight_key(cache_key, prompt: str, track_codes, catalog_version: str, route: ModelRoute):
+    """Single-flight key; the same hash as the cache key so coalescing works with the cache off too"""
+    return cache_key or make_cache_key(prompt, route.model, track_codes or (), catalog_version or "")
+
+def get_completion(prompt: str, is_json=True, timeout: float = None, track_codes=None, catalog_version=None, route: str = None):
     # Simplified - always use OpenAI, no email routing
     if is_json:
         prompt = f"{prompt}. Output should be valid JSON only, no markdown or commentary."
     
-    logger.info(f"Getting completion for prompt: {prompt}")
     start_time = time.time()
+    route = get_route(route)
     
-    # Always use OpenAI
-    logger.info("Getting completion using OpenAI")
-    response_text = get_completion_openai(prompt)
+    cache_key = _cache_key(prompt, track_codes, catalog_version, route)
+    cached = _cached(cache_key)
+    if cached is not None:
+        if sampled():
+            logger.info(f"Completion cache hit in {time.time() - start_time:.4f}s", extra=VERBOSE)
+        return cached
     
+    def fetch():
+        response_text, served_model = routed_completion(prompt, route, timeout)
+        # Fallback replies are good enough to send but not to keep
+        if cache_key is not None and served_model == route.model:
+            completion_cache.set(cache_key, response_text, catalog_version)
+        return response_text
+
+    with stage("upstream"):
+        if completion_flights is None:
+            response_text = fetch()
+        else:
+            response_text = completion_flights.do(_flight_key(cache_key, prompt, track_codes, catalog_version, route), fetch)
+    completion_chars.observe(len(response_text))
+    
+    seconds = time.time() - start_time
+    if sampled():
+        logger.info(f"Completion ({route.name} route) in {seconds:.3f}s; prompt {log_body(prompt)}; response {log_body(response_text)}", extra=VERBOSE)
+    return response_text
+
+def get_completion_stream(prompt: str, is_json=False, timeout: float = None, track_codes=None, catalog_version=None, route: str = None):
+    """Yield completion text chunks as the model produces them"""
+    if is_json:
+        prompt = f"{prompt}. Output should be valid JSON only, no markdown or commentary."
+
+    start_time = time.time()
+    route = get_route(route)
+
+    cache_key = _cache_key(prompt, track_codes, catalog_version, route)
+    cached = _cached(cache_key)
+    if cached is not None:
+        if sampled():
+            logger.info(f"Completion cache hit in {time.time() - start_time:.4f}s", extra=VERBOSE)
+        yield cached
+        return
+    first_chunk_seconds = None
+    chunks = []
+    served_by = []
+
+    for chunk in routed_stream(prompt, route, timeout, served_by):
+        if first_chunk_seconds is None:
+            first_chunk_seconds = time.time() - start_time
+        chunks.append(chunk)
+        yield chunk
+
+    seconds = time.time() - start_time
+    response_text = "".join(chunks)
+    record("upstream", seconds)
+    completion_chars.observe(len(response_text))
+    if sampled():
+        logger.info(f"Streamed completion ({route.name} route) in {seconds:.3f}s (first token after {first_chunk_seconds}); "
+                    f"prompt {log_body(prompt)}; response {log_body(response_text)}", extra=VERBOSE)
+    if cache_key is not None and served_by == [route.model]:
+        completion_cache.set(cache_key, response_text, catalog_version)
+
+async def get_completion_async(prompt: str, is_json=True, timeout: float = None, track_codes=None, catalog_version=None,
+                               deadline: float = None, route: str = None):
+    """get_completion for the asyncio server: bounded by llm_limiter, the request deadline and the route's deadline"""
+    if is_json:
+        prompt = f"{prompt}. Output should be valid JSON only, no markdown or commentary."
+
+    start_time = time.time()
+    route = get_route(route)
+    deadline = _route_deadline(route, deadline)
+
+    cache_key = _cache_key(prompt, track_codes, catalog_version, route)
+    cached = await _cached_async(cache_key)
+    if cached is not None:
+        if sampled():
+            logger.info(f"Completion cache hit in {time.time() - start_time:.4f}s", extra=VERBOSE)
+        return cached
+
+    async def fetch():
+        queued = time.perf_counter()
+        # Hedged and fallback attempts share the slot of the request they belong to
+        async with llm_limiter.slot(deadline):
+            record("queue", time.perf_counter() - queued)
+            response_text, served_model = await routed_completion_async(prompt, route, timeout, deadline)
+        if cache_key is not None and served_model == route.model:
+            completion_cache.set(cache_key, response_text, catalog_version)
+        return response_text
+
+    with stage("upstream"):
+        if completion_flights is None:
+            response_text = await fetch()
+        else:
+            # Joiners wait for the leader's call within their own deadline and never take a model slot
+            try:
+                response_text = await completion_flights.do_async(
+                    _flight_key(cache_key, prompt, track_codes, catalog_version, route), fetch, remaining(deadline)
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Request deadline passed while waiting on the model", llm_limiter.retry_after()) from None
+    completion_chars.observe(len(response_text))
+
+    seconds = time.time() - start_time
+    if sampled():
+        logger.info(f"Async completion ({route.name} route) in {seconds:.3f}s; prompt {log_body(prompt)}; response {log_body(response_text)}", extra=VERBOSE)
+    return response_text
+
+async def get_completion_stream_async(prompt: str, is_json=False, timeout: float = None, track_codes=None, catalog_version=None,
+                                      deadline: float = None, route: str = None):
+    """Async generator of completion chunks; the upstream slot is held until the stream ends"""
+    if is_json:
+        prompt = f"{prompt}. Output should be valid JSON only, no markdown or commentary."
+
+    start_time = time.time()
+    route = get_route(route)
+    deadline = _route_deadline(route, deadline)
+
+    cache_key = _cache_key(prompt, track_codes, catalog_version, route)
+    cached = await _cached_async(cache_key)
+    if cached is not None:
+        if sampled():
+            logger.info(f"Completion cache hit in {time.time() - start_time:.4f}s", extra=VERBOSE)
+        yield cached
+        return
+
+    first_chunk_seconds = None
+    chunks = []
+    served_by = []
+    queued = time.perf_counter()
+    async with llm_limiter.slot(deadline):
+        record("queue", time.perf_counter() - queued)
+        deltas = routed_stream_async(prompt, route, timeout, deadline, served_by)
+        try:
+            async for chunk in deltas:
+                if first_chunk_seconds is None:
+                    first_chunk_seconds = time.time() - start_time
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await deltas.aclose()
+
     seconds = time.time() - start_time
-    logger.info(f"Completion response in {seconds}: {response_text}")
-    return response_text
\ No newline at end of file
+    response_text = "".join(chunks)
+    record("upstream", seconds)
+    completion_chars.observe(len(response_text))
+    if sampled():
+        logger.info(f"Async streamed completion ({route.name} route) in {seconds:.3f}s (first token after {first_chunk_seconds}); "
+                    f"prompt {log_body(prompt)}; response {log_body(response_text)}", extra=VERBOSE)
+    if cache_key is not None and served_by == [route.model]:
+        completion_cache.set(cache_key, response_text, catalog_version)
\ No newline at end of file
@@ -0,0 +1,290 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from werkzeug.serving import make_server
+from mylogger import logger, stop_listener
+
+# Pre-fork deployment of the Flask app across cores.
+#
+# The parent loads the catalog and builds its indexes once, moves everything
+# it allocated out of the garbage collector's reach (gc.freeze) and forks the
+# workers, which accept connections on one inherited listening socket. The
+# catalog, the BM25 postings (flat arrays) and the TF-IDF matrix are shared
+# copy-on-write, so adding a worker costs only what that worker allocates and
+# starting one takes milliseconds. Track objects a worker touches get private
+# copies of their pages as their reference counts change.
+#
+#   python prefork.py [catalog.json] --workers 4 --port 5000
+#   MIRA_WORKERS=4 python app.py [catalog.json]
+#
+# Each worker keeps its own caches and /metrics. Conversations live in
+# memory per worker, but every turn goes to the shared SQLite conversation
+# log and workers catch up on turns other workers wrote (see
+# ConversationStore), so a session may hit any worker. POST /init in a
+# worker is forwarded to the parent (request_reload), as is SIGHUP sent to
+# the parent directly: the parent reloads the catalog and replaces the
+# workers one at a time.
+#
+# A worker told to stop (SIGTERM, on reload or shutdown) stops accepting
+# connections, lets in-flight requests and streams finish for up to
+# MIRA_WORKER_DRAIN_SECONDS, runs the `on_exit` hook (commit write-behind
+# queues) and only then exits.
+
+
+# Write end of the pipe workers use to pass the parent a catalog path with a reload request
+_reload_fd = None
+_in_worker = False
+
+
+def in_worker() -> bool:
+    """Whether this process is a pre-forked worker"""
+    return _in_worker
+
+
+def request_reload(json_file_path: str = None) -> bool:
+    """From a worker: ask the parent to reload the catalog and replace every worker; False outside a worker"""
+    if not _in_worker or _reload_fd is None:
+        return False
+    # Writes under PIPE_BUF bytes are atomic, so concurrent requests never interleave
+    os.write(_reload_fd, ((json_file_path or "") + "\n").encode('utf-8'))
+    os.kill(os.getppid(), signal.SIGHUP)
+    return True
+
+
+def _requested_path(read_fd: int):
+    """The catalog path of the latest reload request waiting in the pipe (None for the default)"""
+    data = b""
+    while True:
+        try:
+            chunk = os.read(read_fd, 65536)
+        except BlockingIOError:
+            break
+        if not chunk:
+            break
+        data += chunk
+    paths = [line for line in data.decode('utf-8', 'replace').splitlines() if line]
+    return paths[-1] if paths else None
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class _InFlight:
+    """Counts a worker's requests being handled, so a stopping worker can wait for them"""
+
+    def __init__(self, server):
+        self._count = 0
+        self._idle = threading.Condition()
+        process_request, process_request_thread = server.process_request, server.process_request_thread
+
+        # Counted when accepted (on the serving thread), so none slips past a wait that starts after shutdown()
+        def counted(request, client_address):
+            with self._idle:
+                self._count += 1
+            try:
+                process_request(request, client_address)
+            except BaseException:
+                self._done()
+                raise
+
+        def handled(request, client_address):
+            try:
+                process_request_thread(request, client_address)
+            finally:
+                self._done()
+
+        server.process_request = counted
+        server.process_request_thread = handled
+
+    def _done(self):
+        with self._idle:
+            self._count -= 1
+            self._idle.notify_all()
+
+    def wait(self, timeout: float) -> int:
+        """Wait for in-flight requests to finish; returns how many are still running"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._count <= 0, timeout)
+            return self._count
+
+
+def _run_worker(wsgi_app, sock: socket.socket, host: str, port: int, on_exit=None):
+    server = make_server(host, port, wsgi_app, threaded=True, fd=sock.fileno())
+    # Every worker wakes for a new connection but only one gets it; the rest must not block in accept()
+    server.socket.setblocking(False)
+    in_flight = _InFlight(server)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, which runs on this (the main) thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    logger.info(f"Worker {os.getpid()} serving on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        # Stop accepting (the parent and other workers keep the listening socket), then drain
+        server.server_close()
+        remaining = in_flight.wait(float(os.getenv("MIRA_WORKER_DRAIN_SECONDS", "30")))
+        if remaining:
+            logger.warning(f"Worker {os.getpid()} stopping with {remaining} requests still running")
+        if on_exit is not None:
+            on_exit()
+
+
+def _fork_worker(wsgi_app, sock: socket.socket, host: str, port: int, on_exit=None) -> int:
+    global _in_worker
+    pid = os.fork()
+    if pid:
+        return pid
+    _in_worker = True
+    code = 0
+    try:
+        _run_worker(wsgi_app, sock, host, port, on_exit)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 0
+    except KeyboardInterrupt:
+        pass
+    except BaseException as e:
+        logger.error(f"Worker {os.getpid()} crashed: {e}")
+        code = 1
+    finally:
+        # Never return into the parent's supervision loop
+        stop_listener()
+        os._exit(code)
+
+
+def _freeze(warm_up=None):
+    """Warm the parent up, then keep the garbage collector off everything it holds so forks share those pages"""
+    if warm_up is not None:
+        try:
+            warm_up()
+        except Exception as e:
+            logger.warning(f"Warm-up before forking failed: {e}")
+    gc.collect()
+    gc.freeze()
+
+
+def serve(wsgi_app, workers: int, host: str = "0.0.0.0", port: int = 5000, reload=None, warm_up=None, on_exit=None):
+    """Fork `workers` processes serving wsgi_app on one socket and keep them running until SIGTERM / SIGINT
+
+    Call this after the catalog is loaded. `warm_up`, if given, runs in the
+    parent before each round of forks; exercising the request path there
+    (without calling the model) keeps lazily built state shared rather than
+    copied into every worker. `reload`, if given, is called in the parent
+    with the requested catalog path (None for the default) on SIGHUP or a
+    worker's request_reload(), before the workers are replaced by fresh forks.
+    `on_exit`, if given, runs in each worker once it has drained, before it
+    exits without running atexit handlers.
+    """
+    global _reload_fd
+    sock = bind_socket(host, port)
+    read_fd, _reload_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    _freeze(warm_up)
+
+    children = {}
+    stopping = False
+    reload_requested = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def request_reload(signum, frame):
+        nonlocal reload_requested
+        reload_requested = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, request_reload)
+
+    started = time.perf_counter()
+    for _ in range(workers):
+        children[_fork_worker(wsgi_app, sock, host, port, on_exit)] = time.monotonic()
+    logger.info(f"Started {workers} workers on {host}:{port} in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    while children:
+        if reload_requested and not stopping:
+            reload_requested = False
+            _replace_workers(wsgi_app, sock, host, port, children, reload, warm_up, _requested_path(read_fd), on_exit)
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        spawned = children.pop(pid, None)
+        if spawned is None or stopping:
+            continue
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; starting a replacement")
+        # Do not spin if workers die right after starting
+        if time.monotonic() - spawned < 1:
+            time.sleep(1)
+        children[_fork_worker(wsgi_app, sock, host, port, on_exit)] = time.monotonic()
+
+    sock.close()
+    os.close(read_fd)
+    logger.info("All workers stopped")
+
+
+def _replace_workers(wsgi_app, sock, host: str, port: int, children: dict, reload=None, warm_up=None,
+                     json_file_path: str = None, on_exit=None):
+    """Run the reload hook, then swap each worker for a fresh fork of the reloaded parent"""
+    if reload is not None:
+        gc.unfreeze()
+        try:
+            reload(json_file_path)
+        except Exception as e:
+            logger.error(f"Reload failed; keeping the current workers: {e}")
+            gc.freeze()
+            return
+        _freeze(warm_up)
+    old_pids = list(children)
+    for old_pid in old_pids:
+        # Retired workers leave the table first so their exit is not mistaken for a crash
+        del children[old_pid]
+        children[_fork_worker(wsgi_app, sock, host, port, on_exit)] = time.monotonic()
+        try:
+            os.kill(old_pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    logger.info(f"Replaced {len(old_pids)} workers")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the MIRA Flask app from pre-forked workers sharing one catalog")
+    parser.add_argument("json_file", nargs="?", help="catalog export (defaults to MIRA_JSON_FILE_PATH)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MIRA_WORKERS", "0")) or os.cpu_count())
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    # app imports this module as `prefork`; let it see this copy's worker state
+    sys.modules.setdefault("prefork", sys.modules[__name__])
+    import app as mira_app
+    json_file = args.json_file or os.getenv("MIRA_JSON_FILE_PATH", mira_app.DEFAULT_JSON_FILE_PATH)
+    if not mira_app.initialize_bot(json_file):
+        sys.exit(1)
+    serve(mira_app.app, args.workers, args.host, args.port, warm_up=mira_app.warm_up, on_exit=mira_app.flush_writes,
+          reload=lambda requested=None: mira_app.bot.reload_catalog(requested or json_file))
@@ -0,0 +1,217 @@
+import os
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional; fall back to the estimator below
+    _encoding = None
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+_TRACK_LINE_RE = re.compile(r"^[\s*#>-]*Track:\**\s*(.+?)\s*(?:-\s*\[|\(http|$)", re.M)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+HISTORY_START = "This is the start of our conversation."
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, otherwise a close estimate
+
+    The estimate counts short words and punctuation as one token and
+    longer words as one token per four characters.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        tokens += (len(piece) + 3) // 4
+    return tokens
+
+
+@lru_cache(maxsize=64)
+def count_fixed_tokens(text: str) -> int:
+    """count_tokens for the static prompt sections, computed once per distinct text"""
+    return count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, on a word boundary"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max_tokens * 4].rsplit(' ', 1)[0]
+    return cut.rstrip() + "…"
+
+
+def compress_reply(message: str, max_tokens: int) -> str:
+    """Shorten a long MIRA reply to its opening sentence plus the tracks it recommended"""
+    if count_tokens(message) <= max_tokens:
+        return message
+    opening = _SENTENCE_END_RE.split(message.strip(), 1)[0].split("\n", 1)[0]
+    names = [name.strip("*[] ") for name in _TRACK_LINE_RE.findall(message)]
+    summary = opening
+    if names:
+        summary = f"{opening} [Recommended: {'; '.join(names)}]"
+    return truncate_to_tokens(summary, max_tokens)
+
+
+def track_line(track, max_tags: int) -> str:
+    """One AVAILABLE TRACKS line, keeping only the first max_tags display tags"""
+    tags = track['displayTags']
+    if max_tags and tags.count(',') >= max_tags:
+        tags = ','.join(tags.split(',')[:max_tags])
+    return (
+        f"trackCode: {track['trackCode']}, name: {track['name']}, "
+        f"bpm: {track['bpm']}, hasVocals: {track['hasVocals']}, "
+        f"name_slug: {track['name_slug']}, displayTags: {tags}"
+    )
+
+
+class RenderedTracks:
+    """Ranked tracks with their AVAILABLE TRACKS lines and token counts, rendered once and reusable across prompts"""
+
+    __slots__ = ('tracks', 'lines', 'tokens', '_blocks')
+
+    def __init__(self, tracks: list, max_tags: int):
+        self.tracks = tracks
+        self.lines = [track_line(track, max_tags) for track in tracks]
+        self.tokens = [count_tokens(line) + 1 for line in self.lines]
+        self._blocks = {}
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def block(self, count: int) -> str:
+        """The first `count` lines as one string, joined once per count"""
+        text = self._blocks.get(count)
+        if text is None:
+            text = self._blocks[count] = "".join(line + "\n" for line in self.lines[:count])
+        return text
+
+
+class BuiltPrompt:
+    """An assembled prompt with the track codes it offers and its per-section token counts
+
+    `output` is "json" when the model is asked for a structured reply to be rendered locally;
+    `route` names the model route (see model_routing) that should answer it.
+    """
+
+    __slots__ = ('text', 'track_codes', 'token_counts', 'output', 'route')
+
+    def __init__(self, text: str, track_codes: list, token_counts: dict, output: str = "text", route: str = None):
+        self.text = text
+        self.track_codes = track_codes
+        self.token_counts = token_counts
+        self.output = output
+        self.route = route
+
+
+class PromptBuilder:
+    """Assembles model prompts within a token budget
+
+    The system prompt and the closing request are always sent in full. What
+    is left goes to the ranked track candidates (up to `track_share` of it,
+    at least `min_tracks` of them) and then to conversation history, newest
+    turn first, with long MIRA replies compressed. Budget the history does
+    not use is handed back to the tracks.
+    """
+
+    def __init__(self, max_tokens: int = None, track_share: float = 0.6, min_tracks: int = 3,
+                 max_tags: int = 6, max_reply_tokens: int = 80, max_message_tokens: int = 200):
+        if max_tokens is None:
+            max_tokens = int(os.getenv("MIRA_PROMPT_TOKEN_BUDGET", "2000"))
+        self.max_tokens = max_tokens
+        self.track_share = track_share
+        self.min_tracks = min_tracks
+        self.max_tags = max_tags
+        self.max_reply_tokens = max_reply_tokens
+        self.max_message_tokens = max_message_tokens
+
+    def render(self, tracks: list) -> RenderedTracks:
+        return RenderedTracks(tracks, self.max_tags)
+
+    def _select_tracks(self, rendered: RenderedTracks, budget: int, start: int = 0):
+        """How many track lines after the first `start` fit, in rank order; returns (count, tokens used)"""
+        count = 0
+        used = 0
+        for tokens in rendered.tokens[start:]:
+            if used + tokens > budget and start + count >= self.min_tracks:
+                break
+            count += 1
+            used += tokens
+        return count, used
+
+    def _select_history(self, history: list, budget: int):
+        """Newest-first history lines that fit; returns (lines in chronological order, tokens used)"""
+        lines = []
+        used = 0
+        for role, message in reversed(history):
+            limit = self.max_reply_tokens if role != "User" else self.max_message_tokens
+            if role == "User":
+                message = truncate_to_tokens(message, limit)
+            else:
+                message = compress_reply(message, limit)
+            line = f"{role}: {message}"
+            tokens = count_tokens(line) + 1
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            used += tokens
+        lines.reverse()
+        return lines, used
+
+    def build(self, system_prompt: str, history: list, closing: str, tracks=None,
+              empty_tracks_note: str = None, summary: str = None) -> BuiltPrompt:
+        """Assemble system prompt, tracks (when given), summary, history and closing request in one join
+
+        `tracks` is a ranked list of tracks or, to reuse lines already built, RenderedTracks.
+        """
+        summary_tokens = count_tokens(summary) if summary else 0
+        fixed = count_fixed_tokens(system_prompt) + count_tokens(closing) + summary_tokens + 12
+        available = max(0, self.max_tokens - fixed)
+
+        if tracks is not None and not isinstance(tracks, RenderedTracks):
+            tracks = self.render(tracks)
+        selected = 0
+        tracks_used = 0
+        if tracks is not None:
+            selected, tracks_used = self._select_tracks(tracks, int(available * self.track_share))
+
+        history_lines, history_used = self._select_history(history, max(0, available - tracks_used))
+
+        # Give whatever history left unused back to the remaining track candidates
+        if tracks is not None and selected < len(tracks):
+            spare = available - tracks_used - history_used
+            if spare > 0:
+                extra_count, extra = self._select_tracks(tracks, spare, start=selected)
+                selected += extra_count
+                tracks_used += extra
+
+        parts = [system_prompt, "\n\n"]
+        if tracks is not None:
+            parts.append("AVAILABLE TRACKS:\n")
+            if selected:
+                parts.append(tracks.block(selected))
+            elif empty_tracks_note:
+                parts.append(empty_tracks_note)
+                parts.append("\n")
+            parts.append("\n")
+        if summary:
+            parts.append("CONVERSATION SUMMARY:\n")
+            parts.append(summary)
+            parts.append("\n\n")
+        parts.append("CONVERSATION HISTORY:\n")
+        parts.append("\n".join(history_lines) if history_lines else HISTORY_START)
+        parts.append("\n\n")
+        parts.append(closing)
+
+        token_counts = {
+            "system": count_fixed_tokens(system_prompt),
+            "tracks": tracks_used,
+            "summary": summary_tokens,
+            "history": history_used,
+            "request": count_tokens(closing),
+        }
+        token_counts["total"] = sum(token_counts.values())
+        track_codes = [track.track_code for track in tracks.tracks[:selected]] if tracks is not None else []
+        return BuiltPrompt("".join(parts), track_codes, token_counts)
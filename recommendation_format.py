@@ -0,0 +1,105 @@
+import json
+import re
+
+# Structured recommendation mode: the model returns only the chosen track codes and a few short
+# reasoning fields as JSON, and the full MIRA markdown (names, links, ROI block) is rendered
+# here from the catalog, so links always match the track they name.
+
+STRUCTURED_INSTRUCTIONS = """Reply with JSON only, no markdown, no links:
+{"intro": "<1-2 sentences on why these picks fit>",
+ "picks": [{"code": "<trackCode from AVAILABLE TRACKS>", "why": "<reason>", "engagement": "<engagement rate estimate>",
+            "watch_time": "<watch time estimate>", "ctr": "<CTR estimate>", "audience": "<target audience>",
+            "reels": "<estimated reels views, e.g. 1.2M>"}],
+ "follow_up": "<one follow-up question>"}
+Exactly 3 picks, each code copied exactly from AVAILABLE TRACKS. Keep every field under 25 words."""
+
+PICK_FIELDS = ("why", "engagement", "watch_time", "ctr", "audience", "reels")
+
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.S)
+
+
+def track_url(track) -> str:
+    return f"https://hooprsmash.com/tracks/{track.name_slug}/{track.track_code}"
+
+
+def parse_structured_reply(text: str):
+    """The JSON object in a model reply (tolerating code fences or stray prose), or None"""
+    match = _JSON_OBJECT_RE.search(text or "")
+    if match is None:
+        return None
+    try:
+        reply = json.loads(match.group(0))
+    except ValueError:
+        return None
+    return reply if isinstance(reply, dict) else None
+
+
+def _text(value, default: str = "") -> str:
+    """A reply field as a single line of text"""
+    if value is None:
+        return default
+    return " ".join(str(value).split()) or default
+
+
+def validated_picks(reply: dict, by_code: dict, offered_codes: list, count: int = 3) -> list:
+    """(track, fields) for the model's picks that are real catalog tracks it was offered
+
+    Unknown, duplicate or unoffered codes are dropped; missing picks are
+    filled with the best-ranked offered tracks, with empty reasoning fields.
+    """
+    offered = set(offered_codes)
+    picks = []
+    seen = set()
+    raw_picks = reply.get("picks") if isinstance(reply, dict) else None
+    for pick in raw_picks if isinstance(raw_picks, list) else []:
+        if not isinstance(pick, dict):
+            continue
+        code = _text(pick.get("code") or pick.get("trackCode"))
+        track = by_code.get(code)
+        if track is None or code not in offered or code in seen:
+            continue
+        seen.add(code)
+        picks.append((track, {field: _text(pick.get(field)) for field in PICK_FIELDS}))
+        if len(picks) == count:
+            return picks
+    for code in offered_codes:
+        if len(picks) == count:
+            break
+        track = by_code.get(code)
+        if track is not None and code not in seen:
+            seen.add(code)
+            picks.append((track, {}))
+    return picks
+
+
+def render_pick(track, fields: dict) -> str:
+    """One recommendation in MIRA's markdown format, with the link built from the catalog"""
+    url = track_url(track)
+    tags = ", ".join(tag.strip() for tag in track.display_tags.split(",")[:4] if tag.strip())
+    return "\n".join([
+        f"Track: {track.name} - [Hoopr Smash Link]({url})",
+        f"Why: {fields.get('why') or f'Matches the brief with a {tags} feel.'}",
+        "ROI impact:",
+        "Metric | Expected Performance",
+        f"Engagement Rate : {fields.get('engagement') or 'n/a'}",
+        f"Watch Time : {fields.get('watch_time') or 'n/a'}",
+        f"CTR : {fields.get('ctr') or 'n/a'}",
+        f"Audience: {fields.get('audience') or 'n/a'}",
+        f"Reels Count: Estimated {fields.get('reels') or 'n/a'} views",
+        f"Hoopr Smash Link: {url}",
+    ])
+
+
+def render_recommendations(text: str, by_code: dict, offered_codes: list) -> str:
+    """Final MIRA reply for a structured completion; falls back to the top offered tracks if it is unusable"""
+    reply = parse_structured_reply(text) or {}
+    if reply.get("picks") == []:
+        # The model declined on purpose (e.g. an off-topic request)
+        return _text(reply.get("intro"), "this is not related to hoopr or music")
+    picks = validated_picks(reply, by_code, offered_codes)
+    if not picks:
+        return "No tracks in the catalog match the requested filters. Want me to loosen them?"
+    parts = [_text(reply.get("intro"), "Here are three tracks that fit your brief.")]
+    parts.extend(render_pick(track, fields) for track, fields in picks)
+    parts.append(_text(reply.get("follow_up"), "Want me to adjust the mood, tempo or vocals?"))
+    return "\n\n".join(parts)
@@ -0,0 +1,84 @@
+import re
+import threading
+from collections import OrderedDict
+from track_index import tokenize
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Filler that never narrows a catalog search; dropped before ranking so phrasings of one request share an entry
+STOPWORDS = frozenset(
+    "a an and any are as at be best by can could do find for from get give good i im in is it its just like "
+    "looking me my need of on or our please recommend show so some suggest that the this to us want we with "
+    "would you your".split()
+)
+
+
+def normalize_query(text: str) -> str:
+    """A message as the retrieval query: lowercased, stopwords dropped, tokens deduplicated and sorted"""
+    words = [word for word in _WORD_RE.findall(text.lower()) if word not in STOPWORDS]
+    return " ".join(sorted(set(tokenize(" ".join(words)))))
+
+
+class RetrievalEntry:
+    """The top `limit` ranked tracks for one query, plus their rendered prompt lines once built"""
+
+    __slots__ = ('tracks', 'limit', 'rendered')
+
+    def __init__(self, tracks: list, limit: int):
+        self.tracks = tracks
+        self.limit = limit
+        self.rendered = None
+
+    def covers(self, limit: int) -> bool:
+        """Whether this entry holds the top `limit` tracks (or every match there is)"""
+        return limit <= self.limit or len(self.tracks) < self.limit
+
+
+class RetrievalCache:
+    """Bounded LRU of retrieval results
+
+    Keys carry the catalog version, so entries for a replaced catalog never
+    match again; clear() drops them at once when the catalog is swapped.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, limit: int = 0):
+        """The entry for key if it ranks at least `limit` tracks deep, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.covers(limit):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: RetrievalEntry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
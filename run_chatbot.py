@@ -1,7 +1,6 @@
 from chatbot import MiraMusicRecommendationBot
 import os
 import sys
-import json
 
 def validate_json_file(json_file_path: str) -> bool:
     """Validate JSON file exists and has valid structure"""
@@ -10,23 +9,16 @@ def validate_json_file(json_file_path: str) -> bool:
         return False
     
     try:
+        # Only sniff the opening of the document; the bot streams and fully validates it while loading
         with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+            head = f.read(4096).lstrip()
         
-        # Check if it's a valid structure
-        if isinstance(data, list) and len(data) > 0:
-            #print(f"Valid JSON array with {len(data)} items")
+        if head[:1] in ('[', '{'):
             return True
-        elif isinstance(data, dict) and any(key in data for key in ['tracks', 'data', 'results']):
-            #print(f"Valid JSON object structure")
-            return True
-        else:
-            #print(f" JSON structure might not be optimal, but will attempt to load")
-            return True
-            
-    except json.JSONDecodeError as e:
-        print(f"Invalid JSON format: {e}")
+        
+        print("Invalid JSON format: expected a JSON array or object of tracks")
         return False
+            
     except Exception as e:
         print(f"Error reading file: {e}")
         return False
@@ -106,8 +98,10 @@ def main():
             
             # Get MIRA response
             print("MIRA is analyzing your request and matching tracks...")
-            response = bot.chat(user_input)
-            print(f"\nMIRA: {response}")
+            print("\nMIRA: ", end="", flush=True)
+            for chunk in bot.chat_stream(user_input):
+                print(chunk, end="", flush=True)
+            print()
             
         except KeyboardInterrupt:
             print("\n\n👋 Session interrupted. Goodbye!")
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one execution
+
+    The first caller for a key (the leader) runs the work; callers that
+    arrive while it is in flight wait for and share its result or error.
+    Nothing is remembered once the call finishes; that is the cache's job.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn):
+        """Run fn() for key, or wait for the identical call already running in another thread"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = Future()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key: str, make_coro, timeout: float = None):
+        """Await make_coro() for key, or join the identical task already running on this loop
+
+        The work runs as its own task, so a caller that is cancelled or times
+        out does not cancel it for the others.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coro())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    def _forget(self, key: str, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the error as retrieved even if every waiter has gone away
+            task.exception()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks)
+            calls = self.leaders + self.coalesced
+            return {
+                "upstream_calls": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_rate": self.coalesced / calls if calls else 0.0,
+                "in_flight": in_flight,
+            }
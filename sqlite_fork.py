@@ -0,0 +1,24 @@
+import os
+
+# SQLite connections and os.fork().
+#
+# A forked child must neither use a connection it inherited (the parent may be
+# in the middle of a transaction on it) nor close it: closing releases the
+# POSIX locks SQLite holds on the database file, and those locks belong to the
+# whole process, so the parent would lose them. The child abandons such
+# connections instead, keeping them referenced (so CPython never closes them
+# when the owner drops them) and unused, and opens its own.
+
+# Connections inherited across fork(), kept open and unused for the life of the child
+_inherited_connections = []
+
+
+def register(reopen):
+    """Call `reopen` in every forked child; it should abandon() the inherited connections and open new ones"""
+    os.register_at_fork(after_in_child=reopen)
+
+
+def abandon(connection):
+    """Keep a connection inherited across fork() open and unused for the life of this process"""
+    if connection is not None:
+        _inherited_connections.append(connection)
@@ -0,0 +1,173 @@
+import math
+from array import array
+from track_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the BM25 index works without it
+    np = None
+
+# Per-field weights (Track attributes), matching the BM25 index
+FIELD_WEIGHTS = (
+    ('search_name', 3.0),
+    ('search_tags', 2.0),
+    ('bpm', 1.0),
+)
+
+
+def featurize(text: str, ngram_sizes=(3, 4)) -> dict:
+    """Word tokens plus character n-grams of each word, with raw counts"""
+    features = {}
+    for token in tokenize(text):
+        key = "w:" + token
+        features[key] = features.get(key, 0) + 1
+        padded = f" {token} "
+        for size in ngram_sizes:
+            for start in range(len(padded) - size + 1):
+                key = "c:" + padded[start:start + size]
+                features[key] = features.get(key, 0) + 1
+    return features
+
+
+class TfidfIndex:
+    """Sparse TF-IDF matrix (word + char n-gram features) over the catalog, scored with NumPy
+
+    The matrix is stored column-major (feature -> rows) so a query only
+    touches the columns of its own features; scoring is one gather plus a
+    weighted bincount over the catalog, and top-k uses argpartition.
+    """
+
+    def __init__(self, tracks: list, max_df: float = 0.5):
+        if np is None:
+            raise RuntimeError("The TF-IDF retrieval engine requires NumPy")
+        self.size = len(tracks)
+        self.vocabulary = {}
+        self._build(tracks, max_df)
+
+    def _build(self, tracks: list, max_df: float):
+        rows = array('i')
+        cols = array('i')
+        values = array('f')
+        vocabulary = self.vocabulary
+
+        for position, track in enumerate(tracks):
+            weighted = {}
+            for field, weight in FIELD_WEIGHTS:
+                value = getattr(track, field)
+                if value is None:
+                    continue
+                for feature, count in featurize(str(value)).items():
+                    weighted[feature] = weighted.get(feature, 0.0) + weight * count
+            for feature, tf in weighted.items():
+                column = vocabulary.setdefault(feature, len(vocabulary))
+                rows.append(position)
+                cols.append(column)
+                values.append(1.0 + math.log(tf))
+
+        rows = np.frombuffer(rows, dtype=np.int32)
+        cols = np.frombuffer(cols, dtype=np.int32)
+        values = np.frombuffer(values, dtype=np.float32).copy()
+        vocabulary_size = len(vocabulary)
+
+        # Smoothed IDF; features in more than max_df of the catalog carry no signal and are dropped
+        df = np.bincount(cols, minlength=vocabulary_size)
+        self.idf = (np.log((1 + self.size) / (1 + df)) + 1).astype(np.float32)
+        self.idf[df > max(1, max_df * self.size)] = 0.0
+        values *= self.idf[cols]
+
+        # L2-normalize each track's row
+        norms = np.sqrt(np.bincount(rows, weights=values.astype(np.float64) ** 2, minlength=self.size))
+        norms[norms == 0] = 1.0
+        values /= norms[rows].astype(np.float32)
+
+        # Column-major layout: rows and values for feature j live in indptr[j]:indptr[j + 1]
+        order = np.argsort(cols, kind='stable')
+        self.col_rows = rows[order]
+        self.col_values = values[order]
+        self.indptr = np.zeros(vocabulary_size + 1, dtype=np.int64)
+        np.cumsum(df, out=self.indptr[1:])
+
+    def _query_vector(self, query: str):
+        """Sparse (columns, weights) TF-IDF vector for a query, L2-normalized"""
+        columns = []
+        weights = []
+        for feature, count in featurize(query).items():
+            column = self.vocabulary.get(feature)
+            if column is None or self.idf[column] == 0.0:
+                continue
+            columns.append(column)
+            weights.append((1.0 + math.log(count)) * self.idf[column])
+        if not columns:
+            return None, None
+        weights = np.asarray(weights, dtype=np.float32)
+        weights /= np.linalg.norm(weights)
+        return np.asarray(columns, dtype=np.int64), weights
+
+    def _gather(self, columns, weights):
+        """Rows and weighted values of the matrix columns touched by a query vector"""
+        starts = self.indptr[columns]
+        lengths = self.indptr[columns + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return None, None
+        # Vectorized concatenation of the column slices
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return self.col_rows[offsets], self.col_values[offsets] * np.repeat(weights, lengths)
+
+    @staticmethod
+    def _top_k(scores, limit: int) -> list:
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        # Sort by score, ties in catalog order
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(position), float(scores[position])) for position in candidates]
+
+    def search(self, query: str, limit: int = 15, allowed=None) -> list:
+        """Return (position, score) pairs for the top `limit` tracks by cosine similarity
+
+        `allowed`, if given, is a FacetMask; other tracks are zeroed before top-k.
+        """
+        columns, weights = self._query_vector(query)
+        if columns is None:
+            return []
+        rows, contributions = self._gather(columns, weights)
+        if rows is None:
+            return []
+        scores = np.bincount(rows, weights=contributions, minlength=self.size)
+        if allowed is not None:
+            scores *= allowed.as_array()
+        return self._top_k(scores, limit)
+
+    def search_batch(self, queries: list, limit: int = 15, max_cells: int = 1 << 21, allowed=None) -> list:
+        """Score many queries together, one weighted bincount per chunk of queries
+
+        `allowed`, if given, holds one FacetMask (or None) per query.
+        """
+        results = [[] for _ in queries]
+        chunk_size = max(1, max_cells // max(1, self.size))
+        for chunk_start in range(0, len(queries), chunk_size):
+            chunk = range(chunk_start, min(len(queries), chunk_start + chunk_size))
+            all_rows = []
+            all_contributions = []
+            for slot, query_number in enumerate(chunk):
+                columns, weights = self._query_vector(queries[query_number])
+                if columns is None:
+                    continue
+                rows, contributions = self._gather(columns, weights)
+                if rows is None:
+                    continue
+                all_rows.append(rows.astype(np.int64) + slot * self.size)
+                all_contributions.append(contributions)
+            if not all_rows:
+                continue
+            scores = np.bincount(
+                np.concatenate(all_rows),
+                weights=np.concatenate(all_contributions),
+                minlength=len(chunk) * self.size
+            ).reshape(len(chunk), self.size)
+            for slot, query_number in enumerate(chunk):
+                if allowed is not None and allowed[query_number] is not None:
+                    scores[slot] *= allowed[query_number].as_array()
+                results[query_number] = self._top_k(scores[slot], limit)
+        return results
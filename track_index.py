@@ -0,0 +1,108 @@
+import heapq
+import math
+import re
+from array import array
+from collections import defaultdict
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Per-field weights (Track attributes) used when folding a track into one BM25 document
+FIELD_WEIGHTS = (
+    ('search_name', 3.0),
+    ('search_tags', 2.0),
+    ('bpm', 1.0),
+)
+
+
+def tokenize(text: str) -> list:
+    """Lowercase text and split it into normalized search tokens"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        # Light plural folding so "reels" finds "reel"
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class TrackIndex:
+    """Inverted token index over the track catalog with BM25F-style scoring
+
+    Postings are stored per token as parallel arrays of track positions and
+    precomputed BM25 contributions, sorted by contribution so a query only
+    has to walk the highest-impact entries of each list.
+    """
+
+    def __init__(self, tracks: list, k1: float = 1.2, b: float = 0.75, max_postings: int = 10000):
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        self.size = len(tracks)
+        self.postings = self._build(tracks)
+
+    def _build(self, tracks: list) -> dict:
+        """Build impact-ordered posting lists for every token in the catalog"""
+        term_freqs = defaultdict(list)
+        doc_lengths = []
+
+        for position, track in enumerate(tracks):
+            weighted = defaultdict(float)
+            length = 0.0
+            for field, weight in FIELD_WEIGHTS:
+                value = getattr(track, field)
+                if value is None:
+                    continue
+                for token in tokenize(str(value)):
+                    weighted[token] += weight
+                    length += weight
+            doc_lengths.append(length)
+            for token, tf in weighted.items():
+                term_freqs[token].append((position, tf))
+
+        if not doc_lengths:
+            return {}
+
+        avg_length = (sum(doc_lengths) / len(doc_lengths)) or 1.0
+        postings = {}
+        for token, entries in term_freqs.items():
+            idf = math.log(1 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            scored = []
+            for position, tf in entries:
+                norm = self.k1 * (1 - self.b + self.b * doc_lengths[position] / avg_length)
+                scored.append((idf * tf * (self.k1 + 1) / (tf + norm), position))
+            # Highest impact first; ties keep catalog order
+            scored.sort(key=lambda entry: (-entry[0], entry[1]))
+            postings[token] = (
+                array('I', [position for _, position in scored]),
+                array('f', [score for score, _ in scored]),
+            )
+        return postings
+
+    def search(self, query: str, limit: int = 15, allowed=None) -> list:
+        """Return (position, score) pairs for the top `limit` tracks matching query
+
+        `allowed`, if given, is a set-like of positions (e.g. a FacetMask);
+        other tracks are skipped before scoring.
+        """
+        scores = {}
+        get = scores.get
+        for token in set(tokenize(query)):
+            entry = self.postings.get(token)
+            if entry is None:
+                continue
+            positions, impacts = entry
+            if allowed is None:
+                for position, impact in zip(positions[:self.max_postings], impacts[:self.max_postings]):
+                    scores[position] = get(position, 0.0) + impact
+                continue
+            # Walk past filtered-out entries so a narrow filter still gets max_postings candidates
+            taken = 0
+            for position, impact in zip(positions, impacts):
+                if position in allowed:
+                    scores[position] = get(position, 0.0) + impact
+                    taken += 1
+                    if taken >= self.max_postings:
+                        break
+
+        top = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        return [(position, scores[position]) for position in top]